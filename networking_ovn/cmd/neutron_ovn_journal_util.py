@@ -0,0 +1,87 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_config import cfg
+from oslo_db import options as db_options
+from oslo_log import log as logging
+
+from neutron import context
+
+from networking_ovn._i18n import _, _LE, _LI
+from networking_ovn.db import journal as journal_db
+
+LOG = logging.getLogger(__name__)
+
+journal_opts = [
+    cfg.BoolOpt('retry',
+                default=False,
+                help=_('Put back the failed journal entries in the pending '
+                       'state, for the OVN workers to apply them again.')),
+    cfg.BoolOpt('delete',
+                default=False,
+                help=_('Delete the failed journal entries. Their changes '
+                       'are lost, run neutron-ovn-db-sync-util afterwards '
+                       'to synchronize the OVN_Northbound DB.')),
+    cfg.MultiStrOpt('resource-id',
+                    default=[],
+                    help=_('Only handle the failed journal entries of this '
+                           'resource, can be repeated. Defaults to all the '
+                           'failed entries.')),
+]
+
+
+def setup_conf():
+    conf = cfg.CONF
+    db_group, neutron_db_opts = db_options.list_opts()[0]
+    cfg.CONF.register_cli_opts(neutron_db_opts, db_group)
+    cfg.CONF.register_cli_opts(journal_opts)
+    return conf
+
+
+def main():
+    """Main method for handling the failed OVN journal entries.
+
+    The journal entries which failed to be applied ovn_journal_max_retries
+    times block the later changes of their resources. The utility lists
+    them, and retries or deletes them.
+    """
+    conf = setup_conf()
+
+    # if no config file is passed or no configuration options are passed
+    # then load configuration from /etc/neutron/neutron.conf
+    try:
+        conf(project='neutron')
+    except TypeError:
+        LOG.error(_LE('Error parsing the configuration values. '
+                      'Please verify.'))
+        return
+
+    logging.setup(conf, 'neutron_ovn_journal_util')
+    if conf.retry and conf.delete:
+        LOG.error(_LE('The --retry and --delete options are exclusive.'))
+        return
+
+    session = context.get_admin_context().session
+    resource_ids = conf.resource_id or None
+    for row in journal_db.get_failed_rows(session, resource_ids):
+        LOG.info(_LI('Failed journal entry %(seqnum)s: %(op)s of %(type)s '
+                     '%(uuid)s, created at %(created_at)s'),
+                 {'seqnum': row.seqnum, 'op': row.operation,
+                  'type': row.object_type, 'uuid': row.object_uuid,
+                  'created_at': row.created_at})
+
+    if conf.retry:
+        count = journal_db.retry_failed_rows(session, resource_ids)
+        LOG.info(_LI('%d failed journal entries will be retried'), count)
+    elif conf.delete:
+        count = journal_db.delete_failed_rows(session, resource_ids)
+        LOG.info(_LI('%d failed journal entries deleted'), count)
@@ -0,0 +1,77 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from networking_ovn._i18n import _, _LE, _LI
+from networking_ovn.common import config as ovn_config
+from networking_ovn.l3 import l3_ovn_scheduler
+from networking_ovn.ovsdb import impl_idl_ovn
+
+LOG = logging.getLogger(__name__)
+
+rebalance_opts = [
+    cfg.BoolOpt('dry-run',
+                default=False,
+                help=_('Only report the gateway routers which would be '
+                       'moved.')),
+    cfg.IntOpt('max-moves',
+               min=0,
+               help=_('Maximum number of gateway routers moved, defaults to '
+                      'the ovn_l3_rebalance_max_moves option. 0 means no '
+                      'limit.')),
+]
+
+
+def setup_conf():
+    conf = cfg.CONF
+    ovn_group, ovn_opts = ovn_config.list_opts()[0]
+    cfg.CONF.register_cli_opts(ovn_opts, group=ovn_group)
+    cfg.CONF.register_cli_opts(rebalance_opts)
+    return conf
+
+
+def main():
+    """Main method for rebalancing the gateway routers of the chassis.
+
+    The utility moves gateway routers from the most loaded chassis to the
+    least loaded ones, in batches, using the configured L3 scheduler.
+    """
+    conf = setup_conf()
+
+    # if no config file is passed or no configuration options are passed
+    # then load configuration from /etc/neutron/neutron.conf
+    try:
+        conf(project='neutron')
+    except TypeError:
+        LOG.error(_LE('Error parsing the configuration values. '
+                      'Please verify.'))
+        return
+
+    logging.setup(conf, 'neutron_ovn_rebalance_util')
+
+    try:
+        nb_idl = impl_idl_ovn.OvsdbNbOvnIdl(None)
+        sb_idl = impl_idl_ovn.OvsdbSbOvnIdl(None)
+    except impl_idl_ovn.OvsdbConnectionUnavailable:
+        LOG.error(_LE('Unable to connect to the OVN databases, check the '
+                      'ovn_nb_connection and ovn_sb_connection values.'))
+        return
+
+    scheduler = l3_ovn_scheduler.get_scheduler()
+    moves = scheduler.rebalance(nb_idl, sb_idl, max_moves=conf.max_moves,
+                                dry_run=conf.dry_run)
+    if conf.dry_run:
+        LOG.info(_LI('%d gateway routers would be moved'), len(moves))
+    else:
+        LOG.info(_LI('%d gateway routers moved'), len(moves))
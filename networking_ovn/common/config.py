@@ -55,12 +55,39 @@ ovn_opts = [
                        'routers.')),
     cfg.StrOpt("ovn_l3_scheduler",
                default='leastloaded',
-               choices=('leastloaded', 'chance'),
+               choices=('leastloaded', 'chance', 'weighted'),
                help=_('The OVN L3 Scheduler type used to schedule router '
                       'gateway ports on hypervisors/chassis. \n'
                       'leastloaded - chassis with fewest gateway ports '
                       'selected \n'
-                      'chance - chassis randomly selected')),
+                      'chance - chassis randomly selected \n'
+                      'weighted - chassis with fewest gateway ports relative '
+                      'to the weight set in the ovn-gateway-weight key of '
+                      'their external_ids selected')),
+    cfg.BoolOpt('ovn_l3_rebalance_on_chassis_join',
+                default=False,
+                help=_('Whether to move gateway routers to the chassis '
+                       'joining the OVN_Southbound DB, to even out the load '
+                       'of the chassis. Moving a gateway router drops its '
+                       'connection tracking state.')),
+    cfg.IntOpt('ovn_l3_rebalance_max_moves',
+               default=100,
+               min=0,
+               help=_('Maximum number of gateway routers moved by a '
+                      'rebalancing of the gateway routers. 0 means no '
+                      'limit.')),
+    cfg.IntOpt('ovn_l3_rebalance_batch_size',
+               default=10,
+               min=1,
+               help=_('Number of gateway routers moved in each OVN '
+                      'Northbound DB transaction when rebalancing the '
+                      'gateway routers.')),
+    cfg.FloatOpt('ovn_l3_rebalance_batch_interval',
+                 default=1.0,
+                 min=0,
+                 help=_('Time in seconds to wait between two batches of '
+                        'gateway routers moved when rebalancing the gateway '
+                        'routers.')),
     cfg.StrOpt("vif_type",
                deprecated_for_removal=True,
                deprecated_reason="The port VIF type is now determined based "
@@ -84,6 +111,132 @@ ovn_opts = [
                default=(12 * 60 * 60),
                help=_('Default least time (in seconds ) to use when '
                       'ovn_native_dhcp is enabled.')),
+    cfg.IntOpt('ovn_event_lock_shards',
+               default=0,
+               min=0,
+               help=_('Number of shards the OVN_Northbound and '
+                      'OVN_Southbound DB events are partitioned into. Each '
+                      'shard is protected by its own OVSDB lock, so that '
+                      'the events are handled by several neutron servers. '
+                      'Logical_Switch_Port rows are assigned to a shard by '
+                      'hashing their name, the events of the other tables, '
+                      'e.g. Chassis, are handled by the holder of the first '
+                      'shard. The ports of a shard are synced when a '
+                      'neutron server acquires it. If set to 0, a single '
+                      'lock is used and all the events are handled by one '
+                      'neutron server.')),
+    cfg.IntOpt('ovn_event_lock_shards_per_server',
+               default=0,
+               min=0,
+               help=_('Maximum number of event shards a neutron server '
+                      'tries to keep. The extra shard locks are released '
+                      'and requested again, so that the other neutron '
+                      'servers waiting for them can take them over. A '
+                      'shard lock granted back because no other server '
+                      'was waiting for it is kept. 0 means no limit. Only '
+                      'used when ovn_event_lock_shards is set.')),
+    cfg.StrOpt('ovn_metrics_sink',
+               help=_('Class implementing '
+                      'networking_ovn.common.metrics.MetricsSink the '
+                      'metrics (latencies and durations) are forwarded to. '
+                      'The metrics are always kept in in-memory '
+                      'histograms, logged when the neutron-server process '
+                      'receives SIGUSR1.')),
+    cfg.FloatOpt('ovn_event_handler_slow_threshold',
+                 default=5.0,
+                 min=0,
+                 help=_('Time in seconds after which a handler of an '
+                        'OVN_Northbound or OVN_Southbound DB event is '
+                        'considered slow and the event and the stack of '
+                        'the handler are logged. 0 disables the check.')),
+    cfg.IntOpt('ovn_port_activation_tracker_size',
+               default=10000,
+               min=0,
+               help=_('Maximum number of new ports the time to activation '
+                      'is tracked for at once. The oldest ports are not '
+                      'tracked anymore when the limit is reached. The '
+                      'commit time of the new ports is stamped in their '
+                      'external_ids for the tracking. 0 disables the '
+                      'tracking of the port activation latency.')),
+    cfg.BoolOpt('ovn_journal',
+                default=False,
+                help=_('Whether the changes of the networks, ports and '
+                       'routers are recorded in a journal in the neutron '
+                       'DB, in the same transaction as the change itself, '
+                       'and applied to the OVN_Northbound DB in the '
+                       'background by the OVN worker, instead of being '
+                       'written to the OVN_Northbound DB before the API '
+                       'call returns.')),
+    cfg.IntOpt('ovn_journal_batch_size',
+               default=100,
+               min=1,
+               help=_('Maximum number of journal entries processed at '
+                      'once by the OVN worker.')),
+    cfg.IntOpt('ovn_journal_max_retries',
+               default=5,
+               min=0,
+               help=_('Number of times the OVN worker retries to apply a '
+                      'journal entry before marking it as failed.')),
+    cfg.FloatOpt('ovn_journal_poll_interval',
+                 default=1.0,
+                 min=0.1,
+                 help=_('Time in seconds between two polls of the journal '
+                        'by the OVN worker when it has no pending entry.')),
+    cfg.FloatOpt('ovn_journal_retry_interval',
+                 default=10.0,
+                 min=0,
+                 help=_('Time in seconds the OVN worker waits before retrying '
+                        'to apply a journal entry which failed to be '
+                        'applied. The later entries of the same resource '
+                        'wait along with it.')),
+    cfg.IntOpt('ovn_txn_group_size',
+               default=1,
+               min=1,
+               help=_('Maximum number of OVN_Northbound DB transactions, '
+                      'queued at the same time by different requests, '
+                      'committed together in a single OVSDB transaction. '
+                      'The commands of the grouped transactions are '
+                      'committed again separately if one of them fails. '
+                      'The default, 1, disables the grouping of the '
+                      'transactions.')),
+    cfg.FloatOpt('ovn_background_txn_rate',
+                 default=0,
+                 min=0,
+                 help=_('Maximum number of background OVN_Northbound DB '
+                        'transactions (DB sync, routers rescheduling, QoS '
+                        'policy updates of the networks...) committed per '
+                        'second by each connection. The transactions of the '
+                        'API requests are always committed first. The '
+                        'default, 0, disables the limit.')),
+    cfg.IntOpt('ovn_txn_max_size',
+               default=1000,
+               min=0,
+               help=_('Maximum number of ports of the ACL updates, of '
+                      'addresses of the address set updates or of DHCP '
+                      'options rows in an OVN_Northbound DB transaction. '
+                      'A larger transaction made only of such commands is '
+                      'committed in several transactions, each one within '
+                      'ovsdb_connection_timeout. 0 disables the split.')),
+    cfg.FloatOpt('ovn_txn_slow_threshold',
+                 default=5.0,
+                 min=0,
+                 help=_('Time in seconds after which an OVN_Northbound DB '
+                        'transaction is considered slow and its commands and '
+                        'the time spent waiting in the queue, running each '
+                        'class of command and committing it are logged. 0 '
+                        'disables the check.')),
+    cfg.FloatOpt('ovn_qos_cache_timeout',
+                 default=0,
+                 min=0,
+                 help=_('Time in seconds the QoS options of the policies '
+                        'and the QoS policies of the networks are cached by '
+                        'each neutron server process. The cache of the '
+                        'process notified of a change is updated at once, '
+                        'the other processes may use the previous QoS '
+                        'options of new ports for up to this time, so only '
+                        'enable it if a single neutron server process '
+                        'handles the QoS changes or if such a delay is '
+                        'acceptable. 0, the default, disables the cache.')),
 ]
 
 cfg.CONF.register_opts(ovn_opts, group='ovn')
@@ -115,6 +268,22 @@ def is_ovn_l3():
     return cfg.CONF.ovn.ovn_l3_mode
 
 
+def is_ovn_l3_rebalance_on_chassis_join():
+    return cfg.CONF.ovn.ovn_l3_rebalance_on_chassis_join
+
+
+def get_ovn_l3_rebalance_max_moves():
+    return cfg.CONF.ovn.ovn_l3_rebalance_max_moves
+
+
+def get_ovn_l3_rebalance_batch_size():
+    return cfg.CONF.ovn.ovn_l3_rebalance_batch_size
+
+
+def get_ovn_l3_rebalance_batch_interval():
+    return cfg.CONF.ovn.ovn_l3_rebalance_batch_interval
+
+
 def get_ovn_l3_scheduler():
     return cfg.CONF.ovn.ovn_l3_scheduler
 
@@ -129,3 +298,63 @@ def is_ovn_dhcp():
 
 def get_ovn_dhcp_default_lease_time():
     return cfg.CONF.ovn.dhcp_default_lease_time
+
+
+def get_ovn_event_lock_shards():
+    return cfg.CONF.ovn.ovn_event_lock_shards
+
+
+def get_ovn_event_lock_shards_per_server():
+    return cfg.CONF.ovn.ovn_event_lock_shards_per_server
+
+
+def get_ovn_metrics_sink():
+    return cfg.CONF.ovn.ovn_metrics_sink
+
+
+def get_ovn_event_handler_slow_threshold():
+    return cfg.CONF.ovn.ovn_event_handler_slow_threshold
+
+
+def get_ovn_port_activation_tracker_size():
+    return cfg.CONF.ovn.ovn_port_activation_tracker_size
+
+
+def is_ovn_journal():
+    return cfg.CONF.ovn.ovn_journal
+
+
+def get_ovn_journal_batch_size():
+    return cfg.CONF.ovn.ovn_journal_batch_size
+
+
+def get_ovn_journal_max_retries():
+    return cfg.CONF.ovn.ovn_journal_max_retries
+
+
+def get_ovn_journal_poll_interval():
+    return cfg.CONF.ovn.ovn_journal_poll_interval
+
+
+def get_ovn_journal_retry_interval():
+    return cfg.CONF.ovn.ovn_journal_retry_interval
+
+
+def get_ovn_txn_group_size():
+    return cfg.CONF.ovn.ovn_txn_group_size
+
+
+def get_ovn_background_txn_rate():
+    return cfg.CONF.ovn.ovn_background_txn_rate
+
+
+def get_ovn_txn_max_size():
+    return cfg.CONF.ovn.ovn_txn_max_size
+
+
+def get_ovn_txn_slow_threshold():
+    return cfg.CONF.ovn.ovn_txn_slow_threshold
+
+
+def get_ovn_qos_cache_timeout():
+    return cfg.CONF.ovn.ovn_qos_cache_timeout
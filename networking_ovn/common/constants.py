@@ -16,6 +16,7 @@ import six
 OVN_ML2_MECH_DRIVER_NAME = 'ovn'
 OVN_NETWORK_NAME_EXT_ID_KEY = 'neutron:network_name'
 OVN_PORT_NAME_EXT_ID_KEY = 'neutron:port_name'
+OVN_PORT_CREATED_AT_EXT_ID_KEY = 'neutron:created_at'
 OVN_ROUTER_NAME_EXT_ID_KEY = 'neutron:router_name'
 OVN_SG_NAME_EXT_ID_KEY = 'neutron:security_group_name'
 OVN_PHYSNET_EXT_ID_KEY = 'neutron:provnet-physical-network'
@@ -27,6 +28,9 @@ OVN_PORT_BINDING_PROFILE_PARAMS = [{'parent_name': six.string_types,
                                    {'vtep-physical-switch': six.string_types,
                                     'vtep-logical-switch': six.string_types}]
 
+# Keys of the Logical_Switch_Port options set from the QoS policy
+OVN_QOS_OPTIONS_KEYS = ('policing_rate', 'policing_burst')
+
 # OVN ACLs have priorities.  The highest priority ACL that matches is the one
 # that takes effect.  Our choice of priority numbers is arbitrary, but it
 # leaves room above and below the ACLs we create.  We only need two priorities.
@@ -45,6 +49,11 @@ ACL_ACTION_ALLOW = 'allow'
 # unhosted router gateways to schedule.
 OVN_GATEWAY_INVALID_CHASSIS = 'neutron-ovn-invalid-chassis'
 
+# Key of the external_ids of a Chassis holding its capacity to host gateway
+# routers, relative to the other chassis, for the weighted scheduler.
+OVN_GATEWAY_WEIGHT_EXT_ID_KEY = 'ovn-gateway-weight'
+OVN_GATEWAY_DEFAULT_WEIGHT = 1.0
+
 SUPPORTED_DHCP_OPTS = [
     'netmask', 'router', 'dns-server', 'log-server',
     'lpr-server', 'swap-server', 'ip-forward-enable',
@@ -53,5 +62,22 @@ SUPPORTED_DHCP_OPTS = [
     'tcp-ttl', 'tcp-keepalive', 'nis-server', 'ntp-server',
     'tftp-server']
 
+# Maximum number of ports created in a single OVN_Northbound DB transaction
+# when ports are created in bulk.
+OVN_BULK_PORTS_PER_TXN = 100
+
+# Journal entries
+OVN_JOURNAL_NETWORK = 'network'
+OVN_JOURNAL_PORT = 'port'
+OVN_JOURNAL_ROUTER = 'router'
+OVN_JOURNAL_ROUTER_INTERFACE = 'router_interface'
+OVN_JOURNAL_CREATE = 'create'
+OVN_JOURNAL_UPDATE = 'update'
+OVN_JOURNAL_DELETE = 'delete'
+
+OVN_JOURNAL_PENDING = 'pending'
+OVN_JOURNAL_PROCESSING = 'processing'
+OVN_JOURNAL_FAILED = 'failed'
+
 CHASSIS_DATAPATH_NETDEV = 'netdev'
 CHASSIS_IFACE_DPDKVHOSTUSER = 'dpdkvhostuser'
@@ -0,0 +1,258 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from eventlet import greenthread
+from neutron import context as n_context
+from neutron import manager
+from neutron.plugins.common import constants as service_constants
+from oslo_log import log
+from oslo_utils import timeutils
+
+from networking_ovn._i18n import _LE, _LW
+from networking_ovn.common import config
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.common import metrics
+from networking_ovn.db import journal as journal_db
+
+LOG = log.getLogger(__name__)
+
+
+class JournalProcessor(object):
+    """Apply the journal entries to the OVN_Northbound DB
+
+    The processor runs in the OVN worker. It claims the oldest pending
+    journal entries in batches and applies them in order. Consecutive
+    entries which can be applied together are grouped: the creations of
+    ports are done in as few transactions as possible, and the consecutive
+    updates of a resource are applied as a single update.
+
+    An entry which fails to be applied is retried after
+    ovn_journal_retry_interval seconds, as well as the following entries of
+    the same resource in the batch, up to ovn_journal_max_retries times.
+    """
+
+    # Time in seconds after which the entries claimed by a neutron server
+    # and not processed yet are considered abandoned.
+    STALE_TIMEOUT = 300
+
+    def __init__(self, driver):
+        self._driver = driver
+        self._thread = None
+        self._handlers = {
+            (ovn_const.OVN_JOURNAL_NETWORK, ovn_const.OVN_JOURNAL_CREATE):
+                self._create_network,
+            (ovn_const.OVN_JOURNAL_NETWORK, ovn_const.OVN_JOURNAL_DELETE):
+                self._delete_network,
+            (ovn_const.OVN_JOURNAL_PORT, ovn_const.OVN_JOURNAL_DELETE):
+                self._delete_port,
+            (ovn_const.OVN_JOURNAL_ROUTER, ovn_const.OVN_JOURNAL_CREATE):
+                self._create_router,
+            (ovn_const.OVN_JOURNAL_ROUTER, ovn_const.OVN_JOURNAL_UPDATE):
+                self._update_router,
+            (ovn_const.OVN_JOURNAL_ROUTER, ovn_const.OVN_JOURNAL_DELETE):
+                self._delete_router,
+            (ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+             ovn_const.OVN_JOURNAL_CREATE): self._create_router_interface,
+            (ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+             ovn_const.OVN_JOURNAL_UPDATE): self._update_router_interface,
+            (ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+             ovn_const.OVN_JOURNAL_DELETE): self._delete_router_interface,
+        }
+        # Handlers applying several consecutive entries at once
+        self._batch_handlers = {
+            (ovn_const.OVN_JOURNAL_NETWORK, ovn_const.OVN_JOURNAL_UPDATE):
+                self._update_network,
+            (ovn_const.OVN_JOURNAL_PORT, ovn_const.OVN_JOURNAL_CREATE):
+                self._create_ports,
+            (ovn_const.OVN_JOURNAL_PORT, ovn_const.OVN_JOURNAL_UPDATE):
+                self._update_port,
+        }
+
+    @property
+    def _l3_plugin(self):
+        return manager.NeutronManager.get_service_plugins().get(
+            service_constants.L3_ROUTER_NAT)
+
+    def start(self):
+        self._thread = greenthread.spawn(self._run)
+
+    def _run(self):
+        next_reset = 0
+        while True:
+            processed = 0
+            try:
+                if time.time() >= next_reset:
+                    journal_db.reset_stale_rows(
+                        n_context.get_admin_context().session,
+                        self.STALE_TIMEOUT)
+                    next_reset = time.time() + self.STALE_TIMEOUT
+                processed = self.process()
+            except Exception:
+                # The journal would no longer be applied if the thread
+                # exited.
+                LOG.exception(_LE('Unexpected exception processing the OVN '
+                                  'journal'))
+            if processed:
+                greenthread.sleep(0)
+            else:
+                greenthread.sleep(config.get_ovn_journal_poll_interval())
+
+    def process(self):
+        """Claim and apply a batch of pending journal entries
+
+        :returns: The number of entries applied
+        """
+        session = n_context.get_admin_context().session
+        rows = journal_db.claim_pending_rows(
+            session, config.get_ovn_journal_batch_size(),
+            config.get_ovn_journal_retry_interval())
+        # Resources of the entries put back in the pending state, their
+        # following entries are put back too to be applied in order.
+        failed = set()
+        applied = 0
+        for group in self._group_rows(rows):
+            if failed.intersection(row.object_uuid for row in group):
+                applied += self._apply_rows(session, group, failed)
+            else:
+                applied += self._apply_group(session, group, failed)
+        return applied
+
+    def _get_group_key(self, row):
+        key = (row.object_type, row.operation)
+        if key not in self._batch_handlers:
+            return None
+        if row.operation == ovn_const.OVN_JOURNAL_UPDATE:
+            # Only the updates of the same resource are merged
+            return key + (row.object_uuid,)
+        return key
+
+    def _group_rows(self, rows):
+        groups = []
+        group_key = None
+        for row in rows:
+            key = self._get_group_key(row)
+            if groups and key is not None and key == group_key:
+                groups[-1].append(row)
+            else:
+                groups.append([row])
+            group_key = key
+        return groups
+
+    def _apply_group(self, session, rows, failed):
+        if len(rows) == 1:
+            return self._apply_rows(session, rows, failed)
+        try:
+            self._apply(rows)
+        except Exception:
+            LOG.warning(_LW('Failed to apply %(count)d %(type)s %(op)s '
+                            'journal entries at once, applying them one '
+                            'by one'),
+                        {'count': len(rows), 'type': rows[0].object_type,
+                         'op': rows[0].operation})
+            return self._apply_rows(session, rows, failed)
+        journal_db.delete_rows(session, rows)
+        return len(rows)
+
+    def _apply_rows(self, session, rows, failed):
+        applied = 0
+        for row in rows:
+            if row.object_uuid in failed:
+                journal_db.release_row(session, row)
+                continue
+            try:
+                self._apply([row])
+            except Exception:
+                failed.add(row.object_uuid)
+                if journal_db.retry_row(session, row,
+                                        config.get_ovn_journal_max_retries()):
+                    LOG.warning(_LW('Failed to apply the %(op)s of %(type)s '
+                                    '%(uuid)s, it will be retried'),
+                                {'op': row.operation,
+                                 'type': row.object_type,
+                                 'uuid': row.object_uuid})
+                else:
+                    LOG.exception(_LE('Failed to apply the %(op)s of '
+                                      '%(type)s %(uuid)s, giving up'),
+                                  {'op': row.operation,
+                                   'type': row.object_type,
+                                   'uuid': row.object_uuid})
+            else:
+                journal_db.delete_rows(session, [row])
+                applied += 1
+        return applied
+
+    def _apply(self, rows):
+        key = (rows[0].object_type, rows[0].operation)
+        data = [journal_db.get_row_data(row) for row in rows]
+        started_at = time.time()
+        if key in self._batch_handlers:
+            self._batch_handlers[key](data)
+        else:
+            self._handlers[key](data[0])
+        metrics.observe('ovn_journal_apply.%s_%s' % key,
+                        time.time() - started_at)
+        now = timeutils.utcnow()
+        for row in rows:
+            # Time between the change in the neutron DB and in OVN
+            metrics.observe('ovn_journal_delay.%s_%s' % key,
+                            timeutils.delta_seconds(row.created_at, now))
+
+    def _create_network(self, network):
+        self._driver.create_network(network)
+
+    def _update_network(self, updates):
+        # Apply the successive updates of the network as a single one
+        self._driver.update_network(updates[-1]['current'],
+                                    updates[0]['original'])
+
+    def _delete_network(self, network):
+        self._driver.delete_network(network)
+
+    def _create_ports(self, ports):
+        self._driver.create_ports_in_ovn(
+            [(port, self._driver.get_ovn_port_options(port))
+             for port in ports])
+
+    def _update_port(self, updates):
+        # Apply the successive updates of the port as a single one
+        self._driver.update_port(updates[-1]['current'],
+                                 updates[0]['original'])
+
+    def _delete_port(self, port):
+        self._driver.delete_port(port)
+
+    def _create_router(self, router):
+        self._l3_plugin.create_lrouter_in_ovn(router)
+
+    def _update_router(self, changes):
+        self._l3_plugin.update_lrouter_in_ovn(
+            changes['router_id'], changes['update'], changes['added'],
+            changes['removed'])
+
+    def _delete_router(self, router):
+        self._l3_plugin.delete_lrouter_in_ovn(router['id'])
+
+    def _create_router_interface(self, interface):
+        self._l3_plugin.create_lrouter_port_in_ovn(
+            n_context.get_admin_context(), interface['router_id'],
+            interface['port'])
+
+    def _update_router_interface(self, interface):
+        self._l3_plugin.update_lrouter_port_in_ovn(
+            n_context.get_admin_context(), interface['router_id'],
+            interface['port'])
+
+    def _delete_router_interface(self, interface):
+        self._l3_plugin.delete_lrouter_port_in_ovn(
+            interface['router_id'], interface['port_id'])
@@ -0,0 +1,178 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+import bisect
+import collections
+import signal
+import threading
+
+from oslo_log import log
+from oslo_utils import importutils
+import six
+
+from networking_ovn._i18n import _LE, _LI
+from networking_ovn.common import config as ovn_config
+
+LOG = log.getLogger(__name__)
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60,
+                   float('inf'))
+
+# Number of the most recent samples kept to compute the percentiles
+DEFAULT_WINDOW = 1024
+
+PERCENTILES = (50, 90, 99)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class MetricsSink(object):
+    """Receives the metrics observed by networking-ovn
+
+    Implementations can be plugged with the ovn_metrics_sink configuration
+    option to forward the metrics to an external monitoring system.
+    """
+
+    @abc.abstractmethod
+    def observe(self, name, value):
+        """Record a value of a metric
+
+        :param name:   The name of the metric
+        :type name:    string
+        :param value:  The observed value, in seconds for durations
+        :type value:   float
+        """
+
+
+class Histogram(object):
+    """Histogram of the observed values of a metric
+
+    Besides the cumulative count of each bucket, the last window values are
+    kept in a bounded buffer to compute the percentiles.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            index = bisect.bisect_left(self.buckets, value)
+            self.counts[min(index, len(self.counts) - 1)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+            self.samples.append(value)
+
+    def percentiles(self, percentiles=PERCENTILES):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return dict((p, None) for p in percentiles)
+        return dict((p, samples[min(len(samples) - 1,
+                                    int(len(samples) * p / 100.0))])
+                    for p in percentiles)
+
+    def summary(self):
+        result = {'count': self.count,
+                  'sum': self.sum,
+                  'max': self.max,
+                  'buckets': list(zip(self.buckets, self.counts))}
+        for percentile, value in self.percentiles().items():
+            result['p%d' % percentile] = value
+        return result
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.histograms = {}
+        self.sink = None
+        self._lock = threading.Lock()
+
+    def get_histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, value):
+        self.get_histogram(name).observe(value)
+        if self.sink is not None:
+            try:
+                self.sink.observe(name, value)
+            except Exception:
+                LOG.exception(_LE('Metrics sink failed to observe %s'), name)
+
+    def dump(self):
+        return dict((name, histogram.summary())
+                    for name, histogram in self.histograms.items())
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+def observe(name, value):
+    """Record a value of a metric in the histograms and the sink"""
+    _registry.observe(name, value)
+
+
+def dump():
+    """Get the summary of all the histograms
+
+    :returns: dictionary of metric name to a dictionary with the count, sum,
+              max, percentiles and buckets of the metric
+    """
+    return _registry.dump()
+
+
+def log_dump(*args):
+    for name, summary in sorted(dump().items()):
+        LOG.info(_LI("Metric %(name)s: %(summary)s"),
+                 {'name': name, 'summary': summary})
+
+
+def load_sink():
+    sink_class = ovn_config.get_ovn_metrics_sink()
+    if sink_class and _registry.sink is None:
+        _registry.sink = importutils.import_object(sink_class)
+
+
+def register_dump_signal(signum=signal.SIGUSR1):
+    """Log the metrics when the process receives signum
+
+    The handler is only installed if no other handler is set for the
+    signal.
+    """
+    try:
+        if signal.getsignal(signum) != signal.SIG_DFL:
+            return False
+        signal.signal(signum, log_dump)
+    except ValueError:
+        # Not called from the main thread
+        return False
+    return True
@@ -55,6 +55,30 @@ def ovn_addrset_name(sg_id, ip_version):
     return ('as-%s-%s' % (ip_version, sg_id)).replace('-', '_')
 
 
+def get_static_route_changes(old_routes, new_routes):
+    """Get the static routes added and removed between two lists of routes
+
+    The routes are dictionaries with the destination and nexthop keys, they
+    are compared by (destination, nexthop).
+
+    :returns: tuple of the lists of the added and removed routes
+    """
+    old_keys = set((route['destination'], route['nexthop'])
+                   for route in old_routes)
+    new_keys = set((route['destination'], route['nexthop'])
+                   for route in new_routes)
+    added = [route for route in new_routes
+             if (route['destination'], route['nexthop']) not in old_keys]
+    removed = [route for route in old_routes
+               if (route['destination'], route['nexthop']) not in new_keys]
+    return added, removed
+
+
+def get_static_route_keys(routes):
+    """Get the (ip_prefix, nexthop) of routes, as used by OVN"""
+    return [(route['destination'], route['nexthop']) for route in routes]
+
+
 def get_lsp_dhcpv4_opts(port):
     # Get dhcpv4 options from Neutron port, for setting DHCP_Options row
     # in OVN.
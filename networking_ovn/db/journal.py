@@ -0,0 +1,262 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import sqlalchemy as sa
+
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.db import models
+
+
+def record(context, object_type, object_uuid, operation, data=None):
+    """Record a change of a resource in the journal
+
+    The row is added in the current transaction of the context, so that it
+    is only committed with the change of the resource itself.
+
+    :param context:      The neutron context of the change
+    :param object_type:  One of the ovn_const.OVN_JOURNAL_* object types
+    :param object_uuid:  The id of the changed resource
+    :param operation:    One of the ovn_const.OVN_JOURNAL_* operations
+    :param data:         The JSON serializable data needed to apply the
+                         change
+    """
+    row = models.OVNJournal(object_type=object_type,
+                            object_uuid=object_uuid,
+                            operation=operation,
+                            data=jsonutils.dumps(data),
+                            state=ovn_const.OVN_JOURNAL_PENDING,
+                            retry_count=0,
+                            created_at=timeutils.utcnow())
+    with context.session.begin(subtransactions=True):
+        context.session.add(row)
+    return row
+
+
+def get_row_data(row):
+    return jsonutils.loads(row.data) if row.data else None
+
+
+def get_parent_uuids(row):
+    """Get the ids of the resources the resource of a row depends on
+
+    A port depends on its network and a router interface on its router, the
+    router interface having the id of its port.
+    """
+    data = get_row_data(row) or {}
+    if row.object_type == ovn_const.OVN_JOURNAL_PORT:
+        # The data of the updates holds the current and original ports
+        parent = data.get('current', data).get('network_id')
+    elif row.object_type == ovn_const.OVN_JOURNAL_ROUTER_INTERFACE:
+        parent = data.get('router_id')
+    else:
+        parent = None
+    return set([parent]) if parent else set()
+
+
+class _Dependencies(object):
+    """Resources of the journal rows not applied yet"""
+
+    def __init__(self):
+        self.uuids = set()
+        self.parent_uuids = set()
+
+    def add(self, row):
+        self.uuids.add(row.object_uuid)
+        self.parent_uuids.update(get_parent_uuids(row))
+
+    def is_blocked(self, row):
+        """Whether a row has to wait for the rows already added
+
+        The changes of a resource wait for the creation or update of its
+        parents, and its deletion waits for the changes of its children.
+        """
+        if row.operation == ovn_const.OVN_JOURNAL_DELETE:
+            return row.object_uuid in self.parent_uuids
+        return bool(get_parent_uuids(row) & self.uuids)
+
+
+def claim_pending_rows(session, limit, retry_interval=0):
+    """Mark the oldest pending rows as processing and return them
+
+    A row is only claimed if all the older unprocessed rows of its resource
+    are claimed too, so that the changes of a resource are applied in order
+    even when several neutron servers process the journal. The rows of a
+    resource whose previous row failed are never claimed.
+
+    A row is also only claimed once the rows of the resources it depends on
+    are applied: a port after its network, a router interface after its
+    router, and the other way around for the deletions.
+
+    :param session:         A DB session
+    :param limit:           The maximum number of rows to claim
+    :param retry_interval:  Time in seconds before a row which failed to be
+                            applied is claimed again
+    :returns:               The claimed rows, oldest first
+    """
+    claimed = []
+    with session.begin(subtransactions=True):
+        now = timeutils.utcnow()
+        retry_after = now - datetime.timedelta(seconds=retry_interval)
+        waiting = sa.and_(
+            models.OVNJournal.state == ovn_const.OVN_JOURNAL_PENDING,
+            models.OVNJournal.retry_count > 0,
+            models.OVNJournal.last_retried > retry_after)
+        # The resources of the rows being applied, of the failed rows and
+        # of the rows waiting to be retried
+        busy = set()
+        unapplied = _Dependencies()
+        for row in session.query(models.OVNJournal).filter(sa.or_(
+                models.OVNJournal.state.in_(
+                    [ovn_const.OVN_JOURNAL_PROCESSING,
+                     ovn_const.OVN_JOURNAL_FAILED]), waiting)):
+            busy.add(row.object_uuid)
+            unapplied.add(row)
+        pending = session.query(models.OVNJournal).filter(
+            models.OVNJournal.state == ovn_const.OVN_JOURNAL_PENDING,
+            sa.not_(waiting)).order_by(models.OVNJournal.seqnum)
+        last_seqnum = None
+        while len(claimed) < limit:
+            # The rows which can't be claimed yet are skipped, they don't
+            # prevent the next rows from being claimed.
+            query = pending
+            if last_seqnum is not None:
+                query = query.filter(models.OVNJournal.seqnum > last_seqnum)
+            rows = query.limit(limit).all()
+            if not rows:
+                break
+            for row in rows:
+                if len(claimed) >= limit:
+                    break
+                last_seqnum = row.seqnum
+                if row.object_uuid in busy or unapplied.is_blocked(row):
+                    busy.add(row.object_uuid)
+                    unapplied.add(row)
+                    continue
+                # Another neutron server may have claimed the row meanwhile
+                count = session.query(models.OVNJournal).filter_by(
+                    seqnum=row.seqnum,
+                    state=ovn_const.OVN_JOURNAL_PENDING).update(
+                        {'state': ovn_const.OVN_JOURNAL_PROCESSING,
+                         'last_retried': now},
+                        synchronize_session=False)
+                # The rows claimed together are applied in order, but the
+                # rows of the children of a resource wait for it to be
+                # applied.
+                unapplied.add(row)
+                if not count:
+                    busy.add(row.object_uuid)
+                    continue
+                session.expunge(row)
+                claimed.append(row)
+    return claimed
+
+
+def delete_rows(session, rows):
+    """Delete the rows applied to the OVN_Northbound DB"""
+    if not rows:
+        return
+    with session.begin(subtransactions=True):
+        session.query(models.OVNJournal).filter(
+            models.OVNJournal.seqnum.in_([row.seqnum for row in rows])
+        ).delete(synchronize_session=False)
+
+
+def release_row(session, row):
+    """Put back a claimed row in the pending state, without retrying it"""
+    with session.begin(subtransactions=True):
+        session.query(models.OVNJournal).filter_by(
+            seqnum=row.seqnum).update(
+                {'state': ovn_const.OVN_JOURNAL_PENDING},
+                synchronize_session=False)
+
+
+def retry_row(session, row, max_retries):
+    """Put back a row which failed to be applied in the pending state
+
+    :returns: True if the row will be retried, False if it failed more
+              than max_retries times and is marked as failed
+    """
+    retry = row.retry_count < max_retries
+    state = (ovn_const.OVN_JOURNAL_PENDING if retry else
+             ovn_const.OVN_JOURNAL_FAILED)
+    with session.begin(subtransactions=True):
+        session.query(models.OVNJournal).filter_by(
+            seqnum=row.seqnum).update(
+                {'state': state, 'retry_count': row.retry_count + 1},
+                synchronize_session=False)
+    return retry
+
+
+def reset_stale_rows(session, timeout):
+    """Put back in the pending state the rows claimed too long ago
+
+    The rows claimed by a neutron server which stopped before processing
+    them would otherwise block the changes of their resources forever.
+
+    :returns: The number of rows put back in the pending state
+    """
+    limit = timeutils.utcnow() - datetime.timedelta(seconds=timeout)
+    with session.begin(subtransactions=True):
+        return session.query(models.OVNJournal).filter(
+            models.OVNJournal.state == ovn_const.OVN_JOURNAL_PROCESSING,
+            models.OVNJournal.last_retried < limit).update(
+                {'state': ovn_const.OVN_JOURNAL_PENDING},
+                synchronize_session=False)
+
+
+def _query_failed_rows(session, object_uuids=None):
+    query = session.query(models.OVNJournal).filter_by(
+        state=ovn_const.OVN_JOURNAL_FAILED)
+    if object_uuids:
+        query = query.filter(models.OVNJournal.object_uuid.in_(object_uuids))
+    return query
+
+
+def get_failed_rows(session, object_uuids=None):
+    """Get the rows which failed to be applied, oldest first
+
+    :param session:       A DB session
+    :param object_uuids:  Only get the rows of these resources if not None
+    """
+    return _query_failed_rows(session, object_uuids).order_by(
+        models.OVNJournal.seqnum).all()
+
+
+def retry_failed_rows(session, object_uuids=None):
+    """Put back the failed rows in the pending state to apply them again
+
+    Their retry count is reset, they are retried ovn_journal_max_retries
+    times again.
+
+    :returns: The number of rows put back in the pending state
+    """
+    with session.begin(subtransactions=True):
+        return _query_failed_rows(session, object_uuids).update(
+            {'state': ovn_const.OVN_JOURNAL_PENDING, 'retry_count': 0},
+            synchronize_session=False)
+
+
+def delete_failed_rows(session, object_uuids=None):
+    """Delete the failed rows, unblocking the next rows of their resources
+
+    The changes of the deleted rows are lost, the OVN_Northbound DB has to
+    be synchronized with neutron-ovn-db-sync-util.
+
+    :returns: The number of rows deleted
+    """
+    with session.begin(subtransactions=True):
+        return _query_failed_rows(session, object_uuids).delete(
+            synchronize_session=False)
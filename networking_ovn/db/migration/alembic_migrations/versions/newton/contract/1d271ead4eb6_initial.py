@@ -0,0 +1,31 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""initial contract branch
+
+Revision ID: 1d271ead4eb6
+Revises: e229b8aad9f2
+Create Date: 2016-10-19 10:14:05.893251
+
+"""
+
+from neutron.db.migration import cli
+
+# revision identifiers, used by Alembic.
+revision = '1d271ead4eb6'
+down_revision = 'e229b8aad9f2'
+branch_labels = (cli.CONTRACT_BRANCH,)
+
+
+def upgrade():
+    pass
@@ -0,0 +1,52 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add ovn_journal table
+
+Revision ID: bc9e24bcf3cd
+Revises: e229b8aad9f2
+Create Date: 2016-10-19 10:16:42.129486
+
+"""
+
+from alembic import op
+from neutron.db.migration import cli
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'bc9e24bcf3cd'
+down_revision = 'e229b8aad9f2'
+branch_labels = (cli.EXPAND_BRANCH,)
+
+
+def upgrade():
+    op.create_table(
+        'ovn_journal',
+        sa.Column('seqnum', sa.BigInteger().with_variant(sa.Integer(),
+                                                         'sqlite'),
+                  primary_key=True, autoincrement=True),
+        sa.Column('object_type', sa.String(36), nullable=False),
+        sa.Column('object_uuid', sa.String(36), nullable=False),
+        sa.Column('operation', sa.String(36), nullable=False),
+        sa.Column('data', sa.Text, nullable=True),
+        sa.Column('state', sa.Enum('pending', 'processing', 'failed',
+                                   name='ovn_journal_states'),
+                  nullable=False, default='pending'),
+        sa.Column('retry_count', sa.Integer, nullable=False, default=0),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('last_retried', sa.DateTime, nullable=True),
+    )
+    op.create_index('ix_ovn_journal_state_seqnum', 'ovn_journal',
+                    ['state', 'seqnum'])
+    op.create_index('ix_ovn_journal_object_uuid', 'ovn_journal',
+                    ['object_uuid'])
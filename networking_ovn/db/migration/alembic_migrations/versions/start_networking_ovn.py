@@ -0,0 +1,28 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""start networking-ovn chain
+
+Revision ID: e229b8aad9f2
+Revises: None
+Create Date: 2016-10-19 10:12:31.417210
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e229b8aad9f2'
+down_revision = None
+
+
+def upgrade():
+    pass
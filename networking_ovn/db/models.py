@@ -0,0 +1,44 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.db import model_base
+import sqlalchemy as sa
+
+from networking_ovn.common import constants as ovn_const
+
+
+class OVNJournal(model_base.BASEV2):
+    """Change of a neutron resource to apply to the OVN_Northbound DB"""
+
+    __tablename__ = 'ovn_journal'
+
+    seqnum = sa.Column(sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                       primary_key=True, autoincrement=True)
+    object_type = sa.Column(sa.String(36), nullable=False)
+    object_uuid = sa.Column(sa.String(36), nullable=False)
+    operation = sa.Column(sa.String(36), nullable=False)
+    data = sa.Column(sa.Text, nullable=True)
+    state = sa.Column(sa.Enum(ovn_const.OVN_JOURNAL_PENDING,
+                              ovn_const.OVN_JOURNAL_PROCESSING,
+                              ovn_const.OVN_JOURNAL_FAILED,
+                              name='ovn_journal_states'),
+                      nullable=False, default=ovn_const.OVN_JOURNAL_PENDING)
+    retry_count = sa.Column(sa.Integer, nullable=False, default=0)
+    created_at = sa.Column(sa.DateTime, server_default=sa.func.now())
+    # Time the row was last claimed by a neutron server to be processed
+    last_retried = sa.Column(sa.DateTime, nullable=True)
+
+    __table_args__ = (
+        sa.Index('ix_ovn_journal_state_seqnum', 'state', 'seqnum'),
+        sa.Index('ix_ovn_journal_object_uuid', 'object_uuid'),
+        model_base.BASEV2.__table_args__
+    )
@@ -0,0 +1,85 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+from neutron.services.segments import db as segment_service_db
+
+# Maximum number of hosts in the IN clause of a single statement
+HOSTS_PER_STATEMENT = 500
+
+
+def _chunks(items, size):
+    items = sorted(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def get_segment_host_mappings(session, hosts=None):
+    """Get the segments mapped to each host
+
+    :param session:  A DB session
+    :param hosts:    The hosts to get the mappings of, all the hosts if None
+    :returns:        dictionary of host to the set of its segment ids
+    """
+    model = segment_service_db.SegmentHostMapping
+    mappings = collections.defaultdict(set)
+    if hosts is None:
+        queries = [session.query(model.host, model.segment_id)]
+    else:
+        queries = [
+            session.query(model.host, model.segment_id).filter(
+                model.host.in_(chunk))
+            for chunk in _chunks(hosts, HOSTS_PER_STATEMENT)]
+    for query in queries:
+        for host, segment_id in query:
+            mappings[host].add(segment_id)
+    return mappings
+
+
+def update_segment_host_mappings(context, host_segments, all_hosts=False):
+    """Map the hosts to their segments, only changing the differences
+
+    The current mappings of the hosts are read at once, then the stale
+    mappings are deleted with one statement per segment and the new ones
+    are inserted with a single statement.
+
+    :param context:        The neutron context
+    :param host_segments:  dictionary of host to the set of the ids of the
+                           segments it is mapped to
+    :param all_hosts:      Whether host_segments holds all the hosts, the
+                           mappings of the other hosts are then deleted
+    :returns:              tuple of the numbers of mappings added and
+                           deleted
+    """
+    model = segment_service_db.SegmentHostMapping
+    session = context.session
+    with session.begin(subtransactions=True):
+        current = get_segment_host_mappings(
+            session, None if all_hosts else list(host_segments))
+        stale = collections.defaultdict(set)
+        for host, segment_ids in current.items():
+            for segment_id in segment_ids - set(
+                    host_segments.get(host, ())):
+                stale[segment_id].add(host)
+        new = [{'host': host, 'segment_id': segment_id}
+               for host, segment_ids in host_segments.items()
+               for segment_id in set(segment_ids) - current.get(host, set())]
+
+        for segment_id, hosts in stale.items():
+            for chunk in _chunks(hosts, HOSTS_PER_STATEMENT):
+                session.query(model).filter(
+                    model.segment_id == segment_id,
+                    model.host.in_(chunk)).delete(synchronize_session=False)
+        if new:
+            session.execute(model.__table__.insert(), new)
+    return len(new), sum(len(hosts) for hosts in stale.values())
@@ -12,13 +12,17 @@
 #    under the License.
 #
 
+import collections
+
 import netaddr
 import six
 
-from neutron.common import utils as n_utils
 from neutron_lib import exceptions as n_exc
 from oslo_log import log
 
+from neutron.callbacks import events
+from neutron.callbacks import registry
+from neutron.callbacks import resources
 from neutron.db import common_db_mixin
 from neutron.db import extraroute_db
 from neutron import manager
@@ -26,15 +30,21 @@ from neutron.plugins.common import constants
 from neutron.services import service_base
 
 from networking_ovn._i18n import _LE, _LI
+from networking_ovn.common import config
 from networking_ovn.common import constants as ovn_const
 from networking_ovn.common import extensions
 from networking_ovn.common import utils
+from networking_ovn.db import journal as journal_db
 from networking_ovn.l3 import l3_ovn_scheduler
 from networking_ovn.ovsdb import impl_idl_ovn
+from networking_ovn.ovsdb import transaction as ovn_txn
 
 
 LOG = log.getLogger(__name__)
 
+# Maximum number of subnet CIDRs cached by the plugin
+SUBNET_CIDR_CACHE_SIZE = 10000
+
 
 class OVNL3RouterPlugin(service_base.ServicePluginBase,
                         common_db_mixin.CommonDbMixin,
@@ -55,6 +65,21 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
         self._sb_ovn_idl = None
         self._plugin_property = None
         self.scheduler = l3_ovn_scheduler.get_scheduler()
+        # Subnet id -> CIDR, the CIDR of a subnet can't be updated
+        self._subnet_cidrs = collections.OrderedDict()
+        if config.is_ovn_journal():
+            self._subscribe_journal()
+
+    def _subscribe_journal(self):
+        # The router journal rows are recorded in the transaction of the
+        # router changes. The port operations of the L3 DB are done out of
+        # these transactions.
+        registry.subscribe(self._record_router_create, resources.ROUTER,
+                           events.PRECOMMIT_CREATE)
+        registry.subscribe(self._record_router_update, resources.ROUTER,
+                           events.PRECOMMIT_UPDATE)
+        registry.subscribe(self._record_router_delete, resources.ROUTER,
+                           events.PRECOMMIT_DELETE)
 
     @property
     def _ovn(self):
@@ -84,9 +109,57 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
         return ("L3 Router Service Plugin for basic L3 forwarding"
                 " using OVN")
 
+    def _record_router_create(self, resource, event, trigger, **kwargs):
+        router = kwargs['router']
+        journal_db.record(kwargs['context'], ovn_const.OVN_JOURNAL_ROUTER,
+                          kwargs['router_id'], ovn_const.OVN_JOURNAL_CREATE,
+                          {'id': kwargs['router_id'],
+                           'name': router.get('name'),
+                           'admin_state_up': router.get('admin_state_up')})
+
+    def _record_router_update(self, resource, event, trigger, **kwargs):
+        # The static routes are recorded by _update_extra_routes()
+        update = self._get_lrouter_update(kwargs['router'],
+                                          kwargs['old_router'])
+        if update:
+            journal_db.record(kwargs['context'],
+                              ovn_const.OVN_JOURNAL_ROUTER,
+                              kwargs['router_id'],
+                              ovn_const.OVN_JOURNAL_UPDATE,
+                              {'router_id': kwargs['router_id'],
+                               'update': update, 'added': [],
+                               'removed': []})
+
+    def _record_router_delete(self, resource, event, trigger, **kwargs):
+        journal_db.record(kwargs['context'], ovn_const.OVN_JOURNAL_ROUTER,
+                          kwargs['router_id'], ovn_const.OVN_JOURNAL_DELETE,
+                          {'id': kwargs['router_id']})
+
+    def _update_extra_routes(self, context, router, routes):
+        if not config.is_ovn_journal():
+            return super(OVNL3RouterPlugin, self)._update_extra_routes(
+                context, router, routes)
+
+        # Called in the transaction updating the static routes
+        original_routes = self._get_extra_routes_by_router_id(context,
+                                                              router['id'])
+        super(OVNL3RouterPlugin, self)._update_extra_routes(
+            context, router, routes)
+        added, removed = utils.get_static_route_changes(original_routes,
+                                                        routes)
+        if added or removed:
+            journal_db.record(context, ovn_const.OVN_JOURNAL_ROUTER,
+                              router['id'], ovn_const.OVN_JOURNAL_UPDATE,
+                              {'router_id': router['id'], 'update': {},
+                               'added': added, 'removed': removed})
+
     def create_router(self, context, router):
         router = super(OVNL3RouterPlugin, self).create_router(
             context, router)
+        if config.is_ovn_journal():
+            # The journal row is recorded by _record_router_create()
+            return router
+
         try:
             self.create_lrouter_in_ovn(router)
         except Exception:
@@ -114,48 +187,60 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
                                              enabled=enabled
                                              ))
 
-    def update_router(self, context, id, router):
-        original_router = self.get_router(context, id)
-        result = super(OVNL3RouterPlugin, self).update_router(
-            context, id, router)
+    @staticmethod
+    def _get_lrouter_update(router, original_router):
+        """Get the columns of the lrouter to update for an updated router
 
+        @param router: The updated attributes of the router
+        @param original_router: The router before the update
+        @return: dictionary of the columns of the lrouter to update
+        """
         update = {}
-        added = []
-        removed = []
-        router_name = utils.ovn_name(id)
-        if 'admin_state_up' in router['router']:
-            enabled = router['router']['admin_state_up']
+        if 'admin_state_up' in router:
+            enabled = router['admin_state_up']
             if enabled != original_router['admin_state_up']:
                 update['enabled'] = enabled
 
-        if 'name' in router['router']:
-            if router['router']['name'] != original_router['name']:
+        if 'name' in router:
+            if router['name'] != original_router['name']:
                 external_ids = {ovn_const.OVN_ROUTER_NAME_EXT_ID_KEY:
-                                router['router']['name']}
+                                router['name']}
                 update['external_ids'] = external_ids
+        return update
+
+    @classmethod
+    def _get_lrouter_changes(cls, router, original_router):
+        """Get the changes of the lrouter of an updated router
+
+        @return: tuple of the columns of the lrouter to update and of the
+                 static routes added and removed
+        """
+        update = cls._get_lrouter_update(router['router'], original_router)
+        added = []
+        removed = []
 
         """Update static routes"""
         if 'routes' in router['router']:
             routes = router['router']['routes']
-            added, removed = n_utils.diff_list_of_dict(
+            added, removed = utils.get_static_route_changes(
                 original_router['routes'], routes)
+        return update, added, removed
+
+    def update_router(self, context, id, router):
+        if config.is_ovn_journal():
+            # The journal rows are recorded by _record_router_update() and
+            # _update_extra_routes()
+            return super(OVNL3RouterPlugin, self).update_router(
+                context, id, router)
 
+        original_router = self.get_router(context, id)
+        result = super(OVNL3RouterPlugin, self).update_router(
+            context, id, router)
+        update, added, removed = self._get_lrouter_changes(router,
+                                                           original_router)
         if update or added or removed:
             try:
-                with self._ovn.transaction(check_error=True) as txn:
-                    if update:
-                        txn.add(self._ovn.update_lrouter(router_name,
-                                **update))
-
-                    for route in added:
-                        txn.add(self._ovn.add_static_route(router_name,
-                                ip_prefix=route['destination'],
-                                nexthop=route['nexthop']))
-
-                    for route in removed:
-                        txn.add(self._ovn.delete_static_route(router_name,
-                                ip_prefix=route['destination'],
-                                nexthop=route['nexthop']))
+                self.update_lrouter_in_ovn(id, update, added, removed)
             except Exception:
                 LOG.exception(_LE('Unable to update lrouter for %s'), id)
                 super(OVNL3RouterPlugin, self).update_router(context,
@@ -165,22 +250,99 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
 
         return result
 
+    def update_lrouter_in_ovn(self, router_id, update, added, removed):
+        """Update lrouter in OVN
+
+        @param router_id: Router ID of the lrouter to update
+        @param update: Columns of the lrouter to update
+        @param added: Static routes to add
+        @param removed: Static routes to delete
+        @return: Nothing
+        """
+        router_name = utils.ovn_name(router_id)
+        with self._ovn.transaction(check_error=True) as txn:
+            if update:
+                txn.add(self._ovn.update_lrouter(router_name, **update))
+
+            if added or removed:
+                txn.add(self._ovn.update_static_routes(
+                    router_name,
+                    add_routes=utils.get_static_route_keys(added),
+                    del_routes=utils.get_static_route_keys(removed)))
+
     def delete_router(self, context, id):
-        router_name = utils.ovn_name(id)
         ret_val = super(OVNL3RouterPlugin, self).delete_router(context, id)
-        self._ovn.delete_lrouter(router_name).execute(check_error=True)
+        if config.is_ovn_journal():
+            # The journal row is recorded by _record_router_delete()
+            return ret_val
+
+        self.delete_lrouter_in_ovn(id)
         return ret_val
 
-    def get_networks_for_lrouter_port(self, context, port_fixed_ips):
+    def delete_lrouter_in_ovn(self, router_id):
+        self._ovn.delete_lrouter(utils.ovn_name(router_id)).execute(
+            check_error=True)
+
+    def _get_subnet_cidrs(self, context, subnet_ids):
+        """Get the CIDR of each subnet of subnet_ids
+
+        The CIDRs are cached, the subnets not in the cache are fetched with
+        a single query.
+        """
+        cidrs = {}
+        missing = set()
+        for subnet_id in subnet_ids:
+            cidr = self._subnet_cidrs.get(subnet_id)
+            if cidr is None:
+                missing.add(subnet_id)
+            else:
+                cidrs[subnet_id] = cidr
+        if len(missing) == 1:
+            subnet_id = missing.pop()
+            cidrs[subnet_id] = self._plugin.get_subnet(context,
+                                                       subnet_id)['cidr']
+        elif missing:
+            for subnet in self._plugin.get_subnets(
+                    context, filters={'id': list(missing)},
+                    fields=['id', 'cidr']):
+                cidrs[subnet['id']] = subnet['cidr']
+                missing.discard(subnet['id'])
+            if missing:
+                raise n_exc.SubnetNotFound(subnet_id=missing.pop())
+        for subnet_id, cidr in cidrs.items():
+            self._subnet_cidrs[subnet_id] = cidr
+        while len(self._subnet_cidrs) > SUBNET_CIDR_CACHE_SIZE:
+            self._subnet_cidrs.popitem(last=False)
+        return cidrs
+
+    @staticmethod
+    def _get_networks(port_fixed_ips, subnet_cidrs):
         networks = set()
         for fixed_ip in port_fixed_ips:
-            subnet_id = fixed_ip['subnet_id']
-            subnet = self._plugin.get_subnet(context, subnet_id)
-            cidr = netaddr.IPNetwork(subnet['cidr'])
+            cidr = netaddr.IPNetwork(subnet_cidrs[fixed_ip['subnet_id']])
             networks.add("%s/%s" % (fixed_ip['ip_address'],
                                     str(cidr.prefixlen)))
         return list(networks)
 
+    def get_networks_for_lrouter_port(self, context, port_fixed_ips):
+        subnet_cidrs = self._get_subnet_cidrs(
+            context, [fixed_ip['subnet_id'] for fixed_ip in port_fixed_ips])
+        return self._get_networks(port_fixed_ips, subnet_cidrs)
+
+    def get_networks_for_lrouter_ports(self, context, ports):
+        """Get the networks of several router ports
+
+        The subnets of all the ports are fetched at once.
+
+        :returns: dictionary of port id to the list of its networks
+        """
+        subnet_cidrs = self._get_subnet_cidrs(
+            context, set(fixed_ip['subnet_id'] for port in ports
+                         for fixed_ip in port['fixed_ips']))
+        return dict((port['id'], self._get_networks(port['fixed_ips'],
+                                                    subnet_cidrs))
+                    for port in ports)
+
     def create_lrouter_port_in_ovn(self, context, router_id, port):
         """Create lrouter port in OVN
 
@@ -226,7 +388,7 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
             txn.add(self._ovn.set_lrouter_port_in_lswitch_port(
                     port['id'], lrouter_port_name))
 
-    def add_router_interface(self, context, router_id, interface_info):
+    def _add_router_interface(self, context, router_id, interface_info):
         router_interface_info = \
             super(OVNL3RouterPlugin, self).add_router_interface(
                 context, router_id, interface_info)
@@ -236,37 +398,99 @@ class OVNL3RouterPlugin(service_base.ServicePluginBase,
                 len(port['fixed_ips']) > 1):
             # NOTE(lizk) It's adding a subnet onto an already existing router
             # interface port, try to update lrouter port 'networks' column.
+            operation = ovn_const.OVN_JOURNAL_UPDATE
+        else:
+            operation = ovn_const.OVN_JOURNAL_CREATE
+        return router_interface_info, port, operation
+
+    def add_router_interface(self, context, router_id, interface_info):
+        router_interface_info, port, operation = self._add_router_interface(
+            context, router_id, interface_info)
+        if config.is_ovn_journal():
+            # NOTE: The L3 DB sends no precommit event for the router
+            # interfaces and creates or deletes their ports through the core
+            # plugin, which must not run in an outer transaction. The
+            # journal row is recorded once the interface is committed, like
+            # the OVN change of the direct mode.
+            journal_db.record(context, ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+                              port['id'], operation,
+                              {'router_id': router_id, 'port': port})
+            return router_interface_info
+
+        if operation == ovn_const.OVN_JOURNAL_UPDATE:
             self.update_lrouter_port_in_ovn(context, router_id, port)
         else:
             self.create_lrouter_port_in_ovn(context, router_id, port)
         return router_interface_info
 
-    def remove_router_interface(self, context, router_id, interface_info):
+    def _remove_router_interface(self, context, router_id, interface_info):
         router_interface_info = \
             super(OVNL3RouterPlugin, self).remove_router_interface(
                 context, router_id, interface_info)
         port_id = router_interface_info['port_id']
         try:
             port = self._plugin.get_port(context, port_id)
+        except n_exc.PortNotFound:
+            port = None
+        return router_interface_info, port_id, port
+
+    def remove_router_interface(self, context, router_id, interface_info):
+        router_interface_info, port_id, port = self._remove_router_interface(
+            context, router_id, interface_info)
+        if config.is_ovn_journal():
+            # See add_router_interface() for why the row is recorded here
+            if port:
+                journal_db.record(
+                    context, ovn_const.OVN_JOURNAL_ROUTER_INTERFACE, port_id,
+                    ovn_const.OVN_JOURNAL_UPDATE,
+                    {'router_id': router_id, 'port': port})
+            else:
+                journal_db.record(
+                    context, ovn_const.OVN_JOURNAL_ROUTER_INTERFACE, port_id,
+                    ovn_const.OVN_JOURNAL_DELETE,
+                    {'router_id': router_id, 'port_id': port_id})
+            return router_interface_info
+
+        if port:
             # The router interface port still exists, call ovn to update it.
             self.update_lrouter_port_in_ovn(context, router_id, port)
-        except n_exc.PortNotFound:
+        else:
             # The router interface port doesn't exist any more, call ovn to
             # delete it.
-            self._ovn.delete_lrouter_port(utils.ovn_lrouter_port_name(port_id),
-                                          utils.ovn_name(router_id),
-                                          if_exists=False
-                                          ).execute(check_error=True)
+            self.delete_lrouter_port_in_ovn(router_id, port_id)
         return router_interface_info
 
+    def delete_lrouter_port_in_ovn(self, router_id, port_id):
+        self._ovn.delete_lrouter_port(utils.ovn_lrouter_port_name(port_id),
+                                      utils.ovn_name(router_id),
+                                      if_exists=False
+                                      ).execute(check_error=True)
+
     def schedule_unhosted_routers(self):
         valid_chassis_list = self._sb_ovn.get_all_chassis()
         unhosted_routers = self._ovn.get_unhosted_routers(valid_chassis_list)
-        if unhosted_routers:
-            with self._ovn.transaction(check_error=True) as txn:
+        if not unhosted_routers:
+            return
+        try:
+            with ovn_txn.background(), \
+                    self._ovn.transaction(check_error=True) as txn:
                 for r_name, r_options in six.iteritems(unhosted_routers):
-                    chassis = self.scheduler.select(self._ovn, self._sb_ovn,
-                                                    r_name)
+                    chassis = self.scheduler.select(
+                        self._ovn, self._sb_ovn, r_name,
+                        candidates=valid_chassis_list)
                     r_options['chassis'] = chassis
                     txn.add(self._ovn.update_lrouter(r_name,
                                                      options=r_options))
+        except Exception:
+            # The routers weren't scheduled, they must not count in the
+            # load of the chassis selected for them
+            self.scheduler.reset(self._ovn, list(unhosted_routers))
+            raise
+
+    def rebalance_routers(self, max_moves=None, dry_run=False):
+        """Move gateway routers to even out the load of the chassis
+
+        :returns: list of (router name, from chassis, to chassis)
+        """
+        return self.scheduler.rebalance(self._ovn, self._sb_ovn,
+                                        max_moves=max_moves, dry_run=dry_run)
@@ -13,19 +13,244 @@
 #
 
 import abc
+import heapq
 import random
 import six
+import threading
+import weakref
 
+from eventlet import greenthread
 from oslo_log import log
+from ovs.db import idl
 
+from networking_ovn._i18n import _LI
 from networking_ovn.common import config as ovn_config
 from networking_ovn.common import constants as ovn_const
+from networking_ovn.ovsdb import ovsdb_monitor
+from networking_ovn.ovsdb import transaction as ovn_txn
 
 
 LOG = log.getLogger(__name__)
 
 OVN_SCHEDULER_CHANCE = 'chance'
 OVN_SCHEDULER_LEAST_LOADED = 'leastloaded'
+OVN_SCHEDULER_WEIGHTED = 'weighted'
+
+
+def _get_gateway_chassis(lrouter):
+    if ovn_const.OVN_ROUTER_NAME_EXT_ID_KEY not in lrouter.external_ids:
+        return None
+    chassis = lrouter.options.get('chassis')
+    if chassis == ovn_const.OVN_GATEWAY_INVALID_CHASSIS:
+        return None
+    return chassis
+
+
+class ChassisLoad(object):
+    """Number of gateway routers hosted by each chassis
+
+    The load is computed from the Logical_Router table when first needed,
+    then kept up to date from the changes of the Logical_Router rows seen
+    by the Idl and from the routers scheduled by this process, before their
+    transaction is committed, those of a transaction which failed being
+    reset with reset_routers. The chassis are kept in a heap by load, so
+    that the least loaded one is found in O(log(chassis)).
+
+    The load of a chassis is relative to its weight, 1 unless set with
+    set_weights.
+    """
+
+    def __init__(self, ovsdb_idl):
+        self._lock = threading.Lock()
+        # The ChassisLoad is cached by Idl, it must not keep it alive
+        self._idl_ref = weakref.ref(ovsdb_idl)
+        # Chassis of each gateway router
+        self._router_chassis = {}
+        # Number of gateway routers of each chassis
+        self._loads = {}
+        # Weight of the chassis whose weight isn't 1
+        self._weights = {}
+        # (key, chassis) entries, those whose key isn't the current key of
+        # the chassis are outdated and skipped.
+        self._heap = []
+        ovsdb_idl.add_table_listener('Logical_Router', self._router_changed)
+        with self._lock:
+            for lrouter in list(
+                    ovsdb_idl.tables['Logical_Router'].rows.values()):
+                self._set_router_chassis(lrouter.name,
+                                         _get_gateway_chassis(lrouter))
+
+    def _router_changed(self, event, row, updates=None):
+        chassis = None
+        if event != idl.ROW_DELETE:
+            chassis = _get_gateway_chassis(row)
+        with self._lock:
+            self._set_router_chassis(row.name, chassis)
+
+    def _get_key(self, chassis):
+        # Load of the chassis once one more router is scheduled on it,
+        # relative to its weight. Chassis with a weight of 0 come last.
+        weight = self._weights.get(chassis, 1.0)
+        if weight <= 0:
+            return float('inf')
+        return (self._loads.get(chassis, 0) + 1) / weight
+
+    def _rebuild_heap(self):
+        self._heap = [(self._get_key(chassis), chassis)
+                      for chassis in self._loads]
+        heapq.heapify(self._heap)
+
+    def _add_load(self, chassis, delta):
+        self._loads[chassis] = self._loads.get(chassis, 0) + delta
+        heapq.heappush(self._heap, (self._get_key(chassis), chassis))
+        if len(self._heap) > 2 * len(self._loads) + 16:
+            # Drop the outdated entries
+            self._rebuild_heap()
+
+    def _set_router_chassis(self, router_name, chassis):
+        old_chassis = self._router_chassis.get(router_name)
+        if old_chassis == chassis:
+            return
+        if old_chassis:
+            self._add_load(old_chassis, -1)
+        if chassis:
+            self._router_chassis[router_name] = chassis
+            self._add_load(chassis, 1)
+        else:
+            del self._router_chassis[router_name]
+
+    def set_router_chassis(self, router_name, chassis):
+        """Account for router_name being scheduled on chassis"""
+        if chassis == ovn_const.OVN_GATEWAY_INVALID_CHASSIS:
+            chassis = None
+        with self._lock:
+            self._set_router_chassis(router_name, chassis)
+
+    def reset_routers(self, router_names):
+        """Account for the routers on their chassis in the Idl
+
+        Undo set_router_chassis for the routers whose transaction failed.
+        """
+        ovsdb_idl = self._idl_ref()
+        if ovsdb_idl is None:
+            return
+        router_names = set(router_names)
+        chassis = dict((lrouter.name, _get_gateway_chassis(lrouter))
+                       for lrouter in list(
+                           ovsdb_idl.tables['Logical_Router'].rows.values())
+                       if lrouter.name in router_names)
+        with self._lock:
+            for router_name in router_names:
+                self._set_router_chassis(router_name,
+                                         chassis.get(router_name))
+
+    def get_router_chassis(self, router_name):
+        with self._lock:
+            return self._router_chassis.get(router_name)
+
+    def get_load(self, chassis):
+        with self._lock:
+            return self._loads.get(chassis, 0)
+
+    def set_weights(self, weights):
+        """Set the weight of the chassis
+
+        :param weights: dictionary of chassis name to weight, the chassis
+                        not in weights have a weight of 1
+        """
+        weights = dict((chassis, weight) for chassis, weight
+                       in weights.items() if weight != 1.0)
+        with self._lock:
+            if weights == self._weights:
+                return
+            self._weights = weights
+            self._rebuild_heap()
+
+    def get_least_loaded(self, candidates):
+        """Get the candidate chassis hosting the fewest gateway routers
+
+        The load of each chassis is relative to its weight.
+        """
+        candidates = set(candidates)
+        with self._lock:
+            for chassis in candidates:
+                if chassis not in self._loads:
+                    self._add_load(chassis, 0)
+            skipped = []
+            least_loaded = None
+            while self._heap:
+                key, chassis = heapq.heappop(self._heap)
+                if chassis not in self._loads or (
+                        self._get_key(chassis) != key):
+                    continue
+                skipped.append((key, chassis))
+                if chassis in candidates:
+                    least_loaded = chassis
+                    break
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+            return least_loaded
+
+
+# Load of the chassis seen by each Idl
+_chassis_loads = weakref.WeakKeyDictionary()
+_chassis_loads_lock = threading.Lock()
+
+
+def get_chassis_load(nb_idl):
+    """Get the ChassisLoad of the OVN_Northbound DB API nb_idl
+
+    :returns: None if the Idl doesn't notify the changes of its rows
+    """
+    ovsdb_idl = getattr(nb_idl, 'idl', None)
+    if not isinstance(ovsdb_idl, ovsdb_monitor.BaseOvnIdl):
+        return None
+    with _chassis_loads_lock:
+        chassis_load = _chassis_loads.get(ovsdb_idl)
+        if chassis_load is None:
+            chassis_load = _chassis_loads[ovsdb_idl] = ChassisLoad(ovsdb_idl)
+    return chassis_load
+
+
+def get_rebalance_moves(chassis_bindings, weights=None, max_moves=0):
+    """Compute the moves of gateway routers evening out the chassis load
+
+    Each move takes a router from the chassis with the highest load
+    relative to its weight to the chassis with the lowest load once the
+    router is added, as long as the latter is lower than the former. The
+    routers are never moved between chassis whose loads only differ by one
+    router, so that the number of moves is minimal.
+
+    :param chassis_bindings: dictionary of chassis name to the list of the
+                             gateway routers it hosts
+    :param weights:          dictionary of chassis name to weight, the
+                             chassis not in weights have a weight of 1
+    :param max_moves:        maximum number of moves, 0 means no limit
+    :returns:                list of (router name, from chassis, to chassis)
+    """
+    weights = weights or {}
+    routers = dict((chassis, sorted(names))
+                   for chassis, names in chassis_bindings.items())
+
+    def _get_load(chassis, delta=0):
+        load = len(routers[chassis]) + delta
+        weight = weights.get(chassis, ovn_const.OVN_GATEWAY_DEFAULT_WEIGHT)
+        if weight <= 0:
+            return float('inf') if load else 0.0
+        return load / float(weight)
+
+    moves = []
+    while routers and (not max_moves or len(moves) < max_moves):
+        source = max(routers, key=lambda chassis: (_get_load(chassis),
+                                                   chassis))
+        target = min(routers, key=lambda chassis: (_get_load(chassis, 1),
+                                                   chassis))
+        if _get_load(target, 1) >= _get_load(source):
+            break
+        router = routers[source].pop()
+        routers[target].append(router)
+        moves.append((router, source, target))
+    return moves
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -43,8 +268,12 @@ class OVNGatewayScheduler(object):
         """
         pass
 
+    def reset(self, nb_idl, router_names):
+        """Forget the selections of the routers whose transaction failed"""
+        pass
+
     def _schedule_gateway(self, nb_idl, sb_idl, router_name, candidates):
-        existing_chassis = nb_idl.get_router_chassis_binding(router_name)
+        existing_chassis = self._get_router_chassis(nb_idl, router_name)
         candidates = candidates or self._get_chassis_candidates(sb_idl)
         if existing_chassis and (existing_chassis in candidates or
                                  not candidates):
@@ -53,16 +282,19 @@ class OVNGatewayScheduler(object):
             return ovn_const.OVN_GATEWAY_INVALID_CHASSIS
         # The actual binding of the gateway to a chassis via the options
         # column in the OVN_Northbound is done by the caller
-        chassis = self._select_gateway_chassis(nb_idl, candidates)
+        chassis = self._select_gateway_chassis(nb_idl, sb_idl, candidates)
         LOG.debug("Router %s gateway scheduled on chassis %s",
                   router_name, chassis)
         return chassis
 
     @abc.abstractmethod
-    def _select_gateway_chassis(self, nb_idl, candidates):
+    def _select_gateway_chassis(self, nb_idl, sb_idl, candidates):
         """Choose a chassis from candidates based on a specific policy."""
         pass
 
+    def _get_router_chassis(self, nb_idl, router_name):
+        return nb_idl.get_router_chassis_binding(router_name)
+
     def _get_chassis_candidates(self, sb_idl):
         # TODO(azbiswas): Allow selection of a specific type of chassis when
         # the upstream code merges.
@@ -70,6 +302,54 @@ class OVNGatewayScheduler(object):
         #    sb_idl.get_all_chassis()
         return sb_idl.get_all_chassis()
 
+    def _get_chassis_weights(self, sb_idl):
+        # All the chassis have the same weight
+        return {}
+
+    def rebalance(self, nb_idl, sb_idl, max_moves=None, dry_run=False):
+        """Move gateway routers to even out the load of the chassis
+
+        The moves are applied in batches of ovn_l3_rebalance_batch_size
+        routers, waiting ovn_l3_rebalance_batch_interval seconds between
+        two batches, to limit the disruption of the connections tracked
+        by the gateways.
+
+        :param max_moves: maximum number of routers moved, defaults to
+                          ovn_l3_rebalance_max_moves, 0 means no limit
+        :param dry_run:   only report the moves, without applying them
+        :returns:         list of (router name, from chassis, to chassis)
+        """
+        if max_moves is None:
+            max_moves = ovn_config.get_ovn_l3_rebalance_max_moves()
+        candidates = self._get_chassis_candidates(sb_idl)
+        if len(candidates) < 2:
+            return []
+        chassis_bindings = nb_idl.get_all_chassis_router_bindings(candidates)
+        moves = get_rebalance_moves(chassis_bindings,
+                                    self._get_chassis_weights(sb_idl),
+                                    max_moves)
+        for router, from_chassis, to_chassis in moves:
+            LOG.info(_LI('%(action)s gateway router %(router)s from chassis '
+                         '%(from)s to chassis %(to)s'),
+                     {'action': 'Would move' if dry_run else 'Moving',
+                      'router': router, 'from': from_chassis,
+                      'to': to_chassis})
+        if dry_run:
+            return moves
+
+        batch_size = ovn_config.get_ovn_l3_rebalance_batch_size()
+        for index in range(0, len(moves), batch_size):
+            if index:
+                greenthread.sleep(
+                    ovn_config.get_ovn_l3_rebalance_batch_interval())
+            with ovn_txn.background(), \
+                    nb_idl.transaction(check_error=True) as txn:
+                for router, from_chassis, to_chassis in (
+                        moves[index:index + batch_size]):
+                    txn.add(nb_idl.move_lrouter_gateway(
+                        router, from_chassis, to_chassis))
+        return moves
+
 
 class OVNGatewayChanceScheduler(OVNGatewayScheduler):
     """Randomly select an chassis for a gateway port of a router"""
@@ -77,7 +357,7 @@ class OVNGatewayChanceScheduler(OVNGatewayScheduler):
     def select(self, nb_idl, sb_idl, router_name, candidates=None):
         return self._schedule_gateway(nb_idl, sb_idl, router_name, candidates)
 
-    def _select_gateway_chassis(self, nb_idl, candidates):
+    def _select_gateway_chassis(self, nb_idl, sb_idl, candidates):
         return random.choice(candidates)
 
 
@@ -85,17 +365,72 @@ class OVNGatewayLeastLoadedScheduler(OVNGatewayScheduler):
     """Select the least loaded chassis for a gateway port of a router"""
 
     def select(self, nb_idl, sb_idl, router_name, candidates=None):
-        return self._schedule_gateway(nb_idl, sb_idl, router_name, candidates)
+        chassis = self._schedule_gateway(nb_idl, sb_idl, router_name,
+                                         candidates)
+        chassis_load = get_chassis_load(nb_idl)
+        if chassis_load is not None:
+            # The routers scheduled next in the same pass see this one,
+            # before its transaction is committed.
+            chassis_load.set_router_chassis(router_name, chassis)
+        return chassis
 
-    def _select_gateway_chassis(self, nb_idl, candidates):
+    def reset(self, nb_idl, router_names):
+        chassis_load = get_chassis_load(nb_idl)
+        if chassis_load is not None:
+            chassis_load.reset_routers(router_names)
+
+    def _get_router_chassis(self, nb_idl, router_name):
+        chassis_load = get_chassis_load(nb_idl)
+        if chassis_load is not None:
+            return chassis_load.get_router_chassis(router_name)
+        return nb_idl.get_router_chassis_binding(router_name)
+
+    def _select_gateway_chassis(self, nb_idl, sb_idl, candidates):
+        chassis_load = get_chassis_load(nb_idl)
+        if chassis_load is not None:
+            return chassis_load.get_least_loaded(candidates)
         chassis_bindings = nb_idl.get_all_chassis_router_bindings(candidates)
         # Sort on the length of the values in the returned dictionary
         return sorted(chassis_bindings.items(), key=lambda x: len(x[1]))[0][0]
 
 
+class OVNGatewayWeightedScheduler(OVNGatewayLeastLoadedScheduler):
+    """Select a chassis in proportion to its capacity
+
+    The capacity of a chassis is the weight set in the ovn-gateway-weight
+    key of its external_ids, 1 by default. The gateway routers are spread
+    so that the load of each chassis is proportional to its weight, a
+    chassis with a weight of 0 is only selected when no other candidate is
+    available. As with the leastloaded scheduler, the routers already
+    hosted by a candidate chassis are not moved, in particular when the
+    weights change.
+    """
+
+    def _get_chassis_weights(self, sb_idl):
+        return sb_idl.get_chassis_gateway_weights()
+
+    def _select_gateway_chassis(self, nb_idl, sb_idl, candidates):
+        weights = self._get_chassis_weights(sb_idl)
+        chassis_load = get_chassis_load(nb_idl)
+        if chassis_load is not None:
+            chassis_load.set_weights(weights)
+            return chassis_load.get_least_loaded(candidates)
+        chassis_bindings = nb_idl.get_all_chassis_router_bindings(candidates)
+
+        def _get_key(item):
+            chassis, routers = item
+            weight = weights.get(chassis, 1.0)
+            if weight <= 0:
+                return (float('inf'), chassis)
+            return ((len(routers) + 1) / weight, chassis)
+
+        return min(chassis_bindings.items(), key=_get_key)[0]
+
+
 OVN_SCHEDULER_STR_TO_CLASS = {
     OVN_SCHEDULER_CHANCE: OVNGatewayChanceScheduler,
-    OVN_SCHEDULER_LEAST_LOADED: OVNGatewayLeastLoadedScheduler
+    OVN_SCHEDULER_LEAST_LOADED: OVNGatewayLeastLoadedScheduler,
+    OVN_SCHEDULER_WEIGHTED: OVNGatewayWeightedScheduler,
     }
 
 
@@ -14,6 +14,7 @@
 
 import collections
 import netaddr
+import time
 
 from neutron_lib.api import validators
 from neutron_lib import constants as const
@@ -42,22 +43,50 @@ from networking_ovn._i18n import _, _LI, _LW
 from networking_ovn.common import acl as ovn_acl
 from networking_ovn.common import config
 from networking_ovn.common import constants as ovn_const
+from networking_ovn.common import journal
+from networking_ovn.common import metrics
 from networking_ovn.common import utils
+from networking_ovn.db import journal as journal_db
+from networking_ovn.db import segments as segments_db
 from networking_ovn.ml2 import qos_driver
 from networking_ovn.ml2 import trunk_driver
 from networking_ovn import ovn_db_sync
+from networking_ovn.ovsdb import commands as ovn_commands
 from networking_ovn.ovsdb import impl_idl_ovn
 from networking_ovn.ovsdb import ovsdb_monitor
 
 
 LOG = log.getLogger(__name__)
 
+# Attribute of the plugin context of a bulk request mapping the id of its
+# ports not yet created in OVN to their PortContext, or to None once
+# created in OVN with the other ports of the request
+BULK_PORTS_ATTR = '_ovn_bulk_ports'
+
 OvnPortInfo = collections.namedtuple('OvnPortInfo', ['type', 'options',
                                                      'addresses',
                                                      'port_security',
                                                      'parent_name', 'tag',
                                                      'dhcpv4_options'])
 
+# Logical_Switch_Port columns set by the driver and the neutron port
+# attributes they are derived from.
+LSP_COLUMNS_PORT_ATTRIBUTES = {
+    'addresses': ('mac_address', 'fixed_ips',
+                  ovn_const.OVN_PORT_BINDING_PROFILE),
+    'external_ids': ('name',),
+    'parent_name': (ovn_const.OVN_PORT_BINDING_PROFILE,),
+    'tag': (ovn_const.OVN_PORT_BINDING_PROFILE,),
+    'type': (ovn_const.OVN_PORT_BINDING_PROFILE,),
+    'options': (ovn_const.OVN_PORT_BINDING_PROFILE, 'qos_policy_id',
+                'device_owner'),
+    'enabled': ('admin_state_up',),
+    'port_security': (psec.PORTSECURITY, 'mac_address', 'fixed_ips',
+                      'allowed_address_pairs',
+                      ovn_const.OVN_PORT_BINDING_PROFILE),
+    'dhcpv4_options': ('extra_dhcp_opts', 'fixed_ips', 'device_owner'),
+}
+
 
 class OVNMechanismDriver(driver_api.MechanismDriver):
     """OVN ML2 mechanism driver
@@ -157,6 +186,8 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
     def post_fork_initialize(self, resource, event, trigger, **kwargs):
         # NOTE(rtheis): This will initialize all workers (API, RPC,
         # plugin service and OVN) with OVN IDL connections.
+        metrics.load_sink()
+        metrics.register_dump_signal()
         self._nb_ovn, self._sb_ovn = impl_idl_ovn.get_ovn_idls(self,
                                                                trigger)
 
@@ -179,6 +210,10 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
             )
             self.sb_synchronizer.sync()
 
+            if config.is_ovn_journal():
+                self.journal_processor = journal.JournalProcessor(self)
+                self.journal_processor.start()
+
     def _process_sg_notification(self, resource, event, trigger, **kwargs):
         sg = kwargs.get('security_group')
         external_ids = {ovn_const.OVN_SG_NAME_EXT_ID_KEY: sg['name']}
@@ -256,6 +291,11 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         of the current transaction.
         """
         self._validate_network_segments(context.network_segments)
+        if config.is_ovn_journal():
+            network = context.current
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_NETWORK, network['id'],
+                              ovn_const.OVN_JOURNAL_CREATE, network)
 
     def create_network_postcommit(self, context):
         """Create a network.
@@ -268,7 +308,12 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         drastically affect performance. Raising an exception will
         cause the deletion of the resource.
         """
-        network = context.current
+        if config.is_ovn_journal():
+            # Applied by the OVN worker
+            return
+        self.create_network(context.current)
+
+    def create_network(self, network):
         physnet = self._get_attribute(network, pnet.PHYSICAL_NETWORK)
         segid = self._get_attribute(network, pnet.SEGMENTATION_ID)
         self.create_network_in_ovn(network, {}, physnet, segid)
@@ -323,6 +368,13 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         state or state changes that it does not know or care about.
         """
         self._validate_network_segments(context.network_segments)
+        if config.is_ovn_journal():
+            network = context.current
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_NETWORK, network['id'],
+                              ovn_const.OVN_JOURNAL_UPDATE,
+                              {'current': network,
+                               'original': context.original})
 
     def update_network_postcommit(self, context):
         """Update a network.
@@ -340,12 +392,34 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         network state.  It is up to the mechanism driver to ignore
         state or state changes that it does not know or care about.
         """
-        network = context.current
-        original_network = context.original
+        if config.is_ovn_journal():
+            # Applied by the OVN worker
+            return
+        self.update_network(context.current, context.original)
+
+    def update_network(self, network, original_network):
         if network['name'] != original_network['name']:
             self._set_network_name(network['id'], network['name'])
         self.qos_driver.update_network(network, original_network)
 
+    def delete_network_precommit(self, context):
+        """Delete resources for a network.
+
+        :param context: NetworkContext instance describing the current
+        state of the network, prior to the call to delete it.
+
+        Delete network resources previously allocated by this
+        mechanism driver for a network. Called inside transaction
+        context on session. Runtime errors are not expected, but
+        raising an exception will result in rollback of the
+        transaction.
+        """
+        if config.is_ovn_journal():
+            network = context.current
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_NETWORK, network['id'],
+                              ovn_const.OVN_JOURNAL_DELETE, network)
+
     def delete_network_postcommit(self, context):
         """Delete a network.
 
@@ -358,7 +432,12 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         expected, and will not prevent the resource from being
         deleted.
         """
-        network = context.current
+        if config.is_ovn_journal():
+            # Applied by the OVN worker
+            return
+        self.delete_network(context.current)
+
+    def delete_network(self, network):
         self._nb_ovn.delete_lswitch(
             utils.ovn_name(network['id']), if_exists=True).execute(
                 check_error=True)
@@ -465,6 +544,27 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         port = context.current
         self.validate_and_get_data_from_binding_profile(port)
         self._insert_port_provisioning_block(context._plugin_context, port)
+        if config.is_ovn_journal():
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_PORT, port['id'],
+                              ovn_const.OVN_JOURNAL_CREATE, port)
+            return
+        plugin_context = context._plugin_context
+        if self._is_bulk_request(plugin_context):
+            bulk_ports = getattr(plugin_context, BULK_PORTS_ATTR, None)
+            if bulk_ports is None:
+                bulk_ports = collections.OrderedDict()
+                setattr(plugin_context, BULK_PORTS_ATTR, bulk_ports)
+            bulk_ports[port['id']] = context
+
+    @staticmethod
+    def _is_bulk_request(plugin_context):
+        # ML2 runs the precommit of all the ports of a bulk request in the
+        # transaction of the request, before any postcommit, while a single
+        # port is created in its own transaction. A single port created in
+        # the transaction of its caller is handled as a bulk of one port.
+        transaction = plugin_context.session.transaction
+        return getattr(transaction, '_parent', None) is not None
 
     def validate_and_get_data_from_binding_profile(self, port):
         if (ovn_const.OVN_PORT_BINDING_PROFILE not in port or
@@ -547,10 +647,48 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         will block the entire process so care should be taken to not
         drastically affect performance.  Raising an exception will
         result in the deletion of the resource.
+
+        When several ports are created by a bulk request, the precommit of
+        all the ports is done in the transaction of the request, before the
+        postcommit of the first one. The ports recorded by the precommits
+        of a bulk request are all created in OVN by the first postcommit,
+        sharing the security group and subnet lookups.
+
+        In journal mode, the ports are created by the OVN worker, several
+        ports created at about the same time being created at once.
         """
+        if config.is_ovn_journal():
+            return
         port = context.current
-        ovn_port_info = self.get_ovn_port_options(port)
-        self.create_port_in_ovn(port, ovn_port_info)
+        plugin_context = context._plugin_context
+        pending = getattr(plugin_context, BULK_PORTS_ATTR, None)
+        if not pending or port['id'] not in pending:
+            self.create_port_in_ovn(port, self.get_ovn_port_options(port))
+            return
+        if pending[port['id']] is None:
+            # Already created in OVN with the other ports of the request
+            del pending[port['id']]
+            return
+
+        del pending[port['id']]
+        port_contexts = [context]
+        if pending:
+            # Only create the ports committed to the DB, a retried request
+            # may have left ports of a rolled back transaction.
+            port_ids = set(p['id'] for p in self._plugin.get_ports(
+                plugin_context, filters={'id': list(pending)}, fields=['id']))
+            for port_id, port_context in list(pending.items()):
+                if port_context is not None and port_id in port_ids:
+                    port_contexts.append(port_context)
+                else:
+                    del pending[port_id]
+
+        ports = [(port_context.current,
+                  self.get_ovn_port_options(port_context.current))
+                 for port_context in port_contexts]
+        self.create_ports_in_ovn(ports)
+        for port_context in port_contexts[1:]:
+            pending[port_context.current['id']] = None
 
     def _get_allowed_addresses_from_port(self, port):
         if not port.get(psec.PORTSECURITY):
@@ -576,10 +714,22 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
 
         return list(allowed_addresses)
 
-    def get_ovn_port_options(self, port, qos_options=None):
+    def get_ovn_port_options(self, port, qos_options=None, columns=None):
+        """Get the Logical_Switch_Port columns of a port
+
+        :param port:         The neutron port
+        :param qos_options:  The QoS options of the port, looked up if None
+        :param columns:      The columns needed, all of them if None. The
+                             QoS and DHCP options are only looked up if the
+                             options and dhcpv4_options columns are needed.
+        :returns:            OvnPortInfo
+        """
         binding_profile = self.validate_and_get_data_from_binding_profile(port)
         if qos_options is None:
-            qos_options = self.qos_driver.get_qos_options(port)
+            if columns is None or 'options' in columns:
+                qos_options = self.qos_driver.get_qos_options(port)
+            else:
+                qos_options = {}
         vtep_physical_switch = binding_profile.get('vtep-physical-switch')
         parent_name = None
         tag = None
@@ -601,57 +751,103 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
                 addresses += ' ' + ip['ip_address']
             port_security = self._get_allowed_addresses_from_port(port)
 
-        port_dhcpv4_options_info = self.get_port_dhcpv4_options(port)
+        port_dhcpv4_options_info, add_dhcpv4_options_cmd = None, None
+        if columns is None or 'dhcpv4_options' in columns:
+            port_dhcpv4_options_info, add_dhcpv4_options_cmd = (
+                self._get_port_dhcpv4_options(port))
         dhcpv4_options = []
-        if port_dhcpv4_options_info and 'uuid' in port_dhcpv4_options_info:
+        if add_dhcpv4_options_cmd is not None:
+            # The DHCP_Options row of the port isn't created yet, the
+            # Logical_Switch_Port refers to the row inserted by the command
+            # in the same transaction.
+            dhcpv4_options = [add_dhcpv4_options_cmd]
+        elif (port_dhcpv4_options_info and
+              'uuid' in port_dhcpv4_options_info):
             dhcpv4_options = [port_dhcpv4_options_info['uuid']]
 
         return OvnPortInfo(port_type, options, [addresses], port_security,
                            parent_name, tag, dhcpv4_options)
 
     def create_port_in_ovn(self, port, ovn_port_info):
-        external_ids = {ovn_const.OVN_PORT_NAME_EXT_ID_KEY: port['name']}
-        lswitch_name = utils.ovn_name(port['network_id'])
+        self.create_ports_in_ovn([(port, ovn_port_info)])
+
+    def create_ports_in_ovn(self, ports):
+        """Create ports in OVN
+
+        The security group and subnet lookups are shared by all the ports,
+        and the ports are created in as few transactions as possible, with
+        at most OVN_BULK_PORTS_PER_TXN ports per transaction.
+
+        :param ports: list of (port, OvnPortInfo) tuples
+        """
         admin_context = n_context.get_admin_context()
         sg_cache = {}
         subnet_cache = {}
 
-        with self._nb_ovn.transaction(check_error=True) as txn:
-            # The lport_name *must* be neutron port['id'].  It must match the
-            # iface-id set in the Interfaces table of the Open_vSwitch
-            # database which nova sets to be the port ID.
-            txn.add(self._nb_ovn.create_lswitch_port(
-                    lport_name=port['id'],
-                    lswitch_name=lswitch_name,
-                    addresses=ovn_port_info.addresses,
-                    external_ids=external_ids,
-                    parent_name=ovn_port_info.parent_name,
-                    tag=ovn_port_info.tag,
-                    enabled=port.get('admin_state_up'),
-                    options=ovn_port_info.options,
-                    type=ovn_port_info.type,
-                    port_security=ovn_port_info.port_security,
-                    dhcpv4_options=ovn_port_info.dhcpv4_options))
-
-            acls_new = ovn_acl.add_acls(self._plugin, admin_context,
-                                        port, sg_cache, subnet_cache)
-            for acl in acls_new:
-                txn.add(self._nb_ovn.add_acl(**acl))
-
-            sg_ids = port.get('security_groups', [])
-            if port.get('fixed_ips') and sg_ids:
-                addresses = ovn_acl.acl_port_ips(port)
-                # NOTE(rtheis): Fail port creation if the address set doesn't
-                # exist. This prevents ports from being created on any security
-                # groups out-of-sync between neutron and OVN.
-                for sg_id in sg_ids:
-                    for ip_version in addresses:
-                        if addresses[ip_version]:
-                            txn.add(self._nb_ovn.update_address_set(
-                                name=utils.ovn_addrset_name(sg_id, ip_version),
-                                addrs_add=addresses[ip_version],
-                                addrs_remove=None,
-                                if_exists=False))
+        for i in six.moves.range(0, len(ports),
+                                 ovn_const.OVN_BULK_PORTS_PER_TXN):
+            chunk = ports[i:i + ovn_const.OVN_BULK_PORTS_PER_TXN]
+            # Addresses added to each address set by the ports of the chunk
+            addr_sets = collections.OrderedDict()
+            with self._nb_ovn.transaction(check_error=True) as txn:
+                for port, ovn_port_info in chunk:
+                    self._add_create_port_commands(
+                        txn, admin_context, port, ovn_port_info, sg_cache,
+                        subnet_cache, addr_sets)
+
+                # NOTE(rtheis): Fail port creation if the address set
+                # doesn't exist. This prevents ports from being created on
+                # any security groups out-of-sync between neutron and OVN.
+                for addr_set_name, addresses in addr_sets.items():
+                    txn.add(self._nb_ovn.update_address_set(
+                        name=addr_set_name,
+                        addrs_add=addresses,
+                        addrs_remove=None,
+                        if_exists=False))
+
+    def _add_create_port_commands(self, txn, admin_context, port,
+                                  ovn_port_info, sg_cache, subnet_cache,
+                                  addr_sets):
+        external_ids = {ovn_const.OVN_PORT_NAME_EXT_ID_KEY: port['name']}
+        if config.get_ovn_port_activation_tracker_size():
+            # The activation latency of the port is measured from its
+            # commit by the OvnWorker
+            external_ids[ovn_const.OVN_PORT_CREATED_AT_EXT_ID_KEY] = (
+                '%.6f' % time.time())
+        lswitch_name = utils.ovn_name(port['network_id'])
+
+        self._add_port_dhcpv4_options_commands(txn, ovn_port_info)
+
+        # The lport_name *must* be neutron port['id'].  It must match the
+        # iface-id set in the Interfaces table of the Open_vSwitch
+        # database which nova sets to be the port ID.
+        txn.add(self._nb_ovn.create_lswitch_port(
+                lport_name=port['id'],
+                lswitch_name=lswitch_name,
+                addresses=ovn_port_info.addresses,
+                external_ids=external_ids,
+                parent_name=ovn_port_info.parent_name,
+                tag=ovn_port_info.tag,
+                enabled=port.get('admin_state_up'),
+                options=ovn_port_info.options,
+                type=ovn_port_info.type,
+                port_security=ovn_port_info.port_security,
+                dhcpv4_options=ovn_port_info.dhcpv4_options))
+
+        acls_new = ovn_acl.add_acls(self._plugin, admin_context,
+                                    port, sg_cache, subnet_cache)
+        for acl in acls_new:
+            txn.add(self._nb_ovn.add_acl(**acl))
+
+        sg_ids = port.get('security_groups', [])
+        if port.get('fixed_ips') and sg_ids:
+            addresses = ovn_acl.acl_port_ips(port)
+            for sg_id in sg_ids:
+                for ip_version in addresses:
+                    if addresses[ip_version]:
+                        addr_sets.setdefault(
+                            utils.ovn_addrset_name(sg_id, ip_version),
+                            []).extend(addresses[ip_version])
 
     def update_port_precommit(self, context):
         """Update resources of a port.
@@ -668,7 +864,16 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         state. It is up to the mechanism driver to ignore state or
         state changes that it does not know or care about.
         """
-        self.validate_and_get_data_from_binding_profile(context.current)
+        port = context.current
+        original_port = context.original
+        self.validate_and_get_data_from_binding_profile(port)
+        if config.is_ovn_journal() and (
+                self._get_changed_lsp_columns(port, original_port) or
+                self._security_groups_changed(port, original_port)):
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_PORT, port['id'],
+                              ovn_const.OVN_JOURNAL_UPDATE,
+                              {'current': port, 'original': original_port})
 
     def update_port_postcommit(self, context):
         """Update a port.
@@ -686,33 +891,74 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         state. It is up to the mechanism driver to ignore state or
         state changes that it does not know or care about.
         """
-        port = context.current
-        original_port = context.original
-        self.update_port(port, original_port)
+        if config.is_ovn_journal():
+            # Applied by the OVN worker
+            return
+        self.update_port(context.current, context.original)
+
+    def _get_changed_lsp_columns(self, port, original_port):
+        columns = set()
+        for column, attributes in LSP_COLUMNS_PORT_ATTRIBUTES.items():
+            for attribute in attributes:
+                if port.get(attribute) != original_port.get(attribute):
+                    columns.add(column)
+                    break
+        return columns
+
+    def _security_groups_changed(self, port, original_port):
+        return (set(original_port.get('security_groups', [])) !=
+                set(port.get('security_groups', [])))
 
     def update_port(self, port, original_port, qos_options=None):
-        ovn_port_info = self.get_ovn_port_options(port, qos_options)
-        self._update_port_in_ovn(original_port, port, ovn_port_info)
+        """Update a port in OVN
+
+        Only the Logical_Switch_Port columns derived from the port
+        attributes changed between original_port and port are written,
+        and nothing is done if none of them, the security groups or the
+        fixed IPs changed. If qos_options is given, the options column
+        is written too.
+        """
+        columns = self._get_changed_lsp_columns(port, original_port)
+        if qos_options is not None:
+            columns.add('options')
+        if (not columns and
+                not self._security_groups_changed(port, original_port)):
+            LOG.debug('No OVN relevant change for port %s', port['id'])
+            return
+
+        ovn_port_info = self.get_ovn_port_options(port, qos_options,
+                                                  columns=columns)
+        self._update_port_in_ovn(original_port, port, ovn_port_info,
+                                 columns=columns)
 
-    def _update_port_in_ovn(self, original_port, port, ovn_port_info):
+    def _update_port_in_ovn(self, original_port, port, ovn_port_info,
+                            columns=None):
         external_ids = {
             ovn_const.OVN_PORT_NAME_EXT_ID_KEY: port['name']}
         admin_context = n_context.get_admin_context()
         sg_cache = {}
         subnet_cache = {}
 
+        lsp_columns = {'addresses': ovn_port_info.addresses,
+                       'external_ids': external_ids,
+                       'parent_name': ovn_port_info.parent_name,
+                       'tag': ovn_port_info.tag,
+                       'type': ovn_port_info.type,
+                       'options': ovn_port_info.options,
+                       'enabled': port['admin_state_up'],
+                       'port_security': ovn_port_info.port_security,
+                       'dhcpv4_options': ovn_port_info.dhcpv4_options}
+        if columns is not None:
+            lsp_columns = dict((column, value)
+                               for column, value in lsp_columns.items()
+                               if column in columns)
+
         with self._nb_ovn.transaction(check_error=True) as txn:
-            txn.add(self._nb_ovn.set_lswitch_port(
-                    lport_name=port['id'],
-                    addresses=ovn_port_info.addresses,
-                    external_ids=external_ids,
-                    parent_name=ovn_port_info.parent_name,
-                    tag=ovn_port_info.tag,
-                    type=ovn_port_info.type,
-                    options=ovn_port_info.options,
-                    enabled=port['admin_state_up'],
-                    port_security=ovn_port_info.port_security,
-                    dhcpv4_options=ovn_port_info.dhcpv4_options))
+            if 'dhcpv4_options' in lsp_columns:
+                self._add_port_dhcpv4_options_commands(txn, ovn_port_info)
+            if lsp_columns:
+                txn.add(self._nb_ovn.set_lswitch_port(
+                        lport_name=port['id'], **lsp_columns))
 
             # Determine if security groups or fixed IPs are updated.
             old_sg_ids = set(original_port.get('security_groups', []))
@@ -793,11 +1039,21 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
             # since this port no longer refers it.
             return self._nb_ovn.delete_dhcp_options(lsp_dhcp_options['uuid'])
 
-    def get_port_dhcpv4_options(self, port):
+    def _get_port_dhcpv4_options(self, port):
+        """Get the DHCPv4 options of a port
+
+        :returns: a (dhcpv4_options, add_cmd) tuple. dhcpv4_options is None
+                  if the port doesn't use DHCPv4. If the port has extra
+                  DHCP options, add_cmd is the (not yet committed) command
+                  adding or updating the DHCP_Options row of the port and
+                  dhcpv4_options the columns of this row. Otherwise add_cmd
+                  is None and dhcpv4_options is the DHCP_Options row of the
+                  subnet.
+        """
         lsp_dhcp_disabled, lsp_dhcpv4_opts = utils.get_lsp_dhcpv4_opts(port)
 
         if lsp_dhcp_disabled:
-            return
+            return None, None
 
         # If the port has multiple IPv4 addresses, DHCPv4 options are set
         # for the first address in port['fixed_ips']
@@ -814,15 +1070,30 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         if not subnet_dhcp_options:
             # Ideally this should not happen.
             # May be a sync is required in such cases ?
-            return
+            return None, None
 
         if not lsp_dhcpv4_opts:
-            return subnet_dhcp_options
+            return subnet_dhcp_options, None
 
         # This port has extra DHCP options defined.
         # So we need to create a new row in DHCP_Options table for this
         # port.
-        #
+        subnet_dhcp_options['options'].update(lsp_dhcpv4_opts)
+        subnet_dhcp_options['external_ids'].update(
+            {'port_id': port['id']})
+        subnet_dhcp_options.pop('uuid', None)
+        add_cmd = self._nb_ovn.add_dhcp_options(
+            subnet_id, port_id=port['id'],
+            cidr=subnet_dhcp_options['cidr'],
+            options=subnet_dhcp_options['options'],
+            external_ids=subnet_dhcp_options['external_ids'])
+        return subnet_dhcp_options, add_cmd
+
+    def get_port_dhcpv4_options(self, port):
+        dhcpv4_options, add_cmd = self._get_port_dhcpv4_options(port)
+        if add_cmd is None:
+            return dhcpv4_options
+
         # TODO(numans) In cases where the below transaction is successful
         # but the Logical_Switch_Port create or update transaction fails
         # we need to delete the DHCP_Options row created else it will be
@@ -832,19 +1103,39 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         # the Logical_Switch_Port get deleted before setting port dhcp options
         # to it, we will delete the DHCP_Options row created to make sure
         # no orphan left behind.
-        subnet_dhcp_options['options'].update(lsp_dhcpv4_opts)
-        subnet_dhcp_options['external_ids'].update(
-            {'port_id': port['id']})
         LOG.debug('Creating port dhcp options for port %s in OVN NB DB',
                   port['id'])
         with self._nb_ovn.transaction(check_error=True) as txn:
-            txn.add(self._nb_ovn.add_dhcp_options(
-                subnet_id, port_id=port['id'],
-                cidr=subnet_dhcp_options['cidr'],
-                options=subnet_dhcp_options['options'],
-                external_ids=subnet_dhcp_options['external_ids']))
+            txn.add(add_cmd)
+
+        return self._nb_ovn.get_port_dhcp_options(
+            dhcpv4_options['external_ids']['subnet_id'], port['id'])
+
+    def _add_port_dhcpv4_options_commands(self, txn, ovn_port_info):
+        # The DHCP_Options row of a port with extra DHCP options is added
+        # by the transaction creating or updating the port, so that the
+        # port can't refer to a missing row or leave an orphan row behind.
+        for dhcpv4_options in ovn_port_info.dhcpv4_options:
+            if isinstance(dhcpv4_options, ovn_commands.AddDHCPOptionsCommand):
+                LOG.debug('Creating port dhcp options for port %s in OVN NB '
+                          'DB', dhcpv4_options.port_id)
+                txn.add(dhcpv4_options)
+
+    def delete_port_precommit(self, context):
+        """Delete resources of a port.
+
+        :param context: PortContext instance describing the current
+        state of the port, prior to the call to delete it.
 
-        return self._nb_ovn.get_port_dhcp_options(subnet_id, port['id'])
+        Called inside transaction context on session. Runtime errors
+        are not expected, but raising an exception will result in
+        rollback of the transaction.
+        """
+        if config.is_ovn_journal():
+            port = context.current
+            journal_db.record(context._plugin_context,
+                              ovn_const.OVN_JOURNAL_PORT, port['id'],
+                              ovn_const.OVN_JOURNAL_DELETE, port)
 
     def delete_port_postcommit(self, context):
         """Delete a port.
@@ -858,7 +1149,12 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         expected, and will not prevent the resource from being
         deleted.
         """
-        port = context.current
+        if config.is_ovn_journal():
+            # Applied by the OVN worker
+            return
+        self.delete_port(context.current)
+
+    def delete_port(self, port):
         with self._nb_ovn.transaction(check_error=True) as txn:
             txn.add(self._nb_ovn.delete_lswitch_port(port['id'],
                     utils.ovn_name(port['network_id'])))
@@ -1023,17 +1319,46 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         """Update SegmentHostMapping in DB"""
         if not host:
             return
+        self.update_segment_host_mappings({host: phy_nets})
 
-        ctx = n_context.get_admin_context()
-        segments = segment_service_db.get_segments_with_phys_nets(
-            ctx, phy_nets)
+    def update_segment_host_mappings(self, host_phynets_map,
+                                     all_hosts=False):
+        """Update the SegmentHostMapping of several hosts in DB
 
-        available_seg_ids = {
-            segment['id'] for segment in segments
-            if segment['network_type'] in ('flat', 'vlan')}
+        The segments of all the physical networks are queried at once and
+        only the mappings which changed are written.
 
-        segment_service_db.update_segment_host_mapping(
-            ctx, host, available_seg_ids)
+        :param host_phynets_map: dictionary of host to the list of its
+                                 physical networks
+        :param all_hosts:        Whether host_phynets_map holds all the
+                                 hosts, the mappings of the other hosts are
+                                 then deleted
+        """
+        host_phynets_map = dict((host, phy_nets) for host, phy_nets
+                                in host_phynets_map.items() if host)
+        ctx = n_context.get_admin_context()
+        phy_nets = set()
+        for host_phy_nets in host_phynets_map.values():
+            phy_nets.update(host_phy_nets)
+        segments = segment_service_db.get_segments_with_phys_nets(
+            ctx, list(phy_nets))
+
+        phynet_seg_ids = collections.defaultdict(set)
+        for segment in segments:
+            if segment['network_type'] in ('flat', 'vlan'):
+                phynet_seg_ids[segment['physical_network']].add(segment['id'])
+        host_seg_ids = {}
+        for host, host_phy_nets in host_phynets_map.items():
+            host_seg_ids[host] = set()
+            for phy_net in host_phy_nets:
+                host_seg_ids[host].update(phynet_seg_ids.get(phy_net, ()))
+
+        added, deleted = segments_db.update_segment_host_mappings(
+            ctx, host_seg_ids, all_hosts=all_hosts)
+        LOG.debug('SegmentHostMapping of %(hosts)d hosts updated: %(added)d '
+                  'mappings added, %(deleted)d deleted',
+                  {'hosts': len(host_seg_ids), 'added': added,
+                   'deleted': deleted})
 
     def _add_segment_host_mapping_for_segment(self, resource, event, trigger,
                                               context, segment):
@@ -1041,7 +1366,5 @@ class OVNMechanismDriver(driver_api.MechanismDriver):
         if not phynet:
             return
 
-        host_phynets_map = self._sb_ovn.get_chassis_hostname_and_physnets()
-        hosts = {host for host, phynets in six.iteritems(host_phynets_map)
-                 if phynet in phynets}
+        hosts = self._sb_ovn.get_chassis_hosts_with_physnet(phynet)
         segment_service_db.map_segment_to_hosts(context, segment.id, hosts)
@@ -10,6 +10,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from oslo_log import log as logging
 
 from neutron_lib import constants
@@ -22,10 +24,17 @@ from neutron.plugins.ml2 import plugin as ml2_plugin
 from neutron.services.qos.notification_drivers import qos_base
 
 from networking_ovn._i18n import _LI
+from networking_ovn.common import config
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.ovsdb import transaction as ovn_txn
 
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of entries of each QoS cache, the expired entries are
+# purged once it is reached
+QOS_CACHE_SIZE = 10000
+
 
 class OVNQosNotificationDriver(qos_base.QosServiceNotificationDriverBase):
     """OVN notification driver for QoS."""
@@ -54,18 +63,30 @@ class OVNQosNotificationDriver(qos_base.QosServiceNotificationDriverBase):
         self._driver.qos_driver.update_policy(context, policy)
 
     def delete_policy(self, context, policy):
-        # No need to update OVN on delete
-        pass
+        # No need to update OVN on delete, a policy in use can't be deleted
+        self._driver.qos_driver.delete_policy(context, policy)
 
 
 class OVNQosDriver(object):
-    """Qos driver for OVN"""
+    """Qos driver for OVN
+
+    The QoS options of the policies and the QoS policies of the networks
+    are cached for ovn_qos_cache_timeout seconds, if set, so that the QoS
+    options of the ports are usually found without any DB query. The caches
+    are updated when the driver is notified of the changes of the policies
+    and of the networks, the changes notified to the other neutron server
+    processes being picked up when the entries expire.
+    """
 
     def __init__(self, driver):
         LOG.info(_LI("Starting OVNQosDriver"))
         super(OVNQosDriver, self).__init__()
         self._driver = driver
         self._plugin_property = None
+        # policy id -> (expiration time, QoS options)
+        self._policy_options = {}
+        # network id -> (expiration time, QoS policy id)
+        self._network_policies = {}
 
     @property
     def _plugin(self):
@@ -80,9 +101,47 @@ class OVNQosDriver(object):
             return True
         return False
 
+    @staticmethod
+    def _get_cached(cache, key):
+        """Get the cached value of key
+
+        :returns: tuple of whether key is cached and of its value
+        """
+        entry = cache.get(key)
+        if entry is None or entry[0] <= time.time():
+            return False, None
+        return True, entry[1]
+
+    @staticmethod
+    def _set_cached(cache, key, value):
+        timeout = config.get_ovn_qos_cache_timeout()
+        if not timeout:
+            return
+        now = time.time()
+        if key not in cache and len(cache) >= QOS_CACHE_SIZE:
+            for expired in [k for k, (expires_at, _v) in cache.items()
+                            if expires_at <= now]:
+                del cache[expired]
+            if len(cache) >= QOS_CACHE_SIZE:
+                cache.clear()
+        cache[key] = (now + timeout, value)
+
+    def _get_network_policy_id(self, context, network_id):
+        cached, policy_id = self._get_cached(self._network_policies,
+                                             network_id)
+        if not cached:
+            network_policy = qos_policy.QosPolicy.get_network_policy(
+                context, network_id)
+            policy_id = network_policy.id if network_policy else None
+            self._set_cached(self._network_policies, network_id, policy_id)
+        return policy_id
+
     def _generate_port_options(self, context, policy_id):
         if policy_id is None:
             return {}
+        cached, options = self._get_cached(self._policy_options, policy_id)
+        if cached:
+            return dict(options)
         options = {}
         # The policy might not have any rules
         all_rules = qos_rule.get_rules(context, policy_id)
@@ -92,6 +151,7 @@ class OVNQosDriver(object):
                     options['policing_rate'] = str(rule.max_kbps)
                 if rule.max_burst_kbps:
                     options['policing_burst'] = str(rule.max_burst_kbps)
+        self._set_cached(self._policy_options, policy_id, dict(options))
         return options
 
     def get_qos_options(self, port):
@@ -107,28 +167,46 @@ class OVNQosDriver(object):
         port_policy_id = port.get('qos_policy_id')
         network_policy_id = None
         if not port_policy_id:
-            network_policy = qos_policy.QosPolicy.get_network_policy(
+            network_policy_id = self._get_network_policy_id(
                 context, port['network_id'])
-            network_policy_id = network_policy.id if network_policy else None
 
         # Generate qos options for the selected policy
         policy_id = port_policy_id or network_policy_id
         return self._generate_port_options(context, policy_id)
 
-    def _update_network_ports(self, context, network_id, options):
-        # Retrieve all ports for this network
+    def _is_vtep_port(self, port):
+        # The options of the VTEP ports don't include the QoS options
+        binding_profile = port.get(ovn_const.OVN_PORT_BINDING_PROFILE) or {}
+        return 'vtep-physical-switch' in binding_profile
+
+    def _update_ports_options(self, ports, options):
+        """Set the QoS options of the ports
+
+        Only the QoS options of the Logical_Switch_Ports are changed, all
+        the ports being updated with a single command, split by the
+        transaction in parts of up to ovn_txn_max_size ports.
+        """
+        lport_names = [port['id'] for port in ports
+                       if not self._is_vtep_port(port)]
+        if not lport_names:
+            return
+        with ovn_txn.background():
+            self._driver._nb_ovn.set_lswitch_ports_qos_options(
+                lport_names, options, if_exists=True).execute(
+                    check_error=True)
+
+    def _get_network_ports(self, context, network_ids):
+        # Retrieve all ports for these networks
         ports = self._plugin.get_ports(context,
-                                       filters={'network_id': [network_id]})
-        for port in ports:
-            # Don't apply qos rules if port has a policy
-            port_policy_id = port.get('qos_policy_id')
-            if port_policy_id:
-                continue
-            # Don't apply qos rules to network devices
-            if self._is_network_device_port(port):
-                continue
-            # Call into mech driver to update port
-            self._driver.update_port(port, port, options)
+                                       filters={'network_id': network_ids})
+        # Don't apply qos rules if port has a policy, nor to network devices
+        return [port for port in ports
+                if not port.get('qos_policy_id') and
+                not self._is_network_device_port(port)]
+
+    def _update_network_ports(self, context, network_id, options):
+        self._update_ports_options(
+            self._get_network_ports(context, [network_id]), options)
 
     def update_network(self, network, original_network):
         # Is qos service enabled
@@ -139,6 +217,8 @@ class OVNQosDriver(object):
         old_network_policy_id = original_network.get('qos_policy_id')
         if network_policy_id == old_network_policy_id:
             return
+        self._set_cached(self._network_policies, network.get('id'),
+                         network_policy_id)
 
         # Update the qos options on each network port
         context = n_context.get_admin_context()
@@ -146,15 +226,22 @@ class OVNQosDriver(object):
         self._update_network_ports(context, network.get('id'), options)
 
     def update_policy(self, context, policy):
+        # The rules of the policy may have changed
+        self._policy_options.pop(policy.id, None)
         options = self._generate_port_options(context, policy.id)
 
-        # Update each network bound to this policy
+        # Update the ports of the networks bound to this policy and the
+        # ports bound to this policy together
+        ports = []
         network_bindings = policy.get_bound_networks()
-        for network_id in network_bindings:
-            self._update_network_ports(context, network_id, options)
-
-        # Update each port bound to this policy
+        if network_bindings:
+            ports.extend(self._get_network_ports(context,
+                                                 list(network_bindings)))
         port_bindings = policy.get_bound_ports()
-        for port_id in port_bindings:
-            port = self._plugin.get_port(context, port_id)
-            self._driver.update_port(port, port, options)
+        if port_bindings:
+            ports.extend(self._plugin.get_ports(
+                context, filters={'id': list(port_bindings)}))
+        self._update_ports_options(ports, options)
+
+    def delete_policy(self, context, policy):
+        self._policy_options.pop(policy.id, None)
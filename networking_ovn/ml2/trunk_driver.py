@@ -10,13 +10,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
+from eventlet import greenthread
 from oslo_config import cfg
+from oslo_log import log
 
+from networking_ovn._i18n import _LE, _LW
 from networking_ovn.common.constants import OVN_ML2_MECH_DRIVER_NAME
 
 from neutron.callbacks import events
 from neutron.callbacks import registry
+from neutron import context as n_context
 from neutron.extensions import portbindings
+from neutron.objects import trunk as trunk_objects
 from neutron.services.trunk import constants as trunk_consts
 from neutron.services.trunk.drivers import base as trunk_base
 
@@ -30,41 +37,148 @@ SUPPORTED_SEGMENTATION_TYPES = (
     trunk_consts.VLAN,
 )
 
+LOG = log.getLogger(__name__)
+
 
 class OVNTrunkHandler(object):
+    """Apply the trunk and subport events to the OVN_Northbound DB
+
+    Events are coalesced: the subport changes of all the trunks received
+    within COALESCE_INTERVAL seconds are applied with a single command,
+    the last change of a subport winning, followed by a single status
+    update of each trunk changed. If the command fails, the changes of each
+    trunk are applied with their own command, so that a trunk failing
+    doesn't fail the others. The changes of a failed trunk are retried
+    after RETRY_INTERVAL seconds, up to MAX_RETRIES times, before its
+    status is set to ERROR.
+    """
+
+    COALESCE_INTERVAL = 0.1
+    RETRY_INTERVAL = 1
+    MAX_RETRIES = 3
+
     def __init__(self, plugin_driver):
         self.plugin_driver = plugin_driver
-
-    def _set_sub_ports(self, parent_port, subports):
-        _nb_ovn = self.plugin_driver._nb_ovn
-        with _nb_ovn.transaction(check_error=True) as txn:
-            for port in subports:
-                txn.add(_nb_ovn.set_lswitch_port(port.port_id,
-                                                 parent_name=parent_port,
-                                                 tag=port.segmentation_id))
-
-    def _unset_sub_ports(self, subports):
-        _nb_ovn = self.plugin_driver._nb_ovn
-        with _nb_ovn.transaction(check_error=True) as txn:
-            for port in subports:
-                txn.add(_nb_ovn.set_lswitch_port(port.port_id,
-                                                 parent_name=[],
-                                                 tag=[]))
+        # subport port id -> (trunk id, (parent port id, tag)), waiting to
+        # be applied
+        self._pending_subports = {}
+        # trunk id -> whether to update the status of the trunk, False if
+        # the trunk was deleted
+        self._pending_trunks = {}
+        # trunk id -> number of times the changes of the trunk failed
+        self._retries = {}
+        self._flush_thread = None
+
+    def _schedule_flush(self, delay):
+        if self._flush_thread is None:
+            self._flush_thread = greenthread.spawn_after(delay, self._flush)
+
+    def _queue(self, trunk, subports, parent_name, update_status):
+        # The parent and tag of the subports are unset if parent_name is
+        # None
+        for port in subports:
+            if parent_name is None:
+                change = ([], [])
+            else:
+                change = (parent_name, port.segmentation_id)
+            self._pending_subports[port.port_id] = (trunk.id, change)
+        self._pending_trunks[trunk.id] = update_status
+        self._schedule_flush(self.COALESCE_INTERVAL)
+
+    def _set_subports_parent(self, changes):
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent(
+            changes, if_exists=True).execute(check_error=True)
+
+    def _apply(self, subports):
+        """Apply the subport changes to the OVN_Northbound DB
+
+        :returns: The ids of the trunks whose changes failed
+        """
+        trunk_changes = collections.defaultdict(dict)
+        for port_id, (trunk_id, change) in subports.items():
+            trunk_changes[trunk_id][port_id] = change
+        if len(trunk_changes) > 1:
+            try:
+                self._set_subports_parent(
+                    dict((port_id, change) for port_id, (_trunk_id, change)
+                         in subports.items()))
+                return set()
+            except Exception:
+                LOG.warning(_LW('Failed to update the subports of %d '
+                                'trunks at once, updating them trunk by '
+                                'trunk'), len(trunk_changes))
+        failed = set()
+        for trunk_id, changes in trunk_changes.items():
+            try:
+                self._set_subports_parent(changes)
+            except Exception:
+                LOG.exception(_LE('Failed to update the subports %(ports)s '
+                                  'of trunk %(trunk)s'),
+                              {'ports': sorted(changes), 'trunk': trunk_id})
+                failed.add(trunk_id)
+        return failed
+
+    def _retry(self, failed, subports, trunks):
+        """Queue again the changes of the failed trunks
+
+        :returns: The ids of the trunks retried, the others gave up
+        """
+        retried = set()
+        for trunk_id in failed:
+            retries = self._retries.get(trunk_id, 0) + 1
+            if retries > self.MAX_RETRIES:
+                LOG.error(_LE('Giving up updating the subports of trunk '
+                              '%s'), trunk_id)
+                continue
+            self._retries[trunk_id] = retries
+            retried.add(trunk_id)
+        for trunk_id in trunks:
+            if trunk_id not in retried:
+                self._retries.pop(trunk_id, None)
+        if not retried:
+            return retried
+        # The changes queued meanwhile are newer
+        for port_id, (trunk_id, change) in subports.items():
+            if trunk_id in retried:
+                self._pending_subports.setdefault(port_id,
+                                                  (trunk_id, change))
+        for trunk_id in retried:
+            self._pending_trunks.setdefault(trunk_id, trunks[trunk_id])
+        self._schedule_flush(self.RETRY_INTERVAL)
+        return retried
+
+    def _flush(self):
+        self._flush_thread = None
+        subports, self._pending_subports = self._pending_subports, {}
+        trunks, self._pending_trunks = self._pending_trunks, {}
+        failed = self._apply(subports)
+        retried = self._retry(failed, subports, trunks)
+        context = n_context.get_admin_context()
+        for trunk_id, update_status in trunks.items():
+            if not update_status or trunk_id in retried:
+                continue
+            status = (trunk_consts.ERROR_STATUS if trunk_id in failed
+                      else trunk_consts.ACTIVE_STATUS)
+            try:
+                trunk = trunk_objects.Trunk.get_object(context, id=trunk_id)
+                # The trunk may have been deleted in the meantime
+                if trunk is not None:
+                    trunk.update(status=status)
+            except Exception:
+                LOG.exception(_LE('Failed to update the status of trunk '
+                                  '%s'), trunk_id)
 
     def trunk_created(self, trunk):
-        self._set_sub_ports(trunk.port_id, trunk.sub_ports)
-        trunk.update(status=trunk_consts.ACTIVE_STATUS)
+        self._queue(trunk, trunk.sub_ports, trunk.port_id, True)
 
     def trunk_deleted(self, trunk):
-        self._unset_sub_ports(trunk.sub_ports)
+        self._queue(trunk, trunk.sub_ports, None, False)
 
     def subports_added(self, trunk, subports):
-        self._set_sub_ports(trunk.port_id, subports)
-        trunk.update(status=trunk_consts.ACTIVE_STATUS)
+        self._queue(trunk, subports, trunk.port_id, True)
 
     def subports_deleted(self, trunk, subports):
-        self._unset_sub_ports(subports)
-        trunk.update(status=trunk_consts.ACTIVE_STATUS)
+        self._queue(trunk, subports, None, True)
 
     def trunk_event(self, resource, event, trunk_plugin, payload):
         if event == events.AFTER_CREATE:
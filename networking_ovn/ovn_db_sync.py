@@ -18,18 +18,17 @@ import itertools
 from neutron_lib import constants
 from oslo_log import log
 
-from neutron.common import utils as n_utils
 from neutron import context
 from neutron.extensions import providernet as pnet
 from neutron import manager
 from neutron.plugins.common import constants as service_constants
-from neutron.services.segments import db as segments_db
 
 from networking_ovn._i18n import _LW
 from networking_ovn.common import acl as acl_utils
 from networking_ovn.common import config
 from networking_ovn.common import constants as const
 from networking_ovn.common import utils
+from networking_ovn.ovsdb import transaction as ovn_txn
 import six
 
 LOG = log.getLogger(__name__)
@@ -75,10 +74,12 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         LOG.debug("Starting OVN-Northbound DB sync process")
 
         ctx = context.get_admin_context()
-        self.sync_address_sets(ctx)
-        self.sync_networks_ports_and_dhcp_opts(ctx)
-        self.sync_acls(ctx)
-        self.sync_routers_and_rports(ctx)
+        # Don't delay the API requests while the DB is synchronized
+        with ovn_txn.background():
+            self.sync_address_sets(ctx)
+            self.sync_networks_ports_and_dhcp_opts(ctx)
+            self.sync_acls(ctx)
+            self.sync_routers_and_rports(ctx)
 
     @staticmethod
     def _get_attribute(obj, attribute):
@@ -311,11 +312,12 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
 
         interfaces = self.l3_plugin._get_sync_interfaces(ctx,
                                                          db_routers.keys())
+        interface_networks = self.l3_plugin.get_networks_for_lrouter_ports(
+            ctx, interfaces)
         for interface in interfaces:
             db_router_ports[interface['id']] = interface
             db_router_ports[interface['id']]['networks'] = sorted(
-                self.l3_plugin.get_networks_for_lrouter_port(
-                    ctx, interface['fixed_ips']))
+                interface_networks[interface['id']])
         lrouters = self.ovn_api.get_all_logical_routers_with_rports()
         del_lrouters_list = []
         del_lrouter_ports_list = []
@@ -338,7 +340,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                 else:
                     db_routes = []
                 ovn_routes = lrouter['static_routes']
-                add_routes, del_routes = n_utils.diff_list_of_dict(
+                add_routes, del_routes = utils.get_static_route_changes(
                     ovn_routes, db_routes)
                 update_sroutes_list.append({'id': lrouter['name'],
                                             'add': add_routes,
@@ -420,11 +422,6 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                     if self.mode == SYNC_MODE_REPAIR:
                         LOG.warning(_LW("Add static routes %s to OVN NB DB"),
                                     sroute['add'])
-                        for route in sroute['add']:
-                            txn.add(self.ovn_api.add_static_route(
-                                utils.ovn_name(sroute['id']),
-                                ip_prefix=route['destination'],
-                                nexthop=route['nexthop']))
                 if sroute['del']:
                     LOG.warning(_LW("Router %(id)s static routes %(route)s "
                                     "found in OVN but not in Neutron"),
@@ -432,11 +429,13 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                     if self.mode == SYNC_MODE_REPAIR:
                         LOG.warning(_LW("Delete static routes %s from OVN "
                                         "NB DB"), sroute['del'])
-                        for route in sroute['del']:
-                            txn.add(self.ovn_api.delete_static_route(
-                                utils.ovn_name(sroute['id']),
-                                ip_prefix=route['destination'],
-                                nexthop=route['nexthop']))
+                if self.mode == SYNC_MODE_REPAIR and (
+                        sroute['add'] or sroute['del']):
+                    txn.add(self.ovn_api.update_static_routes(
+                        utils.ovn_name(sroute['id']),
+                        add_routes=utils.get_static_route_keys(sroute['add']),
+                        del_routes=utils.get_static_route_keys(
+                            sroute['del'])))
         LOG.debug('OVN-NB Sync routers and router ports finished')
 
     def _sync_subnet_dhcp_options(self, ctx, db_networks,
@@ -680,28 +679,9 @@ class OvnSbSynchronizer(OvnDbSynchronizer):
     def sync_hostname_and_physical_networks(self, ctx):
         LOG.debug('OVN-SB Sync hostname and physical networks started')
         host_phynets_map = self.ovn_api.get_chassis_hostname_and_physnets()
-        current_hosts = set(host_phynets_map)
-        previous_hosts = segments_db.get_hosts_mapped_with_segments(ctx)
-
-        stale_hosts = previous_hosts - current_hosts
-        for host in stale_hosts:
-            LOG.debug('Stale host %s found in Neutron, but not in OVN SB DB. '
-                      'Clear its SegmentHostMapping in Neutron', host)
-            self.ovn_driver.update_segment_host_mapping(host, [])
-
-        new_hosts = current_hosts - previous_hosts
-        for host in new_hosts:
-            LOG.debug('New host %s found in OVN SB DB, but not in Neutron. '
-                      'Add its SegmentHostMapping in Neutron', host)
-            self.ovn_driver.update_segment_host_mapping(
-                host, host_phynets_map[host])
-
-        for host in current_hosts & previous_hosts:
-            LOG.debug('Host %s found both in OVN SB DB and Neutron. '
-                      'Trigger updating its SegmentHostMapping in Neutron, '
-                      'to keep OVN SB DB and Neutron have consistent data',
-                      host)
-            self.ovn_driver.update_segment_host_mapping(
-                host, host_phynets_map[host])
+        # The mappings of the hosts no longer in the OVN SB DB are cleared,
+        # only the mappings which changed are written.
+        self.ovn_driver.update_segment_host_mappings(host_phynets_map,
+                                                     all_hosts=True)
 
         LOG.debug('OVN-SB Sync hostname and physical networks finished')
@@ -10,12 +10,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import weakref
+
 import six
 
 from neutron.agent.ovsdb.native import commands
 from neutron.agent.ovsdb.native import idlutils
 
 from networking_ovn._i18n import _
+from networking_ovn.common import constants as ovn_const
 from networking_ovn.common import utils
 
 
@@ -74,6 +78,96 @@ def _updatevalues_in_list(row, column, new_values=None, old_values=None):
         setattr(row, column, column_values)
 
 
+class RowCache(object):
+    """Rows looked up by the commands of a transaction
+
+    The first lookup in a column of a table scans the table, as
+    idlutils.row_by_value does, the next one indexes the whole table by
+    this column. The cached rows are checked before being returned, since
+    the previous commands of the transaction may have deleted or renamed
+    them, and the values not found are looked up again, since a row may
+    have been inserted since.
+    """
+
+    def __init__(self, ovsdb_idl):
+        self.idl = ovsdb_idl
+        self.clear()
+
+    def clear(self):
+        self._indexes = {}
+        self._indexed = set()
+
+    def _is_valid(self, table, row, column, match):
+        return (self.idl.tables[table].rows.get(row.uuid) is row and
+                getattr(row, column) == match)
+
+    def row_by_value(self, table, column, match, *default):
+        key = (table, column)
+        index = self._indexes.setdefault(key, {})
+        row = index.get(match)
+        if row is not None and self._is_valid(table, row, column, match):
+            return row
+        if index and key not in self._indexed:
+            for other in list(self.idl.tables[table].rows.values()):
+                index.setdefault(getattr(other, column), other)
+            self._indexed.add(key)
+            row = index.get(match)
+            if row is not None and self._is_valid(table, row, column, match):
+                return row
+        row = idlutils.row_by_value(self.idl, table, column, match, *default)
+        if row is not None:
+            index[match] = row
+        return row
+
+
+# Row cache of the transaction being run with each Idl
+_row_caches = weakref.WeakKeyDictionary()
+
+
+@contextlib.contextmanager
+def row_cache(ovsdb_idl):
+    """Cache the rows looked up by the commands run in the block"""
+    _row_caches[ovsdb_idl] = cache = RowCache(ovsdb_idl)
+    try:
+        yield cache
+    finally:
+        _row_caches.pop(ovsdb_idl, None)
+
+
+def get_row_cache(ovsdb_idl):
+    return _row_caches.get(ovsdb_idl)
+
+
+def _row_by_value(ovsdb_idl, table, column, match, *default):
+    cache = _row_caches.get(ovsdb_idl)
+    if cache is None:
+        return idlutils.row_by_value(ovsdb_idl, table, column, match,
+                                     *default)
+    return cache.row_by_value(table, column, match, *default)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _resolve_row_references(values):
+    # A reference to a row inserted earlier in the same transaction can be
+    # given as the command inserting it (e.g. AddDHCPOptionsCommand), whose
+    # result is the uuid of the row once it has run.
+    return [value.result if isinstance(value, commands.BaseCommand)
+            else value for value in values]
+
+
+def _resolve_lsp_columns(columns):
+    if 'dhcpv4_options' not in columns:
+        return columns
+    columns = dict(columns)
+    columns['dhcpv4_options'] = _resolve_row_references(
+        columns['dhcpv4_options'])
+    return columns
+
+
 def get_lsp_dhcpv4_options_uuids(lsp, lsp_name):
     # Get dhcpv4_options uuids from Logical_Switch_Port, which are references
     # of port dhcpv4 options in DHCP_Options table.
@@ -94,8 +188,8 @@ class AddLSwitchCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         if self.may_exist:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.name, None)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.name, None)
             if lswitch:
                 return
         row = txn.insert(self.api._tables['Logical_Switch'])
@@ -112,8 +206,8 @@ class DelLSwitchCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.name)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -133,8 +227,8 @@ class LSwitchSetExternalIdCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.name)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.name)
 
         except idlutils.RowNotFound:
             if self.if_exists:
@@ -159,21 +253,21 @@ class AddLSwitchPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.lswitch)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.lswitch)
         except idlutils.RowNotFound:
             msg = _("Logical Switch %s does not exist") % self.lswitch
             raise RuntimeError(msg)
         if self.may_exist:
-            port = idlutils.row_by_value(self.api.idl,
-                                         'Logical_Switch_Port', 'name',
-                                         self.lport, None)
+            port = _row_by_value(self.api.idl,
+                                 'Logical_Switch_Port', 'name',
+                                 self.lport, None)
             if port:
                 return
 
         port = txn.insert(self.api._tables['Logical_Switch_Port'])
         port.name = self.lport
-        for col, val in self.columns.items():
+        for col, val in _resolve_lsp_columns(self.columns).items():
             setattr(port, col, val)
         # add the newly created port to existing lswitch
         _addvalue_to_list(lswitch, 'ports', port.uuid)
@@ -188,8 +282,8 @@ class SetLSwitchPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            port = idlutils.row_by_value(self.api.idl, 'Logical_Switch_Port',
-                                         'name', self.lport)
+            port = _row_by_value(self.api.idl, 'Logical_Switch_Port',
+                                 'name', self.lport)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -200,17 +294,118 @@ class SetLSwitchPortCommand(commands.BaseCommand):
         # The table rows should be consistent for the same transaction.
         # After we get a DHCP_Options row uuid from port dhcpv4_options
         # reference, the row shouldn't disappear for this transaction,
-        # before we delete it.
-        cur_port_dhcp_opts = get_lsp_dhcpv4_options_uuids(
-            port, self.lport)
-        new_port_dhcp_opts = set(self.columns.get('dhcpv4_options', []))
-        for uuid in cur_port_dhcp_opts - new_port_dhcp_opts:
-            self.api._tables['DHCP_Options'].rows[uuid].delete()
-
-        for col, val in self.columns.items():
+        # before we delete it. The dhcpv4_options column is left untouched
+        # by the updates not setting it.
+        columns = _resolve_lsp_columns(self.columns)
+        if 'dhcpv4_options' in columns:
+            cur_port_dhcp_opts = get_lsp_dhcpv4_options_uuids(
+                port, self.lport)
+            new_port_dhcp_opts = set(columns['dhcpv4_options'])
+            for uuid in cur_port_dhcp_opts - new_port_dhcp_opts:
+                self.api._tables['DHCP_Options'].rows[uuid].delete()
+
+        for col, val in columns.items():
             setattr(port, col, val)
 
 
+class SetLSwitchPortsQosOptionsCommand(commands.BaseCommand):
+    """Set the QoS options of logical switch ports
+
+    Only the QoS keys of the options column of the ports are changed: the
+    keys of options are set and the other QoS keys are removed.
+    """
+
+    def __init__(self, api, lport_names, options, if_exists):
+        super(SetLSwitchPortsQosOptionsCommand, self).__init__(api)
+        self.lport_names = lport_names
+        self.options = options
+        self.if_exists = if_exists
+
+    def get_size(self):
+        self.lport_names = list(self.lport_names)
+        return len(self.lport_names)
+
+    def partition(self, max_size):
+        """Split the update in updates of up to max_size ports"""
+        self.lport_names = list(self.lport_names)
+        if len(self.lport_names) <= max_size:
+            return [self]
+        return [SetLSwitchPortsQosOptionsCommand(
+            self.api, lport_names, self.options, self.if_exists)
+            for lport_names in _chunks(self.lport_names, max_size)]
+
+    def run_idl(self, txn):
+        del_keys = set(ovn_const.OVN_QOS_OPTIONS_KEYS) - set(self.options)
+        for lport_name in self.lport_names:
+            try:
+                port = _row_by_value(self.api.idl, 'Logical_Switch_Port',
+                                     'name', lport_name)
+            except idlutils.RowNotFound:
+                if self.if_exists:
+                    continue
+                msg = _("Logical Switch Port %s does not exist") % lport_name
+                raise RuntimeError(msg)
+
+            port_options = getattr(port, 'options', {})
+            changed = [key for key, value in self.options.items()
+                       if port_options.get(key) != value]
+            deleted = [key for key in del_keys if key in port_options]
+            if not changed and not deleted:
+                continue
+            if _is_ovs_mutate_available(port):
+                for key in changed:
+                    port.setkey('options', key, self.options[key])
+                for key in deleted:
+                    port.delkey('options', key)
+            else:
+                port.verify('options')
+                port_options = dict(port_options)
+                port_options.update(self.options)
+                for key in deleted:
+                    del port_options[key]
+                port.options = port_options
+
+
+class SetLSwitchPortsParentCommand(commands.BaseCommand):
+    """Set the parent port and tag of logical switch ports
+
+    lport_parents maps the name of each port to its (parent_name, tag),
+    ([], []) unsetting them.
+    """
+
+    def __init__(self, api, lport_parents, if_exists):
+        super(SetLSwitchPortsParentCommand, self).__init__(api)
+        self.lport_parents = lport_parents
+        self.if_exists = if_exists
+
+    def get_size(self):
+        return len(self.lport_parents)
+
+    def partition(self, max_size):
+        """Split the update in updates of up to max_size ports"""
+        if len(self.lport_parents) <= max_size:
+            return [self]
+        return [SetLSwitchPortsParentCommand(
+            self.api, dict(lport_parents), self.if_exists)
+            for lport_parents in _chunks(
+                sorted(self.lport_parents.items()), max_size)]
+
+    def run_idl(self, txn):
+        # The ports are looked up in the row cache of the transaction,
+        # which indexes the Logical_Switch_Port table by name.
+        for lport_name, (parent_name, tag) in self.lport_parents.items():
+            try:
+                port = _row_by_value(self.api.idl, 'Logical_Switch_Port',
+                                     'name', lport_name)
+            except idlutils.RowNotFound:
+                if self.if_exists:
+                    continue
+                msg = _("Logical Switch Port %s does not exist") % lport_name
+                raise RuntimeError(msg)
+            port.parent_name = parent_name
+            port.tag = tag
+
+
 class DelLSwitchPortCommand(commands.BaseCommand):
     def __init__(self, api, lport, lswitch, if_exists):
         super(DelLSwitchPortCommand, self).__init__(api)
@@ -220,10 +415,10 @@ class DelLSwitchPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lport = idlutils.row_by_value(self.api.idl, 'Logical_Switch_Port',
-                                          'name', self.lport)
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.lswitch)
+            lport = _row_by_value(self.api.idl, 'Logical_Switch_Port',
+                                  'name', self.lport)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.lswitch)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -243,8 +438,8 @@ class AddLRouterCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         if self.may_exist:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.name, None)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.name, None)
             if lrouter:
                 return
 
@@ -263,8 +458,8 @@ class UpdateLRouterCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.name, None)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.name, None)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -277,6 +472,33 @@ class UpdateLRouterCommand(commands.BaseCommand):
             return
 
 
+class MoveLRouterGatewayCommand(commands.BaseCommand):
+    """Move the gateway of a router from a chassis to another one
+
+    Nothing is done if the router no longer exists or if its gateway is no
+    longer hosted by from_chassis.
+    """
+
+    def __init__(self, api, name, from_chassis, to_chassis):
+        super(MoveLRouterGatewayCommand, self).__init__(api)
+        self.name = name
+        self.from_chassis = from_chassis
+        self.to_chassis = to_chassis
+
+    def run_idl(self, txn):
+        try:
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.name)
+        except idlutils.RowNotFound:
+            return
+
+        options = dict(getattr(lrouter, 'options', {}))
+        if options.get('chassis') != self.from_chassis:
+            return
+        options['chassis'] = self.to_chassis
+        lrouter.options = options
+
+
 class DelLRouterCommand(commands.BaseCommand):
     def __init__(self, api, name, if_exists):
         super(DelLRouterCommand, self).__init__(api)
@@ -285,8 +507,8 @@ class DelLRouterCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.name)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -306,14 +528,14 @@ class AddLRouterPortCommand(commands.BaseCommand):
     def run_idl(self, txn):
 
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.lrouter)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.lrouter)
         except idlutils.RowNotFound:
             msg = _("Logical Router %s does not exist") % self.lrouter
             raise RuntimeError(msg)
         try:
-            idlutils.row_by_value(self.api.idl, 'Logical_Router_Port',
-                                  'name', self.name)
+            _row_by_value(self.api.idl, 'Logical_Router_Port',
+                          'name', self.name)
             # The LRP entry with certain name has already exist, raise an
             # exception to notice caller. It's caller's responsibility to
             # call UpdateLRouterPortCommand to get LRP entry processed
@@ -338,9 +560,9 @@ class UpdateLRouterPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter_port = idlutils.row_by_value(self.api.idl,
-                                                 'Logical_Router_Port',
-                                                 'name', self.name)
+            lrouter_port = _row_by_value(self.api.idl,
+                                         'Logical_Router_Port',
+                                         'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -362,17 +584,17 @@ class DelLRouterPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter_port = idlutils.row_by_value(self.api.idl,
-                                                 'Logical_Router_Port',
-                                                 'name', self.name)
+            lrouter_port = _row_by_value(self.api.idl,
+                                         'Logical_Router_Port',
+                                         'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
             msg = _("Logical Router Port %s does not exist") % self.name
             raise RuntimeError(msg)
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.lrouter)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.lrouter)
         except idlutils.RowNotFound:
             msg = _("Logical Router %s does not exist") % self.lrouter
             raise RuntimeError(msg)
@@ -388,8 +610,8 @@ class SetLRouterPortInLSwitchPortCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            port = idlutils.row_by_value(self.api.idl, 'Logical_Switch_Port',
-                                         'name', self.lswitch_port)
+            port = _row_by_value(self.api.idl, 'Logical_Switch_Port',
+                                 'name', self.lswitch_port)
         except idlutils.RowNotFound:
             msg = _("Logical Switch Port %s does not "
                     "exist") % self.lswitch_port
@@ -409,8 +631,8 @@ class AddACLCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.lswitch)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.lswitch)
         except idlutils.RowNotFound:
             msg = _("Logical Switch %s does not exist") % self.lswitch
             raise RuntimeError(msg)
@@ -431,8 +653,8 @@ class DelACLCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', self.lswitch)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', self.lswitch)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -475,6 +697,30 @@ class UpdateACLsCommand(commands.BaseCommand):
         self.need_compare = need_compare
         self.is_add_acl = is_add_acl
 
+    def get_size(self):
+        # The ACLs of each port are updated
+        self.port_list = list(self.port_list)
+        return len(self.port_list)
+
+    def partition(self, max_size):
+        """Split the update in updates of up to max_size ports"""
+        self.port_list = list(self.port_list)
+        if len(self.port_list) <= max_size:
+            return [self]
+        partitions = []
+        for ports in _chunks(self.port_list, max_size):
+            lswitch_names = []
+            for port in ports:
+                if port['network_id'] not in lswitch_names:
+                    lswitch_names.append(port['network_id'])
+            acl_new_values_dict = dict(
+                (port['id'], self.acl_new_values_dict[port['id']])
+                for port in ports if port['id'] in self.acl_new_values_dict)
+            partitions.append(UpdateACLsCommand(
+                self.api, lswitch_names, ports, acl_new_values_dict,
+                self.need_compare, self.is_add_acl))
+        return partitions
+
     def _acl_list_sub(self, acl_list1, acl_list2):
         """Compute the elements in acl_list1 but not in acl_list2.
 
@@ -532,8 +778,8 @@ class UpdateACLsCommand(commands.BaseCommand):
         lswitch_ovsdb_dict = {}
         for switch_name in self.lswitch_names:
             switch_name = utils.ovn_name(switch_name)
-            lswitch = idlutils.row_by_value(self.api.idl, 'Logical_Switch',
-                                            'name', switch_name)
+            lswitch = _row_by_value(self.api.idl, 'Logical_Switch',
+                                    'name', switch_name)
             lswitch_ovsdb_dict[switch_name] = lswitch
         if self.is_add_acl:
             acl_add_values_dict = {}
@@ -613,8 +859,8 @@ class AddStaticRouteCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.lrouter)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.lrouter)
         except idlutils.RowNotFound:
             msg = _("Logical Router %s does not exist") % self.lrouter
             raise RuntimeError(msg)
@@ -635,8 +881,8 @@ class DelStaticRouteCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            lrouter = idlutils.row_by_value(self.api.idl, 'Logical_Router',
-                                            'name', self.lrouter)
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.lrouter)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -653,6 +899,63 @@ class DelStaticRouteCommand(commands.BaseCommand):
                 break
 
 
+class UpdateStaticRoutesCommand(commands.BaseCommand):
+    """Add and delete static routes of a logical router at once
+
+    The routes are identified by their (ip_prefix, nexthop). The static
+    routes of the router are indexed once and all the changes are applied
+    with a single update of its static_routes column. Adding an existing
+    route or deleting a missing one does nothing.
+    """
+
+    def __init__(self, api, lrouter, add_routes, del_routes, if_exists):
+        super(UpdateStaticRoutesCommand, self).__init__(api)
+        self.lrouter = lrouter
+        self.add_routes = [tuple(route) for route in add_routes]
+        self.del_routes = set(tuple(route) for route in del_routes)
+        self.del_routes.difference_update(self.add_routes)
+        self.if_exists = if_exists
+
+    def run_idl(self, txn):
+        try:
+            lrouter = _row_by_value(self.api.idl, 'Logical_Router',
+                                    'name', self.lrouter)
+        except idlutils.RowNotFound:
+            if self.if_exists:
+                return
+            msg = _("Logical Router %s does not exist") % self.lrouter
+            raise RuntimeError(msg)
+
+        routes = {}
+        for route in getattr(lrouter, 'static_routes', []):
+            routes[(getattr(route, 'ip_prefix', ''),
+                    getattr(route, 'nexthop', ''))] = route
+        deleted = [routes.pop(key) for key in self.del_routes
+                   if key in routes]
+        added = []
+        for ip_prefix, nexthop in self.add_routes:
+            if (ip_prefix, nexthop) in routes:
+                continue
+            route = txn.insert(self.api._tables['Logical_Router_Static_Route'])
+            route.ip_prefix = ip_prefix
+            route.nexthop = nexthop
+            routes[(ip_prefix, nexthop)] = route
+            added.append(route)
+        if not deleted and not added:
+            return
+
+        if _is_ovs_mutate_available(lrouter):
+            for route in deleted:
+                lrouter.delvalue('static_routes', route)
+            for route in added:
+                lrouter.addvalue('static_routes', route.uuid)
+        else:
+            lrouter.verify('static_routes')
+            lrouter.static_routes = list(routes.values())
+        for route in deleted:
+            route.delete()
+
+
 class AddAddrSetCommand(commands.BaseCommand):
     def __init__(self, api, name, may_exist, **columns):
         super(AddAddrSetCommand, self).__init__(api)
@@ -662,8 +965,8 @@ class AddAddrSetCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         if self.may_exist:
-            addrset = idlutils.row_by_value(self.api.idl, 'Address_Set',
-                                            'name', self.name, None)
+            addrset = _row_by_value(self.api.idl, 'Address_Set',
+                                    'name', self.name, None)
             if addrset:
                 return
         row = txn.insert(self.api._tables['Address_Set'])
@@ -680,8 +983,8 @@ class DelAddrSetCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            addrset = idlutils.row_by_value(self.api.idl, 'Address_Set',
-                                            'name', self.name)
+            addrset = _row_by_value(self.api.idl, 'Address_Set',
+                                    'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -700,10 +1003,28 @@ class UpdateAddrSetCommand(commands.BaseCommand):
         self.addrs_remove = addrs_remove
         self.if_exists = if_exists
 
+    def get_size(self):
+        return len(self.addrs_add or []) + len(self.addrs_remove or [])
+
+    def partition(self, max_size):
+        """Split the update in updates of up to max_size addresses
+
+        The addresses are added before being removed, as in a single update.
+        """
+        if self.get_size() <= max_size:
+            return [self]
+        changes = ([(addr, True) for addr in self.addrs_add or []] +
+                   [(addr, False) for addr in self.addrs_remove or []])
+        return [UpdateAddrSetCommand(
+            self.api, self.name,
+            [addr for addr, add in chunk if add] or None,
+            [addr for addr, add in chunk if not add] or None,
+            self.if_exists) for chunk in _chunks(changes, max_size)]
+
     def run_idl(self, txn):
         try:
-            addrset = idlutils.row_by_value(self.api.idl, 'Address_Set',
-                                            'name', self.name)
+            addrset = _row_by_value(self.api.idl, 'Address_Set',
+                                    'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -726,8 +1047,8 @@ class UpdateAddrSetExtIdsCommand(commands.BaseCommand):
 
     def run_idl(self, txn):
         try:
-            addrset = idlutils.row_by_value(self.api.idl, 'Address_Set',
-                                            'name', self.name)
+            addrset = _row_by_value(self.api.idl, 'Address_Set',
+                                    'name', self.name)
         except idlutils.RowNotFound:
             if self.if_exists:
                 return
@@ -751,6 +1072,12 @@ class AddDHCPOptionsCommand(commands.BaseCommand):
         self.subnet_id = subnet_id
         self.port_id = port_id
 
+    def get_size(self):
+        return 1
+
+    def partition(self, max_size):
+        return [self]
+
     def _get_dhcp_options_row(self):
         for row in self.api._tables['DHCP_Options'].rows.values():
             external_ids = getattr(row, 'external_ids', {})
@@ -768,6 +1095,13 @@ class AddDHCPOptionsCommand(commands.BaseCommand):
             row = txn.insert(self.api._tables['DHCP_Options'])
         for col, val in self.columns.items():
             setattr(row, col, val)
+        self.result = row.uuid
+
+    def post_commit(self, txn):
+        # The uuid of an inserted row is only known once committed
+        real_uuid = txn.get_insert_uuid(self.result)
+        if real_uuid:
+            self.result = real_uuid
 
 
 class DelDHCPOptionsCommand(commands.BaseCommand):
@@ -776,6 +1110,12 @@ class DelDHCPOptionsCommand(commands.BaseCommand):
         self.if_exists = if_exists
         self.row_uuid = row_uuid
 
+    def get_size(self):
+        return 1
+
+    def partition(self, max_size):
+        return [self]
+
     def run_idl(self, txn):
         if self.row_uuid not in self.api._tables['DHCP_Options'].rows:
             if self.if_exists:
@@ -0,0 +1,224 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+import threading
+import time
+import zlib
+
+from oslo_log import log
+from ovs.db import idl
+from ovs import poller
+import six
+
+from networking_ovn._i18n import _LE, _LI, _LW
+
+LOG = log.getLogger(__name__)
+
+
+def get_shard(key, num_shards):
+    """Get the shard of a key
+
+    The 32 bits hash space of the key is split in num_shards contiguous
+    ranges, so the result is stable across processes and neutron servers.
+
+    :param key:         The key to hash, usually the name of a row
+    :param num_shards:  The number of shards
+    :returns:           The shard index, between 0 and num_shards - 1
+    """
+    if not isinstance(key, bytes):
+        key = six.text_type(key).encode('utf-8')
+    return ((zlib.crc32(key) & 0xffffffff) * num_shards) >> 32
+
+
+def get_row_key(row):
+    return getattr(row, 'name', None) or str(row.uuid)
+
+
+class ShardLock(object):
+    """OVSDB lock of one event shard
+
+    Each lock needs its own session to the ovsdb-server since a session
+    only holds one lock, so a lock only Idl (without any monitored table)
+    is used.
+    """
+
+    def __init__(self, remote, schema_json, lock_name):
+        helper = idl.SchemaHelper(schema_json=copy.deepcopy(schema_json))
+        self.idl = idl.Idl(remote, helper)
+        self.lock_name = lock_name
+        # Time the lock was last released, None if not released
+        self.released_at = None
+        # The lock isn't released again before this time
+        self.keep_until = 0
+        # Whether the lock was held when last checked
+        self.held = False
+        self.idl.set_lock(lock_name)
+
+    @property
+    def has_lock(self):
+        return self.idl.has_lock
+
+    @property
+    def is_answered(self):
+        return self.idl.has_lock or self.idl.is_lock_contended
+
+    def release(self):
+        # Unlocking and requesting the lock again puts this server at the
+        # end of the queue of the lock, after the servers already waiting.
+        self.idl.set_lock(None)
+        self.idl.set_lock(self.lock_name)
+        self.released_at = time.time()
+        self.held = False
+
+
+class EventShards(object):
+    """Partition the OVSDB events between the neutron servers
+
+    The rows are assigned to num_shards shards by hashing their name, each
+    shard having its own OVSDB lock. A neutron server only handles the
+    events of the rows belonging to the shards it holds the lock of. When
+    a neutron server goes away, the ovsdb-server grants its locks to the
+    other neutron servers waiting for them.
+
+    The rows of the tables not in sharded_tables all belong to the first
+    shard, so that their events are handled by a single neutron server.
+
+    No server handles the events of a shard between the release of its
+    lock and the grant to the next server, so the shards acquired are
+    returned by pop_acquired for their rows to be synced.
+
+    If max_shards is set, a server holding more than max_shards locks
+    releases the extra ones (and requests them again) every
+    REBALANCE_INTERVAL seconds so that they are taken over by the servers
+    waiting for them. A lock granted back right away isn't wanted by any
+    other server, so it is kept for KEEP_INTERVAL seconds.
+    """
+
+    REBALANCE_INTERVAL = 5
+    KEEP_INTERVAL = 60
+
+    def __init__(self, remote, schema_json, lock_prefix, num_shards,
+                 max_shards=0, sharded_tables=None):
+        self.num_shards = num_shards
+        self.max_shards = max_shards
+        # None if the rows of all the tables are sharded
+        self.sharded_tables = (None if sharded_tables is None
+                               else frozenset(sharded_tables))
+        self.locks = [ShardLock(remote, schema_json,
+                                '%s_%d' % (lock_prefix, shard))
+                      for shard in six.moves.range(num_shards)]
+        self.poller = poller.Poller()
+        self.thread = None
+        # Shards acquired since the last call to pop_acquired
+        self._acquired = set()
+        self._acquired_lock = threading.Lock()
+
+    def owns(self, shard):
+        return self.locks[shard].has_lock
+
+    def get_row_shard(self, row):
+        if (self.sharded_tables is not None and
+                row._table.name not in self.sharded_tables):
+            return 0
+        return get_shard(get_row_key(row), self.num_shards)
+
+    def owns_row(self, row):
+        return self.owns(self.get_row_shard(row))
+
+    def owned_shards(self):
+        return [shard for shard, lock in enumerate(self.locks)
+                if lock.has_lock]
+
+    def _run_locks(self):
+        for lock in self.locks:
+            lock.idl.run()
+        with self._acquired_lock:
+            for shard, lock in enumerate(self.locks):
+                has_lock = lock.has_lock
+                if has_lock and not lock.held:
+                    self._acquired.add(shard)
+                lock.held = has_lock
+
+    def pop_acquired(self):
+        """Get the shards acquired since the last call
+
+        The events of these shards may have been missed before they were
+        acquired, the state of their rows has to be synced.
+        """
+        with self._acquired_lock:
+            acquired, self._acquired = self._acquired, set()
+        return sorted(acquired)
+
+    def _wait_locks(self, timeout):
+        for lock in self.locks:
+            lock.idl.wait(self.poller)
+        self.poller.timer_wait(timeout * 1000)
+        self.poller.block()
+
+    def wait_for_locks(self, timeout):
+        """Wait for the ovsdb-server to answer all the lock requests"""
+        deadline = time.time() + timeout
+        self._run_locks()
+        while not all(lock.is_answered for lock in self.locks):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.warning(_LW("Timeout waiting for the event shard locks"))
+                break
+            self._wait_locks(min(remaining, 1))
+            self._run_locks()
+        # The rows of the shards held at startup are synced from the
+        # initial dump of the DB
+        self.pop_acquired()
+        LOG.info(_LI("Holding the event shards %s"), self.owned_shards())
+
+    def rebalance(self):
+        now = time.time()
+        for lock in self.locks:
+            if lock.released_at is None:
+                continue
+            if lock.has_lock:
+                # No other server was waiting for the lock
+                lock.keep_until = now + self.KEEP_INTERVAL
+            lock.released_at = None
+
+        if not self.max_shards:
+            return
+
+        held = [lock for lock in self.locks if lock.has_lock]
+        extra = len(held) - self.max_shards
+        if extra <= 0:
+            return
+        for lock in [lock for lock in held if lock.keep_until <= now][:extra]:
+            LOG.info(_LI("Releasing event shard lock %s"), lock.lock_name)
+            with self._acquired_lock:
+                lock.release()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run(self):
+        next_rebalance = time.time() + self.REBALANCE_INTERVAL
+        while True:
+            try:
+                self._wait_locks(self.REBALANCE_INTERVAL)
+                self._run_locks()
+                if time.time() >= next_rebalance:
+                    self.rebalance()
+                    next_rebalance = time.time() + self.REBALANCE_INTERVAL
+            except Exception:
+                # The shard lock sessions would no longer be maintained
+                # if the thread exited.
+                LOG.exception(_LE('Unexpected exception handling the event '
+                                  'shard locks'))
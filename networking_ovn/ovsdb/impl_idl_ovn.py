@@ -10,23 +10,30 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import weakref
+
 from neutron_lib import exceptions as n_exc
 from oslo_log import log
+from ovs.db import idl
+from ovs import poller
 import six
 import tenacity
+import threading
 
-from neutron.agent.ovsdb import impl_idl
 from neutron.agent.ovsdb.native import connection
 from neutron.agent.ovsdb.native import idlutils
 from neutron.common import utils as n_utils
 
-from networking_ovn._i18n import _, _LI
+from networking_ovn._i18n import _, _LI, _LW
 from networking_ovn.common import config as cfg
 from networking_ovn.common import constants as ovn_const
 from networking_ovn.common import utils
 from networking_ovn.ovsdb import commands as cmd
 from networking_ovn.ovsdb import ovn_api
 from networking_ovn.ovsdb import ovsdb_monitor
+from networking_ovn.ovsdb import schema
+from networking_ovn.ovsdb import transaction
 
 
 LOG = log.getLogger(__name__)
@@ -55,19 +62,45 @@ def get_ovn_idls(driver, trigger):
     return nb_ovn_idl, sb_ovn_idl
 
 
+class OvnApiConnection(transaction.GroupCommitMixin, connection.Connection):
+    """OVSDB connection of the API and RPC workers
+
+    Same as the base class, except that tables can be registered with only
+    a subset of their columns (see schema.register_tables()), that the
+    enable_connection_uri() helper isn't called and that the transactions
+    queued at the same time are committed together.
+    """
+
+    def start(self, table_name_list=None):
+        with self.lock:
+            if self.idl is not None:
+                return
+
+            helper = schema.get_schema_helper(self.connection,
+                                              self.schema_name)
+            schema.register_tables(helper, table_name_list)
+
+            self.idl = ovsdb_monitor.BaseOvnIdl(self.connection, helper)
+            idlutils.wait_for_change(self.idl, self.timeout)
+            self.poller = poller.Poller()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+
 def get_connection(db_class, trigger=None):
     # The trigger is the start() method of the NeutronWorker class
     if trigger and trigger.im_class == ovsdb_monitor.OvnWorker:
         cls = ovsdb_monitor.OvnConnection
     else:
-        cls = connection.Connection
+        cls = OvnApiConnection
 
     if db_class == OvsdbNbOvnIdl:
         return cls(cfg.get_ovn_nb_connection(),
-                   cfg.get_ovn_ovsdb_timeout(), 'OVN_Northbound')
+                   cfg.get_ovn_ovsdb_timeout(), schema.OVN_NORTHBOUND)
     elif db_class == OvsdbSbOvnIdl:
         return cls(cfg.get_ovn_sb_connection(),
-                   cfg.get_ovn_ovsdb_timeout(), 'OVN_Southbound')
+                   cfg.get_ovn_ovsdb_timeout(), schema.OVN_SOUTHBOUND)
 
 
 class OvsdbNbOvnIdl(ovn_api.API):
@@ -82,9 +115,13 @@ class OvsdbNbOvnIdl(ovn_api.API):
                     OvsdbNbOvnIdl, trigger)
             if isinstance(OvsdbNbOvnIdl.ovsdb_connection,
                           ovsdb_monitor.OvnConnection):
-                OvsdbNbOvnIdl.ovsdb_connection.start(driver)
+                OvsdbNbOvnIdl.ovsdb_connection.start(
+                    driver, table_name_list=schema.get_tables(
+                        schema.OVN_NORTHBOUND, schema.WORKER_ROLE_OVN))
             else:
-                OvsdbNbOvnIdl.ovsdb_connection.start()
+                OvsdbNbOvnIdl.ovsdb_connection.start(
+                    table_name_list=schema.get_tables(
+                        schema.OVN_NORTHBOUND, schema.WORKER_ROLE_API))
             self.idl = OvsdbNbOvnIdl.ovsdb_connection.idl
             self.ovsdb_timeout = cfg.get_ovn_ovsdb_timeout()
         except Exception as e:
@@ -98,10 +135,9 @@ class OvsdbNbOvnIdl(ovn_api.API):
         return self.idl.tables
 
     def transaction(self, check_error=False, log_errors=True, **kwargs):
-        return impl_idl.Transaction(self,
-                                    OvsdbNbOvnIdl.ovsdb_connection,
-                                    self.ovsdb_timeout,
-                                    check_error, log_errors)
+        return transaction.Transaction(
+            self, OvsdbNbOvnIdl.ovsdb_connection, self.ovsdb_timeout,
+            check_error, log_errors, priority=kwargs.get('priority'))
 
     def create_lswitch(self, lswitch_name, may_exist=True, **columns):
         return cmd.AddLSwitchCommand(self, lswitch_name,
@@ -128,6 +164,15 @@ class OvsdbNbOvnIdl(ovn_api.API):
         return cmd.SetLSwitchPortCommand(self, lport_name,
                                          if_exists, **columns)
 
+    def set_lswitch_ports_qos_options(self, lport_names, options,
+                                      if_exists=True):
+        return cmd.SetLSwitchPortsQosOptionsCommand(self, lport_names,
+                                                    options, if_exists)
+
+    def set_lswitch_ports_parent(self, lport_parents, if_exists=True):
+        return cmd.SetLSwitchPortsParentCommand(self, lport_parents,
+                                                if_exists)
+
     def delete_lswitch_port(self, lport_name=None, lswitch_name=None,
                             ext_id=None, if_exists=True):
         if lport_name is not None:
@@ -253,6 +298,10 @@ class OvsdbNbOvnIdl(ovn_api.API):
     def delete_lrouter(self, name, if_exists=True):
         return cmd.DelLRouterCommand(self, name, if_exists)
 
+    def move_lrouter_gateway(self, name, from_chassis, to_chassis):
+        return cmd.MoveLRouterGatewayCommand(self, name, from_chassis,
+                                             to_chassis)
+
     def add_lrouter_port(self, name, lrouter, **columns):
         return cmd.AddLRouterPortCommand(self, name, lrouter, **columns)
 
@@ -288,6 +337,11 @@ class OvsdbNbOvnIdl(ovn_api.API):
         return cmd.DelStaticRouteCommand(self, lrouter, ip_prefix, nexthop,
                                          if_exists)
 
+    def update_static_routes(self, lrouter, add_routes=None, del_routes=None,
+                             if_exists=True):
+        return cmd.UpdateStaticRoutesCommand(self, lrouter, add_routes or [],
+                                             del_routes or [], if_exists)
+
     def create_address_set(self, name, may_exist=True, **columns):
         return cmd.AddAddrSetCommand(self, name, may_exist, **columns)
 
@@ -443,6 +497,154 @@ class OvsdbNbOvnIdl(ovn_api.API):
         return address_sets
 
 
+def _get_chassis_physnets(chassis):
+    bridge_mappings = chassis.external_ids.get('ovn-bridge-mappings', '')
+    try:
+        mapping_dict = n_utils.parse_mappings(bridge_mappings.split(','))
+    except ValueError:
+        LOG.warning(_LW('Invalid ovn-bridge-mappings %(mappings)s of chassis '
+                        '%(chassis)s'),
+                    {'mappings': bridge_mappings, 'chassis': chassis.name})
+        return []
+    return list(mapping_dict)
+
+
+def _get_chassis_gateway_weight(chassis):
+    weight = chassis.external_ids.get(ovn_const.OVN_GATEWAY_WEIGHT_EXT_ID_KEY)
+    if weight is None:
+        return ovn_const.OVN_GATEWAY_DEFAULT_WEIGHT
+    try:
+        return max(float(weight), 0.0)
+    except ValueError:
+        LOG.warning(_LW('Invalid gateway weight %(weight)s of chassis '
+                        '%(chassis)s'),
+                    {'weight': weight, 'chassis': chassis.name})
+        return ovn_const.OVN_GATEWAY_DEFAULT_WEIGHT
+
+
+class ChassisIndex(object):
+    """Index of the Chassis rows by hostname and physical network
+
+    The index is built from the Chassis table when first needed, then kept
+    up to date from the changes of the Chassis rows seen by the Idl, so
+    that the ovn-bridge-mappings and the gateway weight of a chassis are
+    only parsed when they change. A host has the physical networks of all
+    its chassis and is only removed with its last chassis.
+    """
+
+    def __init__(self, ovsdb_idl):
+        self._lock = threading.Lock()
+        # Chassis uuid -> (row, hostname, physnets)
+        self._chassis = {}
+        # hostname -> uuids of the chassis of the host
+        self._host_chassis = collections.defaultdict(set)
+        # physnet -> hostname -> number of chassis of the host with physnet
+        self._physnet_hosts = collections.defaultdict(collections.Counter)
+        # Chassis uuid -> (chassis name, gateway weight)
+        self._weights = {}
+        ovsdb_idl.add_table_listener('Chassis', self._chassis_changed)
+        with self._lock:
+            for chassis in list(ovsdb_idl.tables['Chassis'].rows.values()):
+                self._add_chassis(chassis)
+
+    def _chassis_changed(self, event, row, updates=None):
+        with self._lock:
+            previous_hostname = self._remove_chassis(row.uuid)
+            if event != idl.ROW_DELETE:
+                self._add_chassis(row, previous_hostname)
+
+    def _remove_chassis(self, chassis_uuid):
+        """Remove a chassis from the index
+
+        :returns: The hostname of the chassis, None if it wasn't indexed
+        """
+        if chassis_uuid not in self._chassis:
+            return None
+        _row, hostname, physnets = self._chassis.pop(chassis_uuid)
+        del self._weights[chassis_uuid]
+        chassis_uuids = self._host_chassis[hostname]
+        chassis_uuids.discard(chassis_uuid)
+        if not chassis_uuids:
+            del self._host_chassis[hostname]
+        for physnet in physnets:
+            hosts = self._physnet_hosts[physnet]
+            hosts[hostname] -= 1
+            if hosts[hostname] <= 0:
+                del hosts[hostname]
+            if not hosts:
+                del self._physnet_hosts[physnet]
+        return hostname
+
+    def _add_chassis(self, chassis, previous_hostname=None):
+        hostname = chassis.hostname
+        if hostname != previous_hostname and self._host_chassis.get(hostname):
+            LOG.warning(_LW('Chassis %(chassis)s has the hostname %(host)s '
+                            'of chassis %(others)s'),
+                        {'chassis': chassis.name, 'host': hostname,
+                         'others': ', '.join(sorted(
+                             self._chassis[chassis_uuid][0].name
+                             for chassis_uuid
+                             in self._host_chassis[hostname]))})
+        physnets = set(_get_chassis_physnets(chassis))
+        self._chassis[chassis.uuid] = (chassis, hostname, physnets)
+        self._weights[chassis.uuid] = (chassis.name,
+                                       _get_chassis_gateway_weight(chassis))
+        self._host_chassis[hostname].add(chassis.uuid)
+        for physnet in physnets:
+            self._physnet_hosts[physnet][hostname] += 1
+
+    def get_chassis_by_hostname(self, hostname):
+        """Get the Chassis row of a host
+
+        When several chassis have the hostname, the one with the lowest
+        name is returned.
+        """
+        with self._lock:
+            chassis = [self._chassis[chassis_uuid][0] for chassis_uuid
+                       in self._host_chassis.get(hostname, ())]
+        if not chassis:
+            return None
+        return min(chassis, key=lambda ch: ch.name)
+
+    def get_hostname_and_physnets(self):
+        with self._lock:
+            hosts = {}
+            for hostname, chassis_uuids in self._host_chassis.items():
+                physnets = set()
+                for chassis_uuid in chassis_uuids:
+                    physnets.update(self._chassis[chassis_uuid][2])
+                hosts[hostname] = list(physnets)
+            return hosts
+
+    def get_hosts_with_physnet(self, physnet):
+        with self._lock:
+            return set(self._physnet_hosts.get(physnet, ()))
+
+    def get_gateway_weights(self):
+        with self._lock:
+            return dict(self._weights.values())
+
+
+# Chassis index of each Idl
+_chassis_indexes = weakref.WeakKeyDictionary()
+_chassis_indexes_lock = threading.Lock()
+
+
+def get_chassis_index(ovsdb_idl):
+    """Get the ChassisIndex of the OVN_Southbound DB Idl ovsdb_idl
+
+    :returns: None if the Idl doesn't notify the changes of its rows
+    """
+    if not isinstance(ovsdb_idl, ovsdb_monitor.BaseOvnIdl):
+        return None
+    with _chassis_indexes_lock:
+        chassis_index = _chassis_indexes.get(ovsdb_idl)
+        if chassis_index is None:
+            chassis_index = _chassis_indexes[ovsdb_idl] = ChassisIndex(
+                ovsdb_idl)
+    return chassis_index
+
+
 class OvsdbSbOvnIdl(ovn_api.SbAPI):
 
     ovsdb_connection = None
@@ -457,10 +659,12 @@ class OvsdbSbOvnIdl(ovn_api.SbAPI):
                           ovsdb_monitor.OvnConnection):
                 # We only need to know the content of Chassis in OVN_Southbound
                 OvsdbSbOvnIdl.ovsdb_connection.start(
-                    driver, table_name_list=['Chassis'])
+                    driver, table_name_list=schema.get_tables(
+                        schema.OVN_SOUTHBOUND, schema.WORKER_ROLE_OVN))
             else:
                 OvsdbSbOvnIdl.ovsdb_connection.start(
-                    table_name_list=['Chassis'])
+                    table_name_list=schema.get_tables(
+                        schema.OVN_SOUTHBOUND, schema.WORKER_ROLE_API))
             self.idl = OvsdbSbOvnIdl.ovsdb_connection.idl
             self.ovsdb_timeout = cfg.get_ovn_ovsdb_timeout()
         except Exception as e:
@@ -470,12 +674,21 @@ class OvsdbSbOvnIdl(ovn_api.SbAPI):
             raise connection_exception
 
     def get_chassis_hostname_and_physnets(self):
-        chassis_info_dict = {}
+        chassis_index = get_chassis_index(self.idl)
+        if chassis_index is not None:
+            return chassis_index.get_hostname_and_physnets()
+        chassis_info_dict = collections.defaultdict(set)
         for ch in self.idl.tables['Chassis'].rows.values():
-            bridge_mappings = ch.external_ids.get('ovn-bridge-mappings', '')
-            mapping_dict = n_utils.parse_mappings(bridge_mappings.split(','))
-            chassis_info_dict[ch.hostname] = mapping_dict.keys()
-        return chassis_info_dict
+            chassis_info_dict[ch.hostname].update(_get_chassis_physnets(ch))
+        return dict((hostname, list(physnets))
+                    for hostname, physnets in chassis_info_dict.items())
+
+    def get_chassis_hosts_with_physnet(self, physnet):
+        chassis_index = get_chassis_index(self.idl)
+        if chassis_index is not None:
+            return chassis_index.get_hosts_with_physnet(physnet)
+        return {ch.hostname for ch in self.idl.tables['Chassis'].rows.values()
+                if physnet in _get_chassis_physnets(ch)}
 
     def get_all_chassis(self, chassis_type=None):
         # TODO(azbiswas): Use chassis_type as input once the compute type
@@ -485,11 +698,24 @@ class OvsdbSbOvnIdl(ovn_api.SbAPI):
             chassis_list.append(ch.name)
         return chassis_list
 
+    def get_chassis_gateway_weights(self):
+        chassis_index = get_chassis_index(self.idl)
+        if chassis_index is not None:
+            return chassis_index.get_gateway_weights()
+        return dict((ch.name, _get_chassis_gateway_weight(ch))
+                    for ch in self.idl.tables['Chassis'].rows.values())
+
     def get_chassis_datapath_and_iface_types(self, hostname):
-        try:
-            chassis = idlutils.row_by_value(self.idl, 'Chassis',
-                                            'hostname', hostname)
-        except idlutils.RowNotFound:
-            return (None, None)
+        chassis_index = get_chassis_index(self.idl)
+        if chassis_index is not None:
+            chassis = chassis_index.get_chassis_by_hostname(hostname)
+            if chassis is None:
+                return (None, None)
+        else:
+            try:
+                chassis = idlutils.row_by_value(self.idl, 'Chassis',
+                                                'hostname', hostname)
+            except idlutils.RowNotFound:
+                return (None, None)
         return (chassis.external_ids.get('datapath-type', ''),
                 chassis.external_ids.get('iface-types', ''))
@@ -102,6 +102,38 @@ class API(object):
         :returns:             :class:`Command` with no result
         """
 
+    @abc.abstractmethod
+    def set_lswitch_ports_qos_options(self, lport_names, options,
+                                      if_exists=True):
+        """Create a command to set the QoS options of OVN logical switch ports
+
+        Only the QoS keys of the options of the ports are changed, the QoS
+        keys not in options are removed. The update of many ports may be
+        split in several transactions.
+
+        :param lport_names:   The names of the lports
+        :type lport_names:    list of strings
+        :param options:       The QoS options of the ports
+        :type options:        dictionary
+        :param if_exists:     Do not fail if an lport does not exist
+        :type if_exists:      bool
+        :returns:             :class:`Command` with no result
+        """
+
+    @abc.abstractmethod
+    def set_lswitch_ports_parent(self, lport_parents, if_exists=True):
+        """Create a command to set the parent of OVN logical switch ports
+
+        The update of many ports may be split in several transactions.
+
+        :param lport_parents: The (parent_name, tag) of each lport name,
+                              ([], []) to unset them
+        :type lport_parents:  dictionary
+        :param if_exists:     Do not fail if an lport does not exist
+        :type if_exists:      bool
+        :returns:             :class:`Command` with no result
+        """
+
     @abc.abstractmethod
     def delete_lswitch_port(self, lport_name=None, lswitch_name=None,
                             ext_id=None, if_exists=True):
@@ -178,6 +210,21 @@ class API(object):
         :returns:            :class:`Command` with no result
         """
 
+    @abc.abstractmethod
+    def move_lrouter_gateway(self, name, from_chassis, to_chassis):
+        """Create a command to move the gateway of an OVN lrouter
+
+        The gateway is only moved if it is still hosted by from_chassis.
+
+        :param name:         The unique name of the lrouter
+        :type name:          string
+        :param from_chassis: The chassis currently hosting the gateway
+        :type from_chassis:  string
+        :param to_chassis:   The chassis the gateway is moved to
+        :type to_chassis:    string
+        :returns:            :class:`Command` with no result
+        """
+
     @abc.abstractmethod
     def add_lrouter_port(self, name, lrouter, if_exists=True,
                          **columns):
@@ -308,6 +355,23 @@ class API(object):
         :returns:            :class:`Command` with no result
         """
 
+    @abc.abstractmethod
+    def update_static_routes(self, lrouter, add_routes=None, del_routes=None,
+                             if_exists=True):
+        """Add and delete static routes of a logical router at once
+
+        :param lrouter:      The unique name of the lrouter
+        :type lrouter:       string
+        :param add_routes:   The (ip_prefix, nexthop) of the routes to add
+        :type add_routes:    list of tuples
+        :param del_routes:   The (ip_prefix, nexthop) of the routes to
+                             delete
+        :type del_routes:    list of tuples
+        :param if_exists:    Do not fail if router does not exist
+        :type if_exists:     bool
+        :returns:            :class:`Command` with no result
+        """
+
     @abc.abstractmethod
     def create_address_set(self, name, may_exist=True, **columns):
         """Create an address set
@@ -482,6 +546,14 @@ class SbAPI(object):
         value. And hostname and physnets are related to the same host.
         """
 
+    @abc.abstractmethod
+    def get_chassis_hosts_with_physnet(self, physnet):
+        """Return the set of the hostnames of the chassis with physnet
+
+        :param physnet:         The physical network
+        :type physnet:          string
+        """
+
     @abc.abstractmethod
     def get_all_chassis(self, chassis_type=None):
         """Return a list of all chassis which match the compute_type
@@ -490,6 +562,13 @@ class SbAPI(object):
         :type chassis_type:     string
         """
 
+    @abc.abstractmethod
+    def get_chassis_gateway_weights(self):
+        """Return the weight of each chassis to host gateway routers
+
+        :returns: dictionary of chassis name to weight, a float >= 0
+        """
+
     @abc.abstractmethod
     def get_chassis_datapath_and_iface_types(self, hostname):
         """Return the datapath type and iface types supported by the chassis
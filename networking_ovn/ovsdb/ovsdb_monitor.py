@@ -13,18 +13,26 @@
 #    under the License.
 
 import atexit
+import collections
 from eventlet import greenthread
+import greenlet
 from six.moves import queue
-import tenacity
 import threading
+import time
+import traceback
 
 from oslo_log import log
 from ovs.db import idl
 from ovs import poller
 
-from networking_ovn._i18n import _LE
+from networking_ovn._i18n import _LE, _LI, _LW
 from networking_ovn.common import config as ovn_config
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.common import metrics
+from networking_ovn.ovsdb import event_shards
 from networking_ovn.ovsdb import row_event
+from networking_ovn.ovsdb import schema
+from networking_ovn.ovsdb import transaction
 from neutron.agent.ovsdb.native import connection
 from neutron.agent.ovsdb.native import idlutils
 from neutron.common import config
@@ -37,7 +45,21 @@ LOG = log.getLogger(__name__)
 
 
 class ChassisEvent(row_event.RowEvent):
-    """Chassis create update delete event."""
+    """Chassis create update delete event.
+
+    Updates are only handled when the hostname or the ovn-bridge-mappings
+    of the chassis changed, other columns (nb_cfg, encaps...) are updated
+    frequently and aren't relevant to neutron.
+
+    Events are debounced: the changes of all the chassis received within
+    DEBOUNCE_INTERVAL seconds are applied at once, followed by a single
+    scheduling of the unhosted routers and, if chassis were created and
+    ovn_l3_rebalance_on_chassis_join is set, a single rebalancing of the
+    gateway routers. A single rebalancing runs at a time, those requested
+    while it runs are coalesced into one more pass once it completes.
+    """
+
+    DEBOUNCE_INTERVAL = 0.5
 
     def __init__(self, driver):
         self.driver = driver
@@ -47,18 +69,181 @@ class ChassisEvent(row_event.RowEvent):
         events = (self.ROW_CREATE, self.ROW_UPDATE, self.ROW_DELETE)
         super(ChassisEvent, self).__init__(events, table, None)
         self.event_name = 'ChassisEvent'
+        # hostname -> list of physical networks, waiting to be applied
+        self._pending_hosts = {}
+        self._chassis_joined = False
+        self._flush_thread = None
+        self._rebalancing = False
+        self._rebalance_requested = False
+
+    @staticmethod
+    def _get_bridge_mappings(row):
+        return row.external_ids.get('ovn-bridge-mappings', '')
+
+    def matches(self, event, row, old=None):
+        if not super(ChassisEvent, self).matches(event, row, old):
+            return False
+        if event != self.ROW_UPDATE or old is None:
+            return True
+        # Only the columns that changed are set in the old row
+        try:
+            if old.hostname != row.hostname:
+                return True
+        except AttributeError:
+            pass
+        try:
+            return (self._get_bridge_mappings(old) !=
+                    self._get_bridge_mappings(row))
+        except AttributeError:
+            return False
 
     def run(self, event, row, old):
         host = row.hostname
         phy_nets = []
         if event != self.ROW_DELETE:
-            bridge_mappings = row.external_ids.get('ovn-bridge-mappings', '')
+            bridge_mappings = self._get_bridge_mappings(row)
             mapping_dict = n_utils.parse_mappings(bridge_mappings.split(','))
             phy_nets = list(mapping_dict)
+        if event == self.ROW_UPDATE and old is not None:
+            try:
+                if old.hostname != host:
+                    # The chassis moved to another host, the old host
+                    # doesn't provide any physical network anymore.
+                    self._pending_hosts[old.hostname] = []
+            except AttributeError:
+                pass
 
-        self.driver.update_segment_host_mapping(host, phy_nets)
-        if ovn_config.is_ovn_l3():
-            self.l3_plugin.schedule_unhosted_routers()
+        self._pending_hosts[host] = phy_nets
+        if event == self.ROW_CREATE:
+            self._chassis_joined = True
+        if self._flush_thread is None:
+            self._flush_thread = greenthread.spawn_after(
+                self.DEBOUNCE_INTERVAL, self._flush)
+
+    def _flush(self):
+        self._flush_thread = None
+        pending, self._pending_hosts = self._pending_hosts, {}
+        chassis_joined, self._chassis_joined = self._chassis_joined, False
+        if not pending:
+            return
+        try:
+            self.driver.update_segment_host_mappings(pending)
+            if ovn_config.is_ovn_l3():
+                self.l3_plugin.schedule_unhosted_routers()
+                if (chassis_joined and
+                        ovn_config.is_ovn_l3_rebalance_on_chassis_join()):
+                    self._rebalance()
+        except Exception:
+            LOG.exception(_LE('Failed to process the Chassis changes of '
+                              'hosts %s'), list(pending))
+
+    def _rebalance(self):
+        # The rebalancing sleeps between its batches, during which the
+        # next flush may request another one
+        if self._rebalancing:
+            self._rebalance_requested = True
+            return
+        self._rebalancing = True
+        try:
+            while True:
+                self._rebalance_requested = False
+                self.l3_plugin.rebalance_routers()
+                if not self._rebalance_requested:
+                    break
+        finally:
+            self._rebalancing = False
+
+
+class PortActivationTracker(object):
+    """Track the time it takes for new ports to become active
+
+    For each Logical_Switch_Port created while the OvnWorker runs, the
+    following phases are recorded in the metrics histograms:
+
+    - ovn_port_activation.nb_commit: from the commit of the port by the
+      API worker, stamped in its external_ids, to the notification of its
+      creation to the OvnWorker, i.e. the time spent committing the port
+      and propagating it.
+    - ovn_port_activation.wait_for_up: from the notification of the
+      creation of the port to the handling of 'up' being set by
+      ovn-northd, i.e. the time spent in ovn-northd, ovn-controller, the
+      hypervisor and in the notification queue.
+    - ovn_port_activation.provisioning: time taken to complete the
+      provisioning block of the port.
+    - ovn_port_activation.total: from the commit of the port to the end of
+      its provisioning.
+
+    The time the up events waited in the notification queue is recorded
+    by the OvnDbNotifyHandler (ovn_event_queue_wait.<event name>), and
+    reported by percentiles() as the queue_wait phase.
+
+    At most max_ports ports are tracked at once, the oldest ones are
+    dropped first.
+    """
+
+    PHASES = ('nb_commit', 'wait_for_up', 'provisioning', 'total')
+    QUEUE_WAIT_HISTOGRAM = (
+        'ovn_event_queue_wait.LogicalSwitchPortUpdateUpEvent')
+
+    def __init__(self, max_ports):
+        self.max_ports = max_ports
+        # port name -> (commit time, creation notification time)
+        self._ports = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def port_created(self, name, created_at=None):
+        """Track the port notified as created
+
+        :param created_at: time the port was committed, defaults to now
+        """
+        notified_at = time.time()
+        with self._lock:
+            self._ports[name] = (created_at or notified_at, notified_at)
+            while len(self._ports) > self.max_ports:
+                self._ports.popitem(last=False)
+
+    def port_deleted(self, name):
+        with self._lock:
+            self._ports.pop(name, None)
+
+    def port_up(self, name, started_at, completed_at):
+        with self._lock:
+            times = self._ports.pop(name, None)
+        if times is None:
+            # Port created before the worker started or not tracked anymore
+            return
+        created_at, notified_at = times
+        metrics.observe('ovn_port_activation.nb_commit',
+                        notified_at - created_at)
+        metrics.observe('ovn_port_activation.wait_for_up',
+                        started_at - notified_at)
+        metrics.observe('ovn_port_activation.provisioning',
+                        completed_at - started_at)
+        metrics.observe('ovn_port_activation.total',
+                        completed_at - created_at)
+
+    def percentiles(self):
+        """Get the percentiles of the activation phases
+
+        :returns: dictionary of phase name to a dictionary of percentile
+                  to value in seconds
+        """
+        registry = metrics.get_registry()
+        percentiles = dict((phase, registry.get_histogram(
+            'ovn_port_activation.%s' % phase).percentiles())
+            for phase in self.PHASES)
+        percentiles['queue_wait'] = registry.get_histogram(
+            self.QUEUE_WAIT_HISTOGRAM).percentiles()
+        return percentiles
+
+
+def _get_port_created_at(row):
+    try:
+        created_at = row.external_ids.get(
+            ovn_const.OVN_PORT_CREATED_AT_EXT_ID_KEY)
+        return float(created_at) if created_at else None
+    except (AttributeError, ValueError):
+        return None
 
 
 class LogicalSwitchPortCreateUpEvent(row_event.RowEvent):
@@ -107,8 +292,9 @@ class LogicalSwitchPortUpdateUpEvent(row_event.RowEvent):
     New value of Logical_Switch_Port 'up' will be True and the old value will
     be False.
     """
-    def __init__(self, driver):
+    def __init__(self, driver, tracker=None):
         self.driver = driver
+        self.tracker = tracker
         table = 'Logical_Switch_Port'
         events = (self.ROW_UPDATE)
         super(LogicalSwitchPortUpdateUpEvent, self).__init__(
@@ -117,7 +303,10 @@ class LogicalSwitchPortUpdateUpEvent(row_event.RowEvent):
         self.event_name = 'LogicalSwitchPortUpdateUpEvent'
 
     def run(self, event, row, old):
+        started_at = time.time()
         self.driver.set_port_status_up(row.name)
+        if self.tracker is not None:
+            self.tracker.port_up(row.name, started_at, time.time())
 
 
 class LogicalSwitchPortUpdateDownEvent(row_event.RowEvent):
@@ -142,7 +331,7 @@ class LogicalSwitchPortUpdateDownEvent(row_event.RowEvent):
 
 class OvnDbNotifyHandler(object):
 
-    STOP_EVENT = ("STOP", None, None, None)
+    STOP_EVENT = ("STOP", None, None, None, None)
 
     def __init__(self, driver):
         self.driver = driver
@@ -187,16 +376,52 @@ class OvnDbNotifyHandler(object):
     def shutdown(self):
         self.notifications.put(OvnDbNotifyHandler.STOP_EVENT)
 
+    def _log_slow_handler(self, match, event, row, started_at, handler):
+        # The stack of the handler greenthread shows where it is blocked
+        stack = ''.join(traceback.format_stack(handler.gr_frame))
+        LOG.warning(_LW("Handler of %(event_name)s is running for %(time).2f "
+                        "seconds, event: %(event)s, row: %(row)s, "
+                        "stack:\n%(stack)s"),
+                    {'event_name': match.event_name,
+                     'time': time.time() - started_at, 'event': event,
+                     'row': event_shards.get_row_key(row), 'stack': stack})
+
+    def _run_event(self, match, event, row, updates, enqueued_at):
+        started_at = time.time()
+        metrics.observe('ovn_event_queue_wait.%s' % match.event_name,
+                        started_at - enqueued_at)
+        watchdog = None
+        threshold = ovn_config.get_ovn_event_handler_slow_threshold()
+        if threshold:
+            watchdog = greenthread.spawn_after(
+                threshold, self._log_slow_handler, match, event, row,
+                started_at, greenlet.getcurrent())
+        try:
+            match.run(event, row, updates)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            duration = time.time() - started_at
+            metrics.observe('ovn_event_handler_duration.%s' %
+                            match.event_name, duration)
+            if threshold and duration > threshold:
+                LOG.warning(_LW("Handler of %(event_name)s took %(time).2f "
+                                "seconds, event: %(event)s, row: %(row)s"),
+                            {'event_name': match.event_name,
+                             'time': duration, 'event': event,
+                             'row': event_shards.get_row_key(row)})
+
     def notify_loop(self):
         while True:
             try:
-                match, event, row, updates = self.notifications.get()
+                match, event, row, updates, enqueued_at = (
+                    self.notifications.get())
                 if (not isinstance(match, row_event.RowEvent) and
-                        (match, event, row, updates) == (
+                        (match, event, row, updates, enqueued_at) == (
                             OvnDbNotifyHandler.STOP_EVENT)):
                     self.notifications.task_done()
                     break
-                match.run(event, row, updates)
+                self._run_event(match, event, row, updates, enqueued_at)
                 if match.ONETIME:
                     self.unwatch_event(match)
                 self.notifications.task_done()
@@ -209,10 +434,46 @@ class OvnDbNotifyHandler(object):
         matching = self.matching_events(
             event, row, updates)
         for match in matching:
-            self.notifications.put((match, event, row, updates))
+            self.queue(match, event, row, updates)
+
+    def queue(self, match, event, row, updates=None):
+        """Queue the handling of an event matched by the caller"""
+        self.notifications.put((match, event, row, updates, time.time()))
+
+
+class BaseOvnIdl(idl.Idl):
+    """Idl calling listeners on the changes of the rows of some tables
+
+    The listeners are called from the connection thread for every change,
+    whether the events are handled by this neutron server or not, to keep
+    the caches of the rows up to date (e.g. the load of the chassis).
+    """
+
+    def __init__(self, remote, schema):
+        super(BaseOvnIdl, self).__init__(remote, schema)
+        self.table_listeners = collections.defaultdict(list)
 
+    def add_table_listener(self, table_name, listener):
+        """Call listener(event, row, updates) on the changes of table_name"""
+        self.table_listeners[table_name].append(listener)
+
+    def notify(self, event, row, updates=None):
+        if not self.table_listeners:
+            return
+        for listener in self.table_listeners.get(row._table.name, ()):
+            try:
+                listener(event, row, updates)
+            except Exception:
+                LOG.exception(_LE('Listener of the %s table failed'),
+                              row._table.name)
 
-class OvnIdl(idl.Idl):
+
+class OvnIdl(BaseOvnIdl):
+
+    # Tables whose rows are partitioned between the event shards, the
+    # events of the other tables are handled by the holder of the first
+    # shard. None if the rows of all the tables are partitioned.
+    sharded_tables = None
 
     def __init__(self, driver, remote, schema):
         super(OvnIdl, self).__init__(remote, schema)
@@ -236,17 +497,44 @@ class OvnIdl(idl.Idl):
         #    ovsdb server would assign the lock to one of the other neutron
         #    servers.
         self.event_lock_name = "neutron_ovn_event_lock"
+        # When the events are sharded (see the ovn_event_lock_shards option)
+        # the event lock isn't used, each shard has its own lock instead.
+        self.event_shards = None
 
     def notify(self, event, row, updates=None):
+        super(OvnIdl, self).notify(event, row, updates)
+        if self.event_shards is not None:
+            if not self.event_shards.owns_row(row):
+                LOG.debug("Don't have the event shard lock of the row to "
+                          "handle the notify event. Ignoring the event : %s",
+                          event)
+                return
         # Do not handle the notification if the event lock is requested,
         # but not granted by the ovsdb-server.
-        if (self.is_lock_contended and not self.has_lock):
+        elif (self.is_lock_contended and not self.has_lock):
             LOG.debug("Don't have the event lock to handle the notify"
                       " events. Ignoring the event : %s", event)
             return
         LOG.debug("Have the event lock to handle the notify events")
         self.notify_handler.notify(event, row, updates)
 
+    def run(self):
+        result = super(OvnIdl, self).run()
+        if self.event_shards is not None:
+            shards = self.event_shards.pop_acquired()
+            if shards:
+                LOG.info(_LI("Syncing the acquired event shards %s"), shards)
+                self.sync_shards(shards)
+        return result
+
+    def sync_shards(self, shards):
+        """Handle the current state of the rows of the acquired shards
+
+        The events of the rows of these shards may have been missed while
+        no neutron server held their lock.
+        """
+        pass
+
     def post_initialize(self, driver):
         """Should be called after the idl has been initialized"""
         pass
@@ -254,9 +542,20 @@ class OvnIdl(idl.Idl):
 
 class OvnNbIdl(OvnIdl):
 
+    sharded_tables = ('Logical_Switch_Port',)
+
     def __init__(self, driver, remote, schema):
         super(OvnNbIdl, self).__init__(driver, remote, schema)
-        self._lsp_update_up_event = LogicalSwitchPortUpdateUpEvent(driver)
+        self.port_activation_tracker = None
+        tracker_size = ovn_config.get_ovn_port_activation_tracker_size()
+        if tracker_size:
+            self.port_activation_tracker = PortActivationTracker(
+                tracker_size)
+        # Set after the initial dump of the DB, only the ports created
+        # afterwards are tracked.
+        self._track_port_activation = False
+        self._lsp_update_up_event = LogicalSwitchPortUpdateUpEvent(
+            driver, self.port_activation_tracker)
         self._lsp_update_down_event = LogicalSwitchPortUpdateDownEvent(driver)
         self._lsp_create_up_event = LogicalSwitchPortCreateUpEvent(driver)
         self._lsp_create_down_event = LogicalSwitchPortCreateDownEvent(driver)
@@ -265,6 +564,10 @@ class OvnNbIdl(OvnIdl):
                                           self._lsp_create_down_event,
                                           self._lsp_update_up_event,
                                           self._lsp_update_down_event])
+        # Set the status of the ports of the acquired event shards, as
+        # done for all the ports on connection
+        self._lsp_sync_events = (LogicalSwitchPortCreateUpEvent(driver),
+                                 LogicalSwitchPortCreateDownEvent(driver))
 
     def unwatch_logical_switch_port_create_events(self):
         """Unwatch the logical switch port create events.
@@ -280,12 +583,45 @@ class OvnNbIdl(OvnIdl):
         self._lsp_create_up_event = None
         self._lsp_create_down_event = None
 
+    def notify(self, event, row, updates=None):
+        if (self._track_port_activation and
+                row._table.name == 'Logical_Switch_Port'):
+            if event == idl.ROW_CREATE:
+                self.port_activation_tracker.port_created(
+                    row.name, _get_port_created_at(row))
+            elif event == idl.ROW_DELETE:
+                self.port_activation_tracker.port_deleted(row.name)
+        super(OvnNbIdl, self).notify(event, row, updates)
+
+    def sync_shards(self, shards):
+        shards = set(shards)
+        for row in list(self.tables['Logical_Switch_Port'].rows.values()):
+            if self.event_shards.get_row_shard(row) not in shards:
+                continue
+            for match in self._lsp_sync_events:
+                if match.matches(idl.ROW_CREATE, row):
+                    self.notify_handler.queue(match, idl.ROW_CREATE, row)
+
     def post_initialize(self, driver):
         self.unwatch_logical_switch_port_create_events()
+        self._track_port_activation = (
+            self.port_activation_tracker is not None)
 
 
 class OvnSbIdl(OvnIdl):
 
+    # The Chassis events are handled by a single neutron server, the
+    # scheduling of the gateway routers mustn't run on several ones
+    sharded_tables = ()
+
+    def sync_shards(self, shards):
+        chassis_event = getattr(self, '_chassis_event', None)
+        if chassis_event is None or 0 not in shards:
+            # The Chassis are synced at startup
+            return
+        for row in list(self.tables['Chassis'].rows.values()):
+            self.notify_handler.queue(chassis_event, idl.ROW_UPDATE, row)
+
     def post_initialize(self, driver):
         """Watch Chassis events.
 
@@ -298,7 +634,7 @@ class OvnSbIdl(OvnIdl):
         self.notify_handler.watch_events([self._chassis_event])
 
 
-class OvnConnection(connection.Connection):
+class OvnConnection(transaction.GroupCommitMixin, connection.Connection):
 
     def get_ovn_idl_cls(self):
         """Get the ovn idl class
@@ -317,33 +653,30 @@ class OvnConnection(connection.Connection):
         # except that OvnIdl object is created instead of idl.Idl and the
         # enable_connection_uri() helper isn't called (since ovs-vsctl won't
         # exist on the controller node when using the reference architecture).
+        # table_name_list may also be a dictionary of table names to column
+        # names, see schema.register_tables().
         with self.lock:
             if self.idl is not None:
                 return
 
-            try:
-                helper = idlutils.get_schema_helper(self.connection,
-                                                    self.schema_name)
-            except Exception:
-                # There is a small window for a race, so retry up to a second
-                @tenacity.retry(
-                    wait=tenacity.wait_exponential(multiplier=0.01),
-                    stop=tenacity.stop_after_delay(1),
-                    reraise=True)
-                def do_get_schema_helper():
-                    return idlutils.get_schema_helper(self.connection,
-                                                      self.schema_name)
-                helper = do_get_schema_helper()
-
-            if table_name_list is None:
-                helper.register_all()
-            else:
-                for table_name in table_name_list:
-                    helper.register_table(table_name)
+            helper = schema.get_schema_helper(self.connection,
+                                              self.schema_name)
+            schema.register_tables(helper, table_name_list)
 
             idl_cls = self.get_ovn_idl_cls()
             self.idl = idl_cls(driver, self.connection, helper)
-            self.idl.set_lock(self.idl.event_lock_name)
+            num_shards = ovn_config.get_ovn_event_lock_shards()
+            if num_shards:
+                self.idl.event_shards = event_shards.EventShards(
+                    self.connection, helper.schema_json,
+                    '%s_%s' % (self.idl.event_lock_name, self.schema_name),
+                    num_shards,
+                    ovn_config.get_ovn_event_lock_shards_per_server(),
+                    sharded_tables=self.idl.sharded_tables)
+                self.idl.event_shards.wait_for_locks(self.timeout)
+                self.idl.event_shards.start()
+            else:
+                self.idl.set_lock(self.idl.event_lock_name)
             idlutils.wait_for_change(self.idl, self.timeout)
             self.idl.post_initialize(driver)
             self.poller = poller.Poller()
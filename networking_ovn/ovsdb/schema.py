@@ -0,0 +1,141 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+
+from oslo_log import log
+import six
+import tenacity
+
+from neutron.agent.ovsdb.native import idlutils
+
+LOG = log.getLogger(__name__)
+
+OVN_NORTHBOUND = 'OVN_Northbound'
+OVN_SOUTHBOUND = 'OVN_Southbound'
+
+# Worker roles. API and RPC workers share the 'api' role, the OvnWorker
+# (see ovsdb_monitor.OvnWorker) has the 'ovn' role.
+WORKER_ROLE_API = 'api'
+WORKER_ROLE_OVN = 'ovn'
+
+# Tables and columns of the OVN_Northbound DB read or written by the
+# commands in ovsdb/commands.py and the getters in ovsdb/impl_idl_ovn.py.
+# A value of None registers every column of the table.
+NB_API_TABLES = {
+    'Logical_Switch': ['name', 'ports', 'acls', 'external_ids'],
+    'Logical_Switch_Port': ['name', 'addresses', 'external_ids',
+                            'parent_name', 'tag', 'enabled', 'options',
+                            'type', 'port_security', 'dhcpv4_options'],
+    'Logical_Router': ['name', 'ports', 'static_routes', 'enabled',
+                       'options', 'external_ids'],
+    'Logical_Router_Port': ['name', 'mac', 'networks'],
+    'Logical_Router_Static_Route': ['ip_prefix', 'nexthop'],
+    'ACL': ['priority', 'direction', 'match', 'action', 'log',
+            'external_ids'],
+    'Address_Set': ['name', 'addresses', 'external_ids'],
+    'DHCP_Options': ['cidr', 'options', 'external_ids'],
+}
+
+# Additional OVN_Northbound columns needed by the events the OvnWorker
+# watches (see ovsdb_monitor.OvnNbIdl).
+NB_OVN_WORKER_TABLES = {
+    'Logical_Switch_Port': ['up'],
+}
+
+# Tables and columns of the OVN_Southbound DB read by OvsdbSbOvnIdl and the
+# ChassisEvent.
+SB_API_TABLES = {
+    'Chassis': ['name', 'hostname', 'external_ids'],
+}
+
+SB_OVN_WORKER_TABLES = {}
+
+_TABLES = {
+    (OVN_NORTHBOUND, WORKER_ROLE_API): (NB_API_TABLES,),
+    (OVN_NORTHBOUND, WORKER_ROLE_OVN): (NB_API_TABLES, NB_OVN_WORKER_TABLES),
+    (OVN_SOUTHBOUND, WORKER_ROLE_API): (SB_API_TABLES,),
+    (OVN_SOUTHBOUND, WORKER_ROLE_OVN): (SB_API_TABLES, SB_OVN_WORKER_TABLES),
+}
+
+
+def _merge_tables(*table_dicts):
+    result = {}
+    for tables in table_dicts:
+        for table, columns in six.iteritems(tables):
+            if table in result and result[table] is None:
+                continue
+            if columns is None:
+                result[table] = None
+                continue
+            merged = result.setdefault(table, [])
+            merged.extend(c for c in columns if c not in merged)
+    return result
+
+
+def get_tables(schema_name, worker_role):
+    """Get the tables and columns to register for a worker role
+
+    :param schema_name: OVN_Northbound or OVN_Southbound
+    :param worker_role: WORKER_ROLE_API or WORKER_ROLE_OVN
+    :returns: dictionary of table name to list of column names, None
+              if all the tables of the schema should be registered
+    """
+    table_dicts = _TABLES.get((schema_name, worker_role))
+    if table_dicts is None:
+        return None
+    return _merge_tables(*copy.deepcopy(table_dicts))
+
+
+def get_schema_helper(connection, schema_name):
+    try:
+        return idlutils.get_schema_helper(connection, schema_name)
+    except Exception:
+        # There is a small window for a race, so retry up to a second
+        @tenacity.retry(
+            wait=tenacity.wait_exponential(multiplier=0.01),
+            stop=tenacity.stop_after_delay(1),
+            reraise=True)
+        def do_get_schema_helper():
+            return idlutils.get_schema_helper(connection, schema_name)
+        return do_get_schema_helper()
+
+
+def register_tables(helper, tables=None):
+    """Register tables and columns in a schema helper
+
+    :param helper:  ovs.db.idl.SchemaHelper
+    :param tables:  None to register the whole schema, a list of table
+                    names to register all their columns, or a dictionary
+                    of table name to list of column names (None for all
+                    the columns of the table). Tables and columns missing
+                    from the schema served by ovsdb-server are skipped.
+    """
+    if tables is None:
+        helper.register_all()
+        return
+
+    if not isinstance(tables, dict):
+        tables = dict.fromkeys(tables)
+
+    schema_tables = helper.schema_json.get('tables', {})
+    for table_name, columns in six.iteritems(tables):
+        if table_name not in schema_tables:
+            LOG.debug("Table %s not found in schema, not registering it",
+                      table_name)
+            continue
+        if columns is None:
+            helper.register_table(table_name)
+            continue
+        schema_columns = schema_tables[table_name].get('columns', {})
+        helper.register_columns(
+            table_name, [c for c in columns if c in schema_columns])
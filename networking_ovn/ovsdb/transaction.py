@@ -0,0 +1,678 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import math
+import os
+import time
+import traceback
+import weakref
+
+import greenlet
+from neutron.agent.ovsdb import impl_idl
+from neutron.agent.ovsdb.native import connection
+from neutron.agent.ovsdb.native import idlutils
+from oslo_log import log
+from ovs.db import idl
+from ovs import poller
+import six
+from six.moves import queue
+
+from networking_ovn._i18n import _, _LE, _LW
+from networking_ovn.common import config as ovn_config
+from networking_ovn.common import metrics
+from networking_ovn.ovsdb import commands as cmd
+
+LOG = log.getLogger(__name__)
+
+# Transactions of the API requests, committed first
+PRIORITY_INTERACTIVE = 'interactive'
+# Transactions of the maintenance tasks (DB sync, router rescheduling, QoS
+# fan-outs...), committed when no interactive transaction is waiting and
+# rate limited with ovn_background_txn_rate
+PRIORITY_BACKGROUND = 'background'
+
+# Priority of the transactions created by each green thread
+_priorities = weakref.WeakKeyDictionary()
+
+
+@contextlib.contextmanager
+def background():
+    """Create the transactions of the block with the background priority"""
+    current = greenlet.getcurrent()
+    previous = _priorities.get(current)
+    _priorities[current] = PRIORITY_BACKGROUND
+    try:
+        yield
+    finally:
+        if previous is None:
+            _priorities.pop(current, None)
+        else:
+            _priorities[current] = previous
+
+
+def get_current_priority():
+    return _priorities.get(greenlet.getcurrent(), PRIORITY_INTERACTIVE)
+
+
+def _get_row_key(command):
+    # Table and name of the row modified by the command, for the commands
+    # handled by optimize_commands(). All the commands modifying the rows
+    # of these tables must be listed here.
+    if isinstance(command, (cmd.AddAddrSetCommand, cmd.DelAddrSetCommand,
+                            cmd.UpdateAddrSetCommand,
+                            cmd.UpdateAddrSetExtIdsCommand)):
+        return 'Address_Set', command.name
+    if isinstance(command, (cmd.AddLSwitchPortCommand,
+                            cmd.SetLSwitchPortCommand,
+                            cmd.DelLSwitchPortCommand)):
+        return 'Logical_Switch_Port', command.lport
+    if isinstance(command, cmd.SetLRouterPortInLSwitchPortCommand):
+        return 'Logical_Switch_Port', command.lswitch_port
+    return None
+
+
+def _merge_addr_set_updates(first, second):
+    # Same result as applying first then second: the addresses removed by
+    # second aren't added, the addresses added by second aren't removed.
+    removed = set(second.addrs_remove or [])
+    addrs_add = []
+    for addr in (first.addrs_add or []) + (second.addrs_add or []):
+        if addr not in removed and addr not in addrs_add:
+            addrs_add.append(addr)
+    added = set(addrs_add)
+    addrs_remove = []
+    for addr in (first.addrs_remove or []) + (second.addrs_remove or []):
+        if addr not in added and addr not in addrs_remove:
+            addrs_remove.append(addr)
+    return cmd.UpdateAddrSetCommand(first.api, first.name, addrs_add or None,
+                                    addrs_remove or None, first.if_exists)
+
+
+def optimize_commands(commands):
+    """Remove the redundant commands of a transaction
+
+    - The successive updates of the addresses of an address set are merged
+      into a single update.
+    - An address set or a logical switch port created and then deleted in
+      the same transaction is only deleted: the creation is dropped and the
+      deletion is done if the row exists.
+
+    A command is only merged with, or cancels, the previous command
+    modifying the same row, so that the commands in between run in the
+    same state.
+
+    :param commands: The commands of the transaction, in order
+    :returns:        The commands to run, in order
+    """
+    optimized = []
+    # Index in optimized of the last command modifying each row
+    last = {}
+    for command in commands:
+        key = _get_row_key(command)
+        if key is None:
+            optimized.append(command)
+            continue
+        previous = optimized[last[key]] if key in last else None
+        if (isinstance(command, cmd.UpdateAddrSetCommand) and
+                isinstance(previous, cmd.UpdateAddrSetCommand) and
+                previous.if_exists == command.if_exists):
+            optimized[last[key]] = _merge_addr_set_updates(previous, command)
+            continue
+        if ((isinstance(command, cmd.DelAddrSetCommand) and
+                isinstance(previous, cmd.AddAddrSetCommand)) or
+                (isinstance(command, cmd.DelLSwitchPortCommand) and
+                 isinstance(previous, cmd.AddLSwitchPortCommand))):
+            if previous.may_exist:
+                optimized[last[key]] = None
+                # The row is deleted only if it existed before
+                command.if_exists = True
+        last[key] = len(optimized)
+        optimized.append(command)
+    return [command for command in optimized if command is not None]
+
+
+class TransactionTimings(object):
+    """Time spent by a transaction in each step of its commit
+
+    The commands and commit times add up the attempts of the transaction,
+    when retried on TRY_AGAIN or committed again out of its group.
+    """
+
+    def __init__(self):
+        self.queue_wait = 0.0
+        # Time running the commands, by command class
+        self.commands = collections.defaultdict(float)
+        # Time waiting for the ovsdb-server to commit the transaction
+        self.commit = 0.0
+        self.retries = 0
+
+    def add_command(self, command, duration):
+        self.commands[command.__class__.__name__] += duration
+
+    def observe(self, priority):
+        metrics.observe('ovn_txn_queue_wait.%s' % priority, self.queue_wait)
+        for name, duration in self.commands.items():
+            metrics.observe('ovn_txn_command.%s' % name, duration)
+        metrics.observe('ovn_txn_commit', self.commit)
+        metrics.observe('ovn_txn_retries', self.retries)
+
+    def __str__(self):
+        commands = ', '.join('%s %.3fs' % (name, duration) for name, duration
+                             in sorted(self.commands.items()))
+        return ('queue wait %.3fs, commands [%s], commit %.3fs, %d retries' %
+                (self.queue_wait, commands, self.commit, self.retries))
+
+
+def _commit_block(txn, ovn_txns):
+    started_at = time.time()
+    status = txn.commit_block()
+    duration = time.time() - started_at
+    for ovn_txn in ovn_txns:
+        ovn_txn.timings.commit += duration
+    return status
+
+
+class PartialCommitError(RuntimeError):
+    """Some parts of a transaction split by Transaction.commit() failed
+
+    :ivar errors: The exceptions of the failed parts, by part index
+    """
+
+    def __init__(self, errors, count):
+        self.errors = errors
+        super(PartialCommitError, self).__init__(
+            _("%(failed)d of the %(count)d parts of the transaction failed: "
+              "%(errors)s") % {'failed': len(errors), 'count': count,
+                               'errors': errors})
+
+
+class Transaction(impl_idl.Transaction):
+    """Transaction of the OVN_Northbound DB
+
+    Same as the base class, except that it can be committed in the same
+    OVSDB transaction as other transactions queued at the same time, see
+    commit_group().
+    """
+
+    # Maximum number of commands logged for a slow transaction
+    SLOW_LOG_MAX_COMMANDS = 20
+
+    def __init__(self, api, ovsdb_connection, timeout, check_error=False,
+                 log_errors=True, groupable=True, priority=None):
+        super(Transaction, self).__init__(api, ovsdb_connection, timeout,
+                                          check_error, log_errors)
+        self.groupable = groupable
+        self.priority = priority or get_current_priority()
+        # The commands added to the transaction, self.commands being the
+        # commands run once optimized
+        self.added_commands = self.commands
+        # Part of a transaction already optimized and split
+        self.is_part = False
+        self.timings = TransactionTimings()
+
+    def optimize(self):
+        self.commands = optimize_commands(self.added_commands)
+        if len(self.commands) < len(self.added_commands):
+            LOG.debug("Transaction optimized from %(added)d to %(run)d "
+                      "commands", {'added': len(self.added_commands),
+                                   'run': len(self.commands)})
+
+    def partition(self, max_size):
+        """Split the commands in parts of up to max_size items
+
+        Only the transactions made of commands which can be partitioned
+        (ACL updates, address set updates, DHCP options...), which are
+        independent from each other, are split.
+
+        :returns: The lists of commands of the parts, or None if the
+                  transaction can't or doesn't need to be split
+        """
+        if not max_size or not self.commands:
+            return None
+        if not all(callable(getattr(command, 'partition', None))
+                   for command in self.commands):
+            return None
+        if sum(command.get_size() for command in self.commands) <= max_size:
+            return None
+        parts = [[]]
+        size = 0
+        for command in self.commands:
+            for partition in command.partition(max_size):
+                partition_size = partition.get_size()
+                if parts[-1] and size + partition_size > max_size:
+                    parts.append([])
+                    size = 0
+                parts[-1].append(partition)
+                size += partition_size
+        return parts
+
+    def commit(self):
+        if not self.is_part:
+            # Done by the caller, before the transaction is queued
+            self.optimize()
+            parts = self.partition(ovn_config.get_ovn_txn_max_size())
+            if parts:
+                return self._commit_parts(parts)
+        started_at = time.time()
+        try:
+            return super(Transaction, self).commit()
+        finally:
+            duration = time.time() - started_at
+            metrics.observe('ovn_txn_total', duration)
+            threshold = ovn_config.get_ovn_txn_slow_threshold()
+            if threshold and duration > threshold:
+                self._log_slow(duration)
+
+    def _log_slow(self, duration):
+        commands = [str(command) for command
+                    in self.commands[:self.SLOW_LOG_MAX_COMMANDS]]
+        if len(self.commands) > self.SLOW_LOG_MAX_COMMANDS:
+            commands.append('... %d more' % (len(self.commands) -
+                                             self.SLOW_LOG_MAX_COMMANDS))
+        LOG.warning(_LW("OVN_Northbound DB transaction took %(time).2f "
+                        "seconds: %(timings)s, commands: %(commands)s"),
+                    {'time': duration, 'timings': self.timings,
+                     'commands': commands})
+
+    def _commit_parts(self, parts):
+        # Each part is committed in its own transaction, within the
+        # timeout, the failure of a part not preventing the others.
+        LOG.debug("Transaction of %(count)d commands split in %(parts)d "
+                  "parts", {'count': len(self.commands),
+                            'parts': len(parts)})
+        errors = {}
+        for i, commands in enumerate(parts):
+            txn = Transaction(self.api, self.ovsdb_connection, self.timeout,
+                              check_error=True, log_errors=False,
+                              groupable=self.groupable,
+                              priority=self.priority)
+            txn.is_part = True
+            for command in commands:
+                txn.add(command)
+            try:
+                txn.commit()
+            except Exception as e:
+                errors[i] = e
+                if self.log_errors:
+                    LOG.error(_LE("Part %(part)d of %(count)d of the "
+                                  "transaction failed: %(error)s"),
+                              {'part': i + 1, 'count': len(parts),
+                               'error': e})
+        if errors and self.check_error:
+            raise PartialCommitError(errors, len(parts))
+        return self.get_results()
+
+    def pre_commit(self, txn):
+        super(Transaction, self).pre_commit(txn)
+        # The rows may have changed since the previous attempt
+        cache = cmd.get_row_cache(self.api.idl)
+        if cache is not None:
+            cache.clear()
+
+    def do_commit(self):
+        # Same as the base class, with the commands run by run_commands()
+        # and the time of each step recorded.
+        deadline = time.time() + self.timeout
+        with cmd.row_cache(self.api.idl):
+            while True:
+                txn = idl.Transaction(self.api.idl)
+                self.pre_commit(txn)
+                try:
+                    self.run_commands(txn)
+                except Exception:
+                    txn.abort()
+                    if self.check_error:
+                        raise
+                    LOG.debug("Command failed, transaction aborted",
+                              exc_info=True)
+                    return None
+
+                seqno = self.api.idl.change_seqno
+                status = _commit_block(txn, [self])
+                if status == txn.TRY_AGAIN:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(_("OVS transaction timed out"))
+                    self.timings.retries += 1
+                    LOG.debug("OVSDB transaction returned TRY_AGAIN, "
+                              "retrying")
+                    idlutils.wait_for_change(self.api.idl, remaining, seqno)
+                    continue
+                elif status == txn.ERROR:
+                    msg = _("OVSDB Error: %s") % txn.get_error()
+                    if self.log_errors:
+                        LOG.error(msg)
+                    if self.check_error:
+                        raise RuntimeError(msg)
+                    return None
+                elif status == txn.ABORTED:
+                    LOG.debug("Transaction aborted")
+                    return None
+                elif status == txn.UNCHANGED:
+                    LOG.debug("Transaction caused no change")
+                elif status == txn.SUCCESS:
+                    self.post_commit(txn)
+                return self.get_results()
+
+    def run_commands(self, txn):
+        for i, command in enumerate(self.commands):
+            LOG.debug("Running txn command(idx=%(idx)s): %(cmd)s",
+                      {'idx': i, 'cmd': command})
+            started_at = time.time()
+            try:
+                command.run_idl(txn)
+            finally:
+                self.timings.add_command(command, time.time() - started_at)
+
+    def get_results(self):
+        return [command.result for command in self.added_commands]
+
+
+def is_groupable(txn):
+    return getattr(txn, 'groupable', False)
+
+
+def is_background(txn):
+    return getattr(txn, 'priority', None) == PRIORITY_BACKGROUND
+
+
+def commit_group(ovsdb_idl, txns, timeout):
+    """Commit several transactions in a single OVSDB transaction
+
+    The commands of the transactions are run one transaction after the
+    other in the same OVSDB transaction, which is committed in one round
+    trip to the ovsdb-server. The transactions being queued by different
+    callers at the same time, their relative order doesn't matter.
+
+    :param ovsdb_idl:  The Idl the transactions are committed with
+    :param txns:       The Transactions to commit
+    :param timeout:    Time in seconds after which the retries on TRY_AGAIN
+                       are abandoned
+    :returns:          The results of the transactions, in the same order,
+                       or None if one of the commands failed or the OVSDB
+                       transaction failed. The transactions then have to be
+                       committed separately to get their own result.
+    """
+    deadline = time.time() + timeout
+    while True:
+        txn = idl.Transaction(ovsdb_idl)
+        try:
+            with cmd.row_cache(ovsdb_idl):
+                for ovn_txn in txns:
+                    ovn_txn.pre_commit(txn)
+                for ovn_txn in txns:
+                    ovn_txn.run_commands(txn)
+        except Exception:
+            LOG.debug("Command failed in a group of %d transactions, "
+                      "committing them separately", len(txns))
+            txn.abort()
+            return None
+
+        seqno = ovsdb_idl.change_seqno
+        status = _commit_block(txn, txns)
+        if status == txn.TRY_AGAIN:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            for ovn_txn in txns:
+                ovn_txn.timings.retries += 1
+            LOG.debug("OVSDB transaction returned TRY_AGAIN, retrying")
+            idlutils.wait_for_change(ovsdb_idl, remaining, seqno)
+            continue
+        elif status in (txn.ERROR, txn.ABORTED):
+            LOG.debug("Group of %(count)d transactions failed with "
+                      "%(status)s, committing them separately",
+                      {'count': len(txns), 'status': status})
+            return None
+        elif status == txn.SUCCESS:
+            for ovn_txn in txns:
+                ovn_txn.post_commit(txn)
+        return [ovn_txn.get_results() for ovn_txn in txns]
+
+
+class RateLimiter(object):
+    """Token bucket allowing rate operations per second
+
+    Up to burst operations can be done at once after a period of
+    inactivity. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated_at = time.time()
+
+    def available(self):
+        if not self.rate:
+            return float('inf')
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return int(self.tokens)
+
+    def consume(self, count=1):
+        if self.rate:
+            self.tokens -= count
+
+    def wait_time(self):
+        """Time in seconds until the next operation is allowed"""
+        if self.available() >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TransactionQueue(connection.TransactionQueue):
+    """Queue of the transactions waiting to be committed
+
+    The interactive and background transactions are kept in separate
+    queues, each with its own alert pipe. get_group() takes the oldest
+    interactive transaction, or the oldest background one when no
+    interactive transaction is waiting and the rate limit allows it, and
+    the other transactions of the same priority which can be committed
+    along with it.
+
+    So that the background transactions aren't starved by a steady flow of
+    API requests, one background group is taken after INTERACTIVE_STREAK
+    interactive groups when background transactions are allowed.
+
+    Each priority can hold up to maxsize transactions, so that a backlog of
+    rate limited background transactions doesn't block the interactive
+    ones in put().
+    """
+
+    INTERACTIVE_STREAK = 10
+
+    def __init__(self, maxsize=0, background_rate=0):
+        super(TransactionQueue, self).__init__(maxsize)
+        alertpipe = os.pipe()
+        self.background_alertin = os.fdopen(alertpipe[0], 'rb', 0)
+        self.background_alertout = os.fdopen(alertpipe[1], 'wb', 0)
+        self.limiter = RateLimiter(background_rate)
+        self._interactive_streak = 0
+
+    def _init(self, maxsize):
+        # self.queue holds the interactive transactions
+        self.queue = collections.deque()
+        self.background = collections.deque()
+
+    def _qsize(self, len=len):
+        return len(self.queue) + len(self.background)
+
+    def _put(self, txn):
+        if is_background(txn):
+            self.background.append(txn)
+        else:
+            self.queue.append(txn)
+
+    def _get(self):
+        if self.queue:
+            return self.queue.popleft()
+        return self.background.popleft()
+
+    def put(self, txn, block=True, timeout=None):
+        # Bypass the base classes: only the transactions of the priority of
+        # txn count against maxsize, and the alert is written in the pipe of
+        # that priority.
+        txns = self.background if is_background(txn) else self.queue
+        with self.not_full:
+            if self.maxsize > 0:
+                if not block:
+                    if len(txns) >= self.maxsize:
+                        raise queue.Full
+                elif timeout is None:
+                    while len(txns) >= self.maxsize:
+                        self.not_full.wait()
+                else:
+                    end = time.time() + timeout
+                    while len(txns) >= self.maxsize:
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            raise queue.Full
+                        self.not_full.wait(remaining)
+            self._put(txn)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        alertout = (self.background_alertout if is_background(txn)
+                    else self.alertout)
+        alertout.write(six.b('X'))
+        alertout.flush()
+
+    def get_nowait(self, *args, **kwargs):
+        group = self.get_group(1)
+        return group[0] if group else None
+
+    @property
+    def background_alert_fileno(self):
+        return self.background_alertin.fileno()
+
+    def background_wait_time(self):
+        """Time in seconds until the waiting background txns are allowed
+
+        :returns: 0 if there is no background transaction waiting or if
+                  the rate limit allows to commit one now
+        """
+        if not self.background:
+            return 0
+        return self.limiter.wait_time()
+
+    def _select_queue(self):
+        background_allowed = (self.background and
+                              self.limiter.available() >= 1)
+        if self.queue and not (
+                background_allowed and
+                self._interactive_streak >= self.INTERACTIVE_STREAK):
+            if background_allowed:
+                self._interactive_streak += 1
+            return self.queue, float('inf')
+        if background_allowed:
+            self._interactive_streak = 0
+            return self.background, self.limiter.available()
+        return None, 0
+
+    def get_group(self, max_size):
+        with self.mutex:
+            txns, allowed = self._select_queue()
+            if not txns:
+                return []
+            group = [txns.popleft()]
+            max_size = min(max_size, allowed)
+            if max_size > 1 and is_groupable(group[0]):
+                for other in list(txns):
+                    if len(group) >= max_size:
+                        break
+                    if is_groupable(other):
+                        txns.remove(other)
+                        group.append(other)
+            if txns is self.background:
+                self.limiter.consume(len(group))
+            # The waiting threads may be putting transactions of the other
+            # priority
+            self.not_full.notify_all()
+        # Consume the alerts of the transactions
+        alertin = (self.background_alertin if txns is self.background
+                   else self.alertin)
+        for i in range(len(group)):
+            alertin.read(1)
+        return group
+
+
+class GroupCommitMixin(object):
+    """Commit the transactions queued at the same time together
+
+    Mixin of the connection.Connection classes. The connection thread
+    commits the transactions queued by different green threads at the
+    same time, up to ovn_txn_group_size of them, in a single OVSDB
+    transaction. If one of them fails, they are committed separately so
+    that each caller gets the result of its own transaction.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(GroupCommitMixin, self).__init__(*args, **kwargs)
+        self.txns = TransactionQueue(
+            max(1, ovn_config.get_ovn_txn_group_size()),
+            ovn_config.get_ovn_background_txn_rate())
+
+    def queue_txn(self, txn):
+        txn.queued_at = time.time()
+        super(GroupCommitMixin, self).queue_txn(txn)
+
+    def run(self):
+        while True:
+            self.idl.wait(self.poller)
+            self.poller.fd_wait(self.txns.alert_fileno, poller.POLLIN)
+            wait_time = self.txns.background_wait_time()
+            if wait_time:
+                # The background transactions are throttled, their alerts
+                # would wake up the loop until they are allowed.
+                self.poller.timer_wait(int(math.ceil(wait_time * 1000)))
+            else:
+                self.poller.fd_wait(self.txns.background_alert_fileno,
+                                    poller.POLLIN)
+            self.poller.timer_wait(self.timeout * 1000)
+            self.poller.block()
+            self.idl.run()
+            txns = self.txns.get_group(ovn_config.get_ovn_txn_group_size())
+            if txns:
+                self.commit_txns(txns)
+
+    def commit_txns(self, txns):
+        started_at = time.time()
+        for txn in txns:
+            if hasattr(txn, 'timings'):
+                txn.timings.queue_wait = started_at - getattr(
+                    txn, 'queued_at', started_at)
+        results = None
+        if len(txns) > 1:
+            try:
+                results = commit_group(self.idl, txns, self.timeout)
+            except Exception:
+                LOG.debug("Failed to commit a group of %d transactions, "
+                          "committing them separately", len(txns),
+                          exc_info=True)
+        if results is None:
+            results = [self._do_commit(txn) for txn in txns]
+
+        for txn, result in zip(txns, results):
+            if hasattr(txn, 'timings'):
+                txn.timings.observe(txn.priority)
+            txn.results.put(result)
+            self.txns.task_done()
+
+    def _do_commit(self, txn):
+        try:
+            return txn.do_commit()
+        except Exception as ex:
+            return idlutils.ExceptionResult(ex=ex, tb=traceback.format_exc())
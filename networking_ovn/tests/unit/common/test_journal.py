@@ -0,0 +1,112 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.common import journal
+from networking_ovn.tests import base
+
+
+class TestJournalProcessor(base.TestCase):
+
+    def setUp(self):
+        super(TestJournalProcessor, self).setUp()
+        self.driver = mock.Mock()
+        self.processor = journal.JournalProcessor(self.driver)
+        self.journal_db = mock.patch.object(journal, 'journal_db').start()
+        self.journal_db.get_row_data.side_effect = (
+            lambda row: jsonutils.loads(row.data))
+        self.journal_db.retry_row.return_value = True
+        mock.patch.object(journal.n_context, 'get_admin_context').start()
+        self.seqnum = 0
+
+    def _row(self, uuid, operation=ovn_const.OVN_JOURNAL_CREATE,
+             data=None, object_type=ovn_const.OVN_JOURNAL_PORT):
+        self.seqnum += 1
+        return mock.Mock(seqnum=self.seqnum, object_type=object_type,
+                         object_uuid=uuid, operation=operation,
+                         data=jsonutils.dumps(data),
+                         created_at=timeutils.utcnow())
+
+    def _process(self, *rows, **kwargs):
+        self.journal_db.claim_pending_rows.return_value = list(rows)
+        self.assertEqual(kwargs.get('applied', len(rows)),
+                         self.processor.process())
+
+    def test_group_rows(self):
+        rows = [self._row('port1'), self._row('port2'),
+                self._row('port1', ovn_const.OVN_JOURNAL_UPDATE),
+                self._row('port1', ovn_const.OVN_JOURNAL_UPDATE),
+                self._row('port2', ovn_const.OVN_JOURNAL_UPDATE),
+                self._row('port2', ovn_const.OVN_JOURNAL_DELETE),
+                self._row('port3', ovn_const.OVN_JOURNAL_DELETE)]
+        self.assertEqual([rows[0:2], rows[2:4], [rows[4]], [rows[5]],
+                          [rows[6]]],
+                         self.processor._group_rows(rows))
+
+    def test_process_create_ports(self):
+        rows = [self._row('port%d' % i, data={'id': 'port%d' % i})
+                for i in range(3)]
+        self.driver.get_ovn_port_options.side_effect = lambda port: port['id']
+        self._process(*rows)
+        self.driver.create_ports_in_ovn.assert_called_once_with(
+            [({'id': 'port%d' % i}, 'port%d' % i) for i in range(3)])
+        self.journal_db.delete_rows.assert_called_once_with(mock.ANY, rows)
+
+    def test_process_merged_updates(self):
+        rows = [self._row('port1', ovn_const.OVN_JOURNAL_UPDATE,
+                          {'current': {'name': 'b'},
+                           'original': {'name': 'a'}}),
+                self._row('port1', ovn_const.OVN_JOURNAL_UPDATE,
+                          {'current': {'name': 'c'},
+                           'original': {'name': 'b'}})]
+        self._process(*rows)
+        self.driver.update_port.assert_called_once_with(
+            {'name': 'c'}, {'name': 'a'})
+
+    def test_process_router(self):
+        l3_plugin = mock.Mock()
+        mock.patch.object(
+            journal.manager.NeutronManager, 'get_service_plugins',
+            return_value={journal.service_constants.L3_ROUTER_NAT: l3_plugin}
+        ).start()
+        self._process(self._row('router1', ovn_const.OVN_JOURNAL_DELETE,
+                                {'id': 'router1'},
+                                ovn_const.OVN_JOURNAL_ROUTER))
+        l3_plugin.delete_lrouter_in_ovn.assert_called_once_with('router1')
+
+    def test_process_failed_batch(self):
+        rows = [self._row('port1', data={'id': 'port1'}),
+                self._row('port2', data={'id': 'port2'}),
+                self._row('port1', ovn_const.OVN_JOURNAL_DELETE,
+                          {'id': 'port1'}),
+                self._row('port2', ovn_const.OVN_JOURNAL_DELETE,
+                          {'id': 'port2'})]
+
+        def create_ports(ports):
+            if any(port['id'] == 'port1' for port, info in ports):
+                raise RuntimeError()
+        self.driver.create_ports_in_ovn.side_effect = create_ports
+        # The retried and released rows aren't counted as applied
+        self._process(*rows, applied=2)
+
+        # port2 is created and deleted, port1 is retried in order
+        self.journal_db.retry_row.assert_called_once_with(
+            mock.ANY, rows[0], mock.ANY)
+        self.journal_db.release_row.assert_called_once_with(mock.ANY,
+                                                            rows[2])
+        self.journal_db.delete_rows.assert_has_calls(
+            [mock.call(mock.ANY, [rows[1]]), mock.call(mock.ANY, [rows[3]])])
+        self.driver.delete_port.assert_called_once_with({'id': 'port2'})
@@ -0,0 +1,117 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import signal
+
+import mock
+from oslo_config import cfg
+
+from networking_ovn.common import metrics
+from networking_ovn.tests import base
+
+
+class FakeSink(metrics.MetricsSink):
+
+    def __init__(self):
+        self.observed = []
+
+    def observe(self, name, value):
+        self.observed.append((name, value))
+
+
+class TestHistogram(base.TestCase):
+
+    def test_observe(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1, float('inf')))
+        for value in (0.05, 0.1, 0.5, 2, 3):
+            histogram.observe(value)
+        summary = histogram.summary()
+        self.assertEqual(5, summary['count'])
+        self.assertAlmostEqual(5.65, summary['sum'])
+        self.assertEqual(3, summary['max'])
+        self.assertEqual([(0.1, 2), (1, 1), (float('inf'), 2)],
+                         summary['buckets'])
+
+    def test_percentiles(self):
+        histogram = metrics.Histogram()
+        for value in range(100):
+            histogram.observe(value)
+        self.assertEqual({50: 50, 90: 90, 99: 99}, histogram.percentiles())
+
+    def test_percentiles_window(self):
+        histogram = metrics.Histogram(window=10)
+        for value in range(100):
+            histogram.observe(value)
+        self.assertEqual(100, histogram.count)
+        self.assertEqual({50: 95}, histogram.percentiles((50,)))
+
+    def test_percentiles_empty(self):
+        self.assertEqual({50: None, 90: None, 99: None},
+                         metrics.Histogram().percentiles())
+
+
+class TestRegistry(base.TestCase):
+
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.registry = metrics.Registry()
+        mock.patch.object(metrics, '_registry', self.registry).start()
+
+    def test_observe_and_dump(self):
+        metrics.observe('foo', 1)
+        metrics.observe('foo', 3)
+        metrics.observe('bar', 2)
+        dump = metrics.dump()
+        self.assertEqual(['bar', 'foo'], sorted(dump))
+        self.assertEqual(2, dump['foo']['count'])
+        self.assertEqual(3, dump['foo']['max'])
+        self.assertIn('p99', dump['foo'])
+
+    def test_observe_sink(self):
+        self.registry.sink = FakeSink()
+        metrics.observe('foo', 1)
+        self.assertEqual([('foo', 1)], self.registry.sink.observed)
+
+    def test_observe_sink_failure(self):
+        self.registry.sink = mock.Mock()
+        self.registry.sink.observe.side_effect = Exception
+        metrics.observe('foo', 1)
+        self.assertEqual(1, self.registry.get_histogram('foo').count)
+
+    def test_load_sink(self):
+        cfg.CONF.set_override(
+            'ovn_metrics_sink',
+            'networking_ovn.tests.unit.common.test_metrics.FakeSink', 'ovn')
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_metrics_sink', 'ovn')
+        metrics.load_sink()
+        self.assertIsInstance(self.registry.sink, FakeSink)
+
+    def test_load_no_sink(self):
+        metrics.load_sink()
+        self.assertIsNone(self.registry.sink)
+
+
+class TestRegisterDumpSignal(base.TestCase):
+
+    @mock.patch.object(signal, 'signal')
+    @mock.patch.object(signal, 'getsignal', return_value=signal.SIG_DFL)
+    def test_register_dump_signal(self, mock_getsignal, mock_signal):
+        self.assertTrue(metrics.register_dump_signal())
+        mock_signal.assert_called_once_with(signal.SIGUSR1,
+                                            metrics.log_dump)
+
+    @mock.patch.object(signal, 'signal')
+    @mock.patch.object(signal, 'getsignal', return_value=mock.Mock())
+    def test_register_dump_signal_handler_set(self, mock_getsignal,
+                                              mock_signal):
+        self.assertFalse(metrics.register_dump_signal())
+        mock_signal.assert_not_called()
@@ -0,0 +1,230 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+from neutron import context
+from neutron.tests.unit import testlib_api
+from oslo_utils import timeutils
+
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.db import journal as journal_db
+from networking_ovn.db import models
+
+
+class TestJournal(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.context = context.get_admin_context()
+        self.session = self.context.session
+
+    def _record(self, uuid, operation=ovn_const.OVN_JOURNAL_CREATE,
+                data=None, object_type=ovn_const.OVN_JOURNAL_PORT):
+        return journal_db.record(self.context, object_type, uuid, operation,
+                                 data)
+
+    def _get_rows(self):
+        return dict((row.seqnum, (row.state, row.retry_count))
+                    for row in self.session.query(models.OVNJournal))
+
+    def _claim(self, limit=10, retry_interval=0):
+        return [(row.object_uuid, row.operation) for row in
+                journal_db.claim_pending_rows(self.session, limit,
+                                              retry_interval)]
+
+    def test_record(self):
+        self._record('port1', data={'id': 'port1', 'fixed_ips': []})
+        rows = journal_db.claim_pending_rows(self.session, 10)
+        self.assertEqual(1, len(rows))
+        self.assertEqual(ovn_const.OVN_JOURNAL_PORT, rows[0].object_type)
+        self.assertEqual({'id': 'port1', 'fixed_ips': []},
+                         journal_db.get_row_data(rows[0]))
+        self.assertEqual({rows[0].seqnum: (ovn_const.OVN_JOURNAL_PROCESSING,
+                                           0)}, self._get_rows())
+
+    def test_claim_order_and_limit(self):
+        self._record('port1')
+        self._record('port2')
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE),
+                          ('port2', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim(2))
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_UPDATE)],
+                         self._claim())
+
+    def test_claim_busy_resource(self):
+        self._record('port1')
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self._record('port2')
+        # The creation of port1 is still being processed
+        self.assertEqual([('port2', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+
+    def test_claim_busy_resource_limit(self):
+        self._record('port1')
+        self._claim()
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self._record('port2')
+        # The rows which can't be claimed don't count in the limit
+        self.assertEqual([('port2', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim(1))
+
+    def test_claim_failed_resource(self):
+        self._record('port1')
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        self.assertFalse(journal_db.retry_row(self.session, row, 0))
+        self._record('port1', ovn_const.OVN_JOURNAL_DELETE)
+        # The deletion isn't applied on top of the failed creation
+        self.assertEqual([], self._claim())
+
+    def test_claim_port_after_network(self):
+        self._record('net1', object_type=ovn_const.OVN_JOURNAL_NETWORK)
+        self._record('port1', data={'network_id': 'net1'})
+        self._record('port2', ovn_const.OVN_JOURNAL_UPDATE,
+                     {'current': {'network_id': 'net1'}})
+        self._record('port3', data={'network_id': 'net2'})
+        self.assertEqual([('net1', ovn_const.OVN_JOURNAL_CREATE),
+                          ('port3', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+        self.assertEqual([], self._claim())
+        journal_db.delete_rows(
+            self.session, self.session.query(models.OVNJournal).filter_by(
+                object_uuid='net1').all())
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE),
+                          ('port2', ovn_const.OVN_JOURNAL_UPDATE)],
+                         self._claim())
+
+    def test_claim_router_interface_after_router(self):
+        self._record('router1', object_type=ovn_const.OVN_JOURNAL_ROUTER)
+        self._record('port1', data={'router_id': 'router1'},
+                     object_type=ovn_const.OVN_JOURNAL_ROUTER_INTERFACE)
+        self.assertEqual([('router1', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+        self._record('router1', ovn_const.OVN_JOURNAL_DELETE,
+                     object_type=ovn_const.OVN_JOURNAL_ROUTER)
+        self.assertEqual([], self._claim())
+
+    def test_claim_network_delete_after_ports(self):
+        self._record('port1', ovn_const.OVN_JOURNAL_DELETE,
+                     {'network_id': 'net1'})
+        self._record('net1', ovn_const.OVN_JOURNAL_DELETE,
+                     object_type=ovn_const.OVN_JOURNAL_NETWORK)
+        self._record('net2', ovn_const.OVN_JOURNAL_DELETE,
+                     object_type=ovn_const.OVN_JOURNAL_NETWORK)
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_DELETE),
+                          ('net2', ovn_const.OVN_JOURNAL_DELETE)],
+                         self._claim())
+        journal_db.delete_rows(
+            self.session, self.session.query(models.OVNJournal).filter_by(
+                object_uuid='port1').all())
+        self.assertEqual([('net1', ovn_const.OVN_JOURNAL_DELETE)],
+                         self._claim())
+
+    def test_claim_retry_interval(self):
+        self._record('port1')
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        self.assertTrue(journal_db.retry_row(self.session, row, 1))
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self._record('port2')
+        # port1 waits before being retried, along with its update
+        self.assertEqual([('port2', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim(retry_interval=60))
+        later = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE),
+                              ('port1', ovn_const.OVN_JOURNAL_UPDATE)],
+                             self._claim(retry_interval=60))
+
+    def test_delete_rows(self):
+        self._record('port1')
+        self._record('port2')
+        rows = journal_db.claim_pending_rows(self.session, 1)
+        journal_db.delete_rows(self.session, rows)
+        self.assertEqual([('port2', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+
+    def test_retry_row(self):
+        self._record('port1')
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        self.assertTrue(journal_db.retry_row(self.session, row, 1))
+        self.assertEqual({row.seqnum: (ovn_const.OVN_JOURNAL_PENDING, 1)},
+                         self._get_rows())
+
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        self.assertFalse(journal_db.retry_row(self.session, row, 1))
+        self.assertEqual({row.seqnum: (ovn_const.OVN_JOURNAL_FAILED, 2)},
+                         self._get_rows())
+        self.assertEqual([], self._claim())
+
+    def test_release_row(self):
+        self._record('port1')
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        journal_db.release_row(self.session, row)
+        self.assertEqual({row.seqnum: (ovn_const.OVN_JOURNAL_PENDING, 0)},
+                         self._get_rows())
+
+    def test_reset_stale_rows(self):
+        self._record('port1')
+        self._claim()
+        self.assertEqual(0, journal_db.reset_stale_rows(self.session, 60))
+        later = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            self.assertEqual(1, journal_db.reset_stale_rows(self.session,
+                                                            60))
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE)],
+                         self._claim())
+
+    def _fail(self, uuid):
+        self._record(uuid)
+        row = journal_db.claim_pending_rows(self.session, 1)[0]
+        self.assertFalse(journal_db.retry_row(self.session, row, 0))
+        return row
+
+    def test_get_failed_rows(self):
+        row1 = self._fail('port1')
+        row2 = self._fail('port2')
+        self._record('port3')
+        self.assertEqual([row1.seqnum, row2.seqnum],
+                         [row.seqnum for row in
+                          journal_db.get_failed_rows(self.session)])
+        self.assertEqual([row2.seqnum],
+                         [row.seqnum for row in journal_db.get_failed_rows(
+                             self.session, ['port2'])])
+
+    def test_retry_failed_rows(self):
+        row1 = self._fail('port1')
+        row2 = self._fail('port2')
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self.assertEqual(1, journal_db.retry_failed_rows(self.session,
+                                                         ['port1']))
+        rows = self._get_rows()
+        self.assertEqual((ovn_const.OVN_JOURNAL_PENDING, 0),
+                         rows[row1.seqnum])
+        self.assertEqual((ovn_const.OVN_JOURNAL_FAILED, 1),
+                         rows[row2.seqnum])
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_CREATE),
+                          ('port1', ovn_const.OVN_JOURNAL_UPDATE)],
+                         self._claim())
+
+    def test_delete_failed_rows(self):
+        self._fail('port1')
+        self._fail('port2')
+        self._record('port1', ovn_const.OVN_JOURNAL_UPDATE)
+        self.assertEqual(2, journal_db.delete_failed_rows(self.session))
+        self.assertEqual([], journal_db.get_failed_rows(self.session))
+        self.assertEqual([('port1', ovn_const.OVN_JOURNAL_UPDATE)],
+                         self._claim())
@@ -48,6 +48,8 @@ class FakeOvsdbNbOvnIdl(object):
         self.delete_lswitch = mock.Mock()
         self.create_lswitch_port = mock.Mock()
         self.set_lswitch_port = mock.Mock()
+        self.set_lswitch_ports_qos_options = mock.Mock()
+        self.set_lswitch_ports_parent = mock.Mock()
         self.delete_lswitch_port = mock.Mock()
         self.get_all_logical_switches_ids = mock.Mock()
         self.get_logical_switch_ids = mock.Mock()
@@ -56,6 +58,7 @@ class FakeOvsdbNbOvnIdl(object):
         self.create_lrouter = mock.Mock()
         self.update_lrouter = mock.Mock()
         self.delete_lrouter = mock.Mock()
+        self.move_lrouter_gateway = mock.Mock()
         self.add_lrouter_port = mock.Mock()
         self.update_lrouter_port = mock.Mock()
         self.delete_lrouter_port = mock.Mock()
@@ -66,6 +69,7 @@ class FakeOvsdbNbOvnIdl(object):
         self.idl = mock.Mock()
         self.add_static_route = mock.Mock()
         self.delete_static_route = mock.Mock()
+        self.update_static_routes = mock.Mock()
         self.create_address_set = mock.Mock()
         self.update_address_set_ext_ids = mock.Mock()
         self.delete_address_set = mock.Mock()
@@ -88,7 +92,11 @@ class FakeOvsdbSbOvnIdl(object):
     def __init__(self, **kwargs):
         self.get_chassis_hostname_and_physnets = mock.Mock()
         self.get_chassis_hostname_and_physnets.return_value = {}
+        self.get_chassis_hosts_with_physnet = mock.Mock()
+        self.get_chassis_hosts_with_physnet.return_value = set()
         self.get_all_chassis = mock.Mock()
+        self.get_chassis_gateway_weights = mock.Mock()
+        self.get_chassis_gateway_weights.return_value = {}
         self.get_chassis_datapath_and_iface_types = mock.Mock()
         self.get_chassis_datapath_and_iface_types.return_value = ('fake', '')
 
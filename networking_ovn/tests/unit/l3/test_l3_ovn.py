@@ -17,11 +17,16 @@ import mock
 from neutron_lib import exceptions as n_exc
 from oslo_config import cfg
 
+from neutron.callbacks import events
+from neutron.callbacks import resources
 from neutron import manager
 from neutron.plugins.common import constants as service_constants
 from neutron.tests.unit.extensions import test_extraroute
 from neutron.tests.unit.extensions import test_l3
 
+from networking_ovn.common import constants as ovn_const
+from networking_ovn.db import journal as journal_db
+from networking_ovn.l3 import l3_ovn
 from networking_ovn.tests.unit import fakes
 from networking_ovn.tests.unit.ml2 import test_mech_driver
 
@@ -65,6 +70,12 @@ class OVNL3RouterPlugin(test_mech_driver.OVNMechanismDriverTestCase):
             'neutron.db.db_base_plugin_v2.NeutronDbPluginV2.get_subnet',
             return_value=self.fake_subnet
         ).start()
+        self.get_subnets = mock.patch(
+            'neutron.db.db_base_plugin_v2.NeutronDbPluginV2.get_subnets',
+            side_effect=lambda context, filters=None, fields=None: [
+                dict(self.fake_subnet, id=subnet_id)
+                for subnet_id in filters['id']]
+        ).start()
         mock.patch(
             'neutron.db.l3_db.L3_NAT_dbonly_mixin.get_router',
             return_value=self.fake_router
@@ -183,8 +194,7 @@ class OVNL3RouterPlugin(test_mech_driver.OVNMechanismDriverTestCase):
         update_data = {'router': {'routes': [{'destination': '1.1.1.0/24',
                                               'nexthop': '2.2.2.3'}]}}
         self.l3_plugin.update_router(self.context, router_id, update_data)
-        self.assertFalse(self.l3_plugin._ovn.add_static_route.called)
-        self.assertFalse(self.l3_plugin._ovn.delete_static_route.called)
+        self.assertFalse(self.l3_plugin._ovn.update_static_routes.called)
 
     @mock.patch('neutron.db.l3_db.L3_NAT_dbonly_mixin.update_router')
     def test_update_router_static_route_change(self, func):
@@ -192,12 +202,186 @@ class OVNL3RouterPlugin(test_mech_driver.OVNMechanismDriverTestCase):
         update_data = {'router': {'routes': [{'destination': '2.2.2.0/24',
                                               'nexthop': '3.3.3.3'}]}}
         self.l3_plugin.update_router(self.context, router_id, update_data)
-        self.l3_plugin._ovn.add_static_route.assert_called_once_with(
-            'neutron-router-id',
-            ip_prefix='2.2.2.0/24', nexthop='3.3.3.3')
-        self.l3_plugin._ovn.delete_static_route.assert_called_once_with(
+        self.l3_plugin._ovn.update_static_routes.assert_called_once_with(
             'neutron-router-id',
-            ip_prefix='1.1.1.0/24', nexthop='2.2.2.3')
+            add_routes=[('2.2.2.0/24', '3.3.3.3')],
+            del_routes=[('1.1.1.0/24', '2.2.2.3')])
+
+    def _set_journal(self):
+        cfg.CONF.set_override('ovn_journal', True, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_journal', 'ovn')
+        return mock.patch.object(journal_db, 'record').start()
+
+    def test_subscribe_journal(self):
+        with mock.patch.object(l3_ovn.registry, 'subscribe') as subscribe:
+            self.l3_plugin._subscribe_journal()
+        subscribe.assert_has_calls([
+            mock.call(self.l3_plugin._record_router_create,
+                      resources.ROUTER, events.PRECOMMIT_CREATE),
+            mock.call(self.l3_plugin._record_router_update,
+                      resources.ROUTER, events.PRECOMMIT_UPDATE),
+            mock.call(self.l3_plugin._record_router_delete,
+                      resources.ROUTER, events.PRECOMMIT_DELETE)])
+
+    def test_record_router_create(self):
+        record = self._set_journal()
+        self.l3_plugin._record_router_create(
+            resources.ROUTER, events.PRECOMMIT_CREATE, self.l3_plugin,
+            context=self.context, router_id='router-id',
+            router={'id': 'router-id', 'name': 'router',
+                    'admin_state_up': True, 'tenant_id': 'tenant-id'})
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER, 'router-id',
+            ovn_const.OVN_JOURNAL_CREATE,
+            {'id': 'router-id', 'name': 'router', 'admin_state_up': True})
+
+    def test_record_router_update(self):
+        record = self._set_journal()
+        # The static routes are recorded by _update_extra_routes()
+        self.l3_plugin._record_router_update(
+            resources.ROUTER, events.PRECOMMIT_UPDATE, self.l3_plugin,
+            context=self.context, router_id='router-id',
+            router={'admin_state_up': True, 'routes': []},
+            old_router=self.fake_router)
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER, 'router-id',
+            ovn_const.OVN_JOURNAL_UPDATE,
+            {'router_id': 'router-id', 'update': {'enabled': True},
+             'added': [], 'removed': []})
+
+    def test_record_router_update_no_change(self):
+        record = self._set_journal()
+        self.l3_plugin._record_router_update(
+            resources.ROUTER, events.PRECOMMIT_UPDATE, self.l3_plugin,
+            context=self.context, router_id='router-id',
+            router={'name': 'router'}, old_router=self.fake_router)
+        self.assertFalse(record.called)
+
+    def test_record_router_delete(self):
+        record = self._set_journal()
+        self.l3_plugin._record_router_delete(
+            resources.ROUTER, events.PRECOMMIT_DELETE, self.l3_plugin,
+            context=self.context, router_id='router-id')
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER, 'router-id',
+            ovn_const.OVN_JOURNAL_DELETE, {'id': 'router-id'})
+
+    @mock.patch('neutron.db.extraroute_db.ExtraRoute_dbonly_mixin.'
+                '_update_extra_routes')
+    @mock.patch('neutron.db.extraroute_db.ExtraRoute_dbonly_mixin.'
+                '_get_extra_routes_by_router_id')
+    def test_update_extra_routes_journal(self, get_routes, update_routes):
+        record = self._set_journal()
+        get_routes.return_value = self.fake_router['routes']
+        routes = [{'destination': '2.2.2.0/24', 'nexthop': '3.3.3.3'}]
+        router_db = {'id': 'router-id'}
+        self.l3_plugin._update_extra_routes(self.context, router_db, routes)
+        update_routes.assert_called_once_with(self.context, router_db,
+                                              routes)
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER, 'router-id',
+            ovn_const.OVN_JOURNAL_UPDATE,
+            {'router_id': 'router-id', 'update': {},
+             'added': routes, 'removed': self.fake_router['routes']})
+
+    @mock.patch('neutron.db.l3_db.L3_NAT_dbonly_mixin.update_router')
+    def test_update_router_journal(self, func):
+        record = self._set_journal()
+        update_data = {'router': {'admin_state_up': True}}
+        self.l3_plugin.update_router(self.context, 'router-id', update_data)
+        func.assert_called_once_with(self.context, 'router-id', update_data)
+        # The row is recorded by the precommit callback of the L3 DB
+        self.assertFalse(record.called)
+        self.assertFalse(self.l3_plugin._ovn.update_lrouter.called)
+
+    @mock.patch('neutron.db.l3_db.L3_NAT_dbonly_mixin.add_router_interface')
+    def test_add_router_interface_journal(self, func):
+        record = self._set_journal()
+        func.return_value = {'port_id': 'router-port-id',
+                             'subnet_ids': ['subnet-id']}
+        self.l3_plugin.add_router_interface(
+            self.context, 'router-id', {'port_id': 'router-port-id'})
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+            'router-port-id', ovn_const.OVN_JOURNAL_CREATE,
+            {'router_id': 'router-id', 'port': self.fake_router_port})
+        self.assertFalse(self.l3_plugin._ovn.add_lrouter_port.called)
+
+    @mock.patch('neutron.db.db_base_plugin_v2.NeutronDbPluginV2.get_port')
+    def test_remove_router_interface_journal(self, getp):
+        record = self._set_journal()
+        getp.side_effect = n_exc.PortNotFound(port_id='router-port-id')
+        interface_info = {'port_id': 'router-port-id'}
+        with mock.patch('neutron.db.l3_db.L3_NAT_dbonly_mixin.'
+                        'remove_router_interface',
+                        return_value=interface_info):
+            self.l3_plugin.remove_router_interface(
+                self.context, 'router-id', interface_info)
+        record.assert_called_once_with(
+            self.context, ovn_const.OVN_JOURNAL_ROUTER_INTERFACE,
+            'router-port-id', ovn_const.OVN_JOURNAL_DELETE,
+            {'router_id': 'router-id', 'port_id': 'router-port-id'})
+        self.assertFalse(self.l3_plugin._ovn.delete_lrouter_port.called)
+
+    @mock.patch('neutron.db.db_base_plugin_v2.NeutronDbPluginV2.get_subnet')
+    def test_get_networks_for_lrouter_port_cached(self, get_subnet):
+        get_subnet.return_value = self.fake_subnet
+        fixed_ips = self.fake_router_port['fixed_ips']
+        for i in range(2):
+            self.assertEqual(['10.0.0.100/24'],
+                             self.l3_plugin.get_networks_for_lrouter_port(
+                                 self.context, fixed_ips))
+        get_subnet.assert_called_once_with(self.context, 'subnet-id')
+        self.get_subnets.assert_not_called()
+
+    def test_get_networks_for_lrouter_ports(self):
+        ports = [{'id': 'port1',
+                  'fixed_ips': [{'ip_address': '10.0.0.1',
+                                 'subnet_id': 'subnet1'},
+                                {'ip_address': '10.0.1.1',
+                                 'subnet_id': 'subnet2'}]},
+                 {'id': 'port2',
+                  'fixed_ips': [{'ip_address': '10.0.0.2',
+                                 'subnet_id': 'subnet1'}]}]
+        networks = self.l3_plugin.get_networks_for_lrouter_ports(
+            self.context, ports)
+        self.assertEqual({'port1': ['10.0.0.1/24', '10.0.1.1/24'],
+                          'port2': ['10.0.0.2/24']},
+                         dict((port_id, sorted(port_networks))
+                              for port_id, port_networks in networks.items()))
+        # The subnets are fetched with a single query
+        self.assertEqual(1, self.get_subnets.call_count)
+        self.assertEqual(['subnet1', 'subnet2'], sorted(
+            self.get_subnets.call_args[1]['filters']['id']))
+        self.l3_plugin.get_networks_for_lrouter_ports(self.context, ports)
+        self.assertEqual(1, self.get_subnets.call_count)
+
+    def test_get_networks_for_lrouter_ports_subnet_not_found(self):
+        self.get_subnets.side_effect = None
+        self.get_subnets.return_value = [{'id': 'subnet1',
+                                          'cidr': '10.0.0.0/24'}]
+        ports = [{'id': 'port1',
+                  'fixed_ips': [{'ip_address': '10.0.0.1',
+                                 'subnet_id': 'subnet1'},
+                                {'ip_address': '10.0.1.1',
+                                 'subnet_id': 'subnet2'}]}]
+        self.assertRaises(n_exc.SubnetNotFound,
+                          self.l3_plugin.get_networks_for_lrouter_ports,
+                          self.context, ports)
+
+    def test_schedule_unhosted_routers_failure(self):
+        self.l3_plugin._sb_ovn.get_all_chassis.return_value = ['hv1']
+        self.l3_plugin._ovn.get_unhosted_routers.return_value = {
+            'neutron-router-id': {}}
+        self.l3_plugin._ovn.update_lrouter.side_effect = RuntimeError
+        with mock.patch.object(self.l3_plugin.scheduler, 'select',
+                               return_value='hv1'), \
+                mock.patch.object(self.l3_plugin.scheduler,
+                                  'reset') as reset:
+            self.assertRaises(RuntimeError,
+                              self.l3_plugin.schedule_unhosted_routers)
+        reset.assert_called_once_with(self.l3_plugin._ovn,
+                                      ['neutron-router-id'])
 
 
 class OVNL3ExtrarouteTests(test_l3.L3NatDBIntTestCase,
@@ -12,11 +12,14 @@
 #    under the License.
 #
 
+import collections
 import mock
 import random
 import six
 
 from neutron.tests import base
+from oslo_config import cfg
+from ovs.db import idl
 
 from networking_ovn.common import constants as ovn_const
 from networking_ovn.l3 import l3_ovn_scheduler
@@ -34,6 +37,8 @@ class FakeOVNGatewaySchedulerSbOvnIdl(object):
     def __init__(self, chassis_router_mapping):
         self.get_all_chassis = mock.Mock(
             return_value=chassis_router_mapping['Chassis'])
+        self.get_chassis_gateway_weights = mock.Mock(
+            return_value=chassis_router_mapping.get('Weights', {}))
 
 
 class TestOVNGatewayScheduler(base.BaseTestCase):
@@ -150,3 +155,282 @@ class OVNGatewayLeastLoadedScheduler(TestOVNGatewayScheduler):
         router_name = random.choice(list(mapping['Routers'].keys()))
         chassis = self.select(mapping, router_name)
         self.assertEqual(mapping['Routers'][router_name], chassis)
+
+
+class OVNGatewayWeightedScheduler(OVNGatewayLeastLoadedScheduler):
+
+    def setUp(self):
+        super(OVNGatewayWeightedScheduler, self).setUp()
+        self.l3_scheduler = l3_ovn_scheduler.OVNGatewayWeightedScheduler()
+
+    def test_weighted_chassis_available_for_new_router(self):
+        mapping = dict(self.fake_chassis_router_mappings['Multiple1'],
+                       Weights={'hv1': 3.0, 'hv2': 1.0})
+        chassis = self.select(mapping, self.new_router_name)
+        self.assertEqual('hv1', chassis)
+
+    def test_zero_weight_chassis_not_selected(self):
+        mapping = dict(self.fake_chassis_router_mappings['Multiple3'],
+                       Weights={'hv1': 0.0})
+        chassis = self.select(mapping, self.new_router_name)
+        self.assertEqual('hv3', chassis)
+
+    def test_zero_weight_chassis_only_candidate(self):
+        mapping = dict(self.fake_chassis_router_mappings['Multiple1'],
+                       Weights={'hv1': 0.0, 'hv2': 0.0})
+        chassis = self.select(mapping, self.new_router_name)
+        self.assertIn(chassis, mapping.get('Chassis'))
+
+    def test_existing_chassis_kept_when_weights_change(self):
+        mapping = dict(self.fake_chassis_router_mappings['Multiple2'],
+                       Weights={'hv1': 0.0})
+        chassis = self.select(mapping, 'r1')
+        self.assertEqual('hv1', chassis)
+
+
+def _fake_lrouter(name, chassis):
+    lrouter = mock.Mock(
+        external_ids={ovn_const.OVN_ROUTER_NAME_EXT_ID_KEY: name},
+        options={'chassis': chassis})
+    lrouter.name = name
+    return lrouter
+
+
+def _fake_idl(routers):
+    rows = dict((name, _fake_lrouter(name, chassis))
+                for name, chassis in routers.items())
+    return mock.Mock(tables={'Logical_Router': mock.Mock(rows=rows)})
+
+
+class OVNGatewayLeastLoadedSchedulerChassisLoad(
+        OVNGatewayLeastLoadedScheduler):
+
+    def select(self, chassis_router_mapping, router_name):
+        chassis_load = l3_ovn_scheduler.ChassisLoad(
+            _fake_idl(chassis_router_mapping['Routers']))
+        with mock.patch.object(l3_ovn_scheduler, 'get_chassis_load',
+                               return_value=chassis_load):
+            chassis = super(OVNGatewayLeastLoadedSchedulerChassisLoad,
+                            self).select(chassis_router_mapping, router_name)
+        # The router is accounted to its chassis right away
+        if chassis == ovn_const.OVN_GATEWAY_INVALID_CHASSIS:
+            self.assertIsNone(chassis_load.get_router_chassis(router_name))
+        else:
+            self.assertEqual(chassis,
+                             chassis_load.get_router_chassis(router_name))
+        return chassis
+
+
+class OVNGatewayWeightedSchedulerChassisLoad(OVNGatewayWeightedScheduler):
+
+    def select(self, chassis_router_mapping, router_name):
+        chassis_load = l3_ovn_scheduler.ChassisLoad(
+            _fake_idl(chassis_router_mapping['Routers']))
+        with mock.patch.object(l3_ovn_scheduler, 'get_chassis_load',
+                               return_value=chassis_load):
+            return super(OVNGatewayWeightedSchedulerChassisLoad,
+                         self).select(chassis_router_mapping, router_name)
+
+
+class TestChassisLoad(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestChassisLoad, self).setUp()
+        self.idl = _fake_idl({'r1': 'hv1', 'r2': 'hv1', 'r3': 'hv2',
+                              'r4': ovn_const.OVN_GATEWAY_INVALID_CHASSIS})
+        self.idl.tables['Logical_Router'].rows['not-neutron'] = mock.Mock(
+            external_ids={}, options={'chassis': 'hv2'})
+        self.chassis_load = l3_ovn_scheduler.ChassisLoad(self.idl)
+        self.listener = self.idl.add_table_listener.call_args[0][1]
+
+    def test_initial_load(self):
+        self.idl.add_table_listener.assert_called_once_with(
+            'Logical_Router', mock.ANY)
+        self.assertEqual(2, self.chassis_load.get_load('hv1'))
+        self.assertEqual(1, self.chassis_load.get_load('hv2'))
+        self.assertEqual(0, self.chassis_load.get_load('hv3'))
+        self.assertIsNone(self.chassis_load.get_router_chassis('r4'))
+
+    def test_get_least_loaded(self):
+        self.assertEqual('hv2', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2']))
+        self.assertEqual('hv3', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2', 'hv3']))
+        self.assertEqual('hv1', self.chassis_load.get_least_loaded(['hv1']))
+        self.assertIsNone(self.chassis_load.get_least_loaded([]))
+
+    def test_scheduling_pass(self):
+        # The routers scheduled in the same pass are spread
+        candidates = ['hv2', 'hv3']
+        for router in ('r5', 'r6', 'r7', 'r8'):
+            chassis = self.chassis_load.get_least_loaded(candidates)
+            self.chassis_load.set_router_chassis(router, chassis)
+        self.assertEqual(3, self.chassis_load.get_load('hv2'))
+        self.assertEqual(2, self.chassis_load.get_load('hv3'))
+
+    def test_router_changes(self):
+        self.listener(idl.ROW_UPDATE, _fake_lrouter('r1', 'hv2'))
+        self.listener(idl.ROW_CREATE, _fake_lrouter('r5', 'hv3'))
+        self.listener(idl.ROW_DELETE, _fake_lrouter('r3', 'hv2'))
+        self.assertEqual(1, self.chassis_load.get_load('hv1'))
+        self.assertEqual(1, self.chassis_load.get_load('hv2'))
+        self.assertEqual(1, self.chassis_load.get_load('hv3'))
+        self.assertEqual('hv2', self.chassis_load.get_router_chassis('r1'))
+
+    def test_committed_assignment_counted_once(self):
+        self.chassis_load.set_router_chassis('r4', 'hv2')
+        self.listener(idl.ROW_UPDATE, _fake_lrouter('r4', 'hv2'))
+        self.assertEqual(2, self.chassis_load.get_load('hv2'))
+
+    def test_reset_routers(self):
+        self.chassis_load.set_router_chassis('r1', 'hv2')
+        self.chassis_load.set_router_chassis('r4', 'hv2')
+        self.chassis_load.set_router_chassis('r5', 'hv2')
+        self.chassis_load.reset_routers(['r1', 'r4', 'r5'])
+        self.assertEqual('hv1', self.chassis_load.get_router_chassis('r1'))
+        self.assertIsNone(self.chassis_load.get_router_chassis('r4'))
+        self.assertIsNone(self.chassis_load.get_router_chassis('r5'))
+        self.assertEqual(2, self.chassis_load.get_load('hv1'))
+        self.assertEqual(1, self.chassis_load.get_load('hv2'))
+
+    def test_heap_compaction(self):
+        for i in range(100):
+            self.chassis_load.set_router_chassis('r1', 'hv%d' % (i % 3))
+        self.assertLessEqual(len(self.chassis_load._heap), 2 * 3 + 16)
+        self.assertEqual('hv0', self.chassis_load.get_router_chassis('r1'))
+        self.assertEqual(1, self.chassis_load.get_load('hv1'))
+        self.assertEqual('hv1', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2']))
+
+    def test_weights(self):
+        self.chassis_load.set_weights({'hv1': 4.0, 'hv2': 1.0})
+        # hv1 hosts 2 routers for a weight of 4, hv2 1 for a weight of 1
+        self.assertEqual('hv1', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2']))
+        candidates = ['hv1', 'hv2']
+        for i in range(7):
+            chassis = self.chassis_load.get_least_loaded(candidates)
+            self.chassis_load.set_router_chassis('r%d' % (i + 5), chassis)
+        self.assertEqual(8, self.chassis_load.get_load('hv1'))
+        self.assertEqual(2, self.chassis_load.get_load('hv2'))
+
+    def test_weights_changed(self):
+        self.chassis_load.set_weights({'hv1': 4.0})
+        self.assertEqual('hv1', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2']))
+        self.chassis_load.set_weights({'hv1': 1.0})
+        self.assertEqual('hv2', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2']))
+        # The routers aren't moved
+        self.assertEqual(2, self.chassis_load.get_load('hv1'))
+
+    def test_zero_weight(self):
+        self.chassis_load.set_weights({'hv3': 0.0})
+        self.assertEqual('hv2', self.chassis_load.get_least_loaded(
+            ['hv1', 'hv2', 'hv3']))
+        self.assertEqual('hv3', self.chassis_load.get_least_loaded(['hv3']))
+
+
+class TestGetRebalanceMoves(base.BaseTestCase):
+
+    def _get_loads(self, chassis_bindings, moves):
+        loads = dict((chassis, len(routers))
+                     for chassis, routers in chassis_bindings.items())
+        for router, from_chassis, to_chassis in moves:
+            self.assertIn(router, chassis_bindings[from_chassis])
+            loads[from_chassis] -= 1
+            loads[to_chassis] += 1
+        return loads
+
+    def test_new_chassis(self):
+        bindings = {'hv1': ['r1', 'r2', 'r3', 'r4'],
+                    'hv2': ['r5', 'r6', 'r7'],
+                    'hv3': []}
+        moves = l3_ovn_scheduler.get_rebalance_moves(bindings)
+        self.assertEqual(2, len(moves))
+        self.assertEqual({'hv1': 3, 'hv2': 2, 'hv3': 2},
+                         self._get_loads(bindings, moves))
+
+    def test_balanced(self):
+        bindings = {'hv1': ['r1', 'r2'], 'hv2': ['r3'], 'hv3': ['r4']}
+        self.assertEqual([], l3_ovn_scheduler.get_rebalance_moves(bindings))
+        self.assertEqual([], l3_ovn_scheduler.get_rebalance_moves({}))
+
+    def test_max_moves(self):
+        bindings = {'hv1': ['r%d' % i for i in range(10)], 'hv2': []}
+        moves = l3_ovn_scheduler.get_rebalance_moves(bindings, max_moves=3)
+        self.assertEqual({'hv1': 7, 'hv2': 3},
+                         self._get_loads(bindings, moves))
+        moves = l3_ovn_scheduler.get_rebalance_moves(bindings)
+        self.assertEqual({'hv1': 5, 'hv2': 5},
+                         self._get_loads(bindings, moves))
+
+    def test_weights(self):
+        bindings = {'hv1': ['r%d' % i for i in range(10)], 'hv2': []}
+        moves = l3_ovn_scheduler.get_rebalance_moves(
+            bindings, weights={'hv1': 1.0, 'hv2': 4.0})
+        self.assertEqual({'hv1': 2, 'hv2': 8},
+                         self._get_loads(bindings, moves))
+
+    def test_zero_weight(self):
+        bindings = {'hv1': ['r1', 'r2'], 'hv2': ['r3'], 'hv3': []}
+        moves = l3_ovn_scheduler.get_rebalance_moves(
+            bindings, weights={'hv1': 0.0, 'hv3': 0.0})
+        self.assertEqual({'hv1': 0, 'hv2': 3, 'hv3': 0},
+                         self._get_loads(bindings, moves))
+
+
+class TestRebalance(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRebalance, self).setUp()
+        self.nb_idl = mock.Mock()
+        self.nb_idl.get_all_chassis_router_bindings.return_value = {
+            'hv1': ['r%d' % i for i in range(6)], 'hv2': [], 'hv3': []}
+        self.sb_idl = mock.Mock()
+        self.sb_idl.get_all_chassis.return_value = ['hv1', 'hv2', 'hv3']
+        self.sb_idl.get_chassis_gateway_weights.return_value = {'hv2': 2.0}
+        self.scheduler = l3_ovn_scheduler.OVNGatewayLeastLoadedScheduler()
+        self.sleep = mock.patch.object(l3_ovn_scheduler.greenthread,
+                                       'sleep').start()
+        cfg.CONF.set_override('ovn_l3_rebalance_batch_size', 2, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ovn_l3_rebalance_batch_size', 'ovn')
+
+    def test_rebalance(self):
+        moves = self.scheduler.rebalance(self.nb_idl, self.sb_idl)
+        self.assertEqual(4, len(moves))
+        self.nb_idl.get_all_chassis_router_bindings.assert_called_once_with(
+            ['hv1', 'hv2', 'hv3'])
+        # The moves are committed in batches of 2
+        self.assertEqual(2, self.nb_idl.transaction.call_count)
+        self.assertEqual(1, self.sleep.call_count)
+        self.nb_idl.move_lrouter_gateway.assert_has_calls(
+            [mock.call(*move) for move in moves])
+
+    def test_rebalance_max_moves(self):
+        moves = self.scheduler.rebalance(self.nb_idl, self.sb_idl,
+                                         max_moves=1)
+        self.assertEqual(1, len(moves))
+        self.assertEqual(1, self.nb_idl.transaction.call_count)
+        self.sleep.assert_not_called()
+
+    def test_rebalance_dry_run(self):
+        moves = self.scheduler.rebalance(self.nb_idl, self.sb_idl,
+                                         dry_run=True)
+        self.assertEqual(4, len(moves))
+        self.nb_idl.transaction.assert_not_called()
+        self.nb_idl.move_lrouter_gateway.assert_not_called()
+
+    def test_rebalance_single_chassis(self):
+        self.sb_idl.get_all_chassis.return_value = ['hv1']
+        self.assertEqual([], self.scheduler.rebalance(self.nb_idl,
+                                                      self.sb_idl))
+        self.nb_idl.get_all_chassis_router_bindings.assert_not_called()
+
+    def test_rebalance_weighted(self):
+        scheduler = l3_ovn_scheduler.OVNGatewayWeightedScheduler()
+        moves = scheduler.rebalance(self.nb_idl, self.sb_idl, dry_run=True)
+        loads = collections.Counter(to_chassis for _r, _f, to_chassis
+                                    in moves)
+        self.assertEqual({'hv2': 3, 'hv3': 1}, dict(loads))
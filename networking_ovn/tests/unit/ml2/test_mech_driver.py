@@ -22,6 +22,7 @@ from neutron.callbacks import events
 from neutron.callbacks import registry
 from neutron.callbacks import resources
 from neutron.common import utils as n_utils
+from neutron import context as n_context
 from neutron.db import provisioning_blocks
 from neutron.extensions import portbindings
 from neutron import manager
@@ -34,6 +35,10 @@ from neutron.tests.unit.plugins.ml2 import test_plugin
 from networking_ovn.common import acl as ovn_acl
 from networking_ovn.common import constants as ovn_const
 from networking_ovn.common import utils as ovn_utils
+from networking_ovn.db import models
+from networking_ovn.db import segments as segments_db
+from networking_ovn.ml2 import mech_driver
+from networking_ovn.ovsdb import commands as ovn_commands
 from networking_ovn.tests.unit import fakes
 
 
@@ -457,6 +462,88 @@ class TestOVNMechanismDriver(test_plugin.Ml2PluginV2TestCase):
                                      group='ovn')
         self._test_create_port_with_security_groups_helper(8)
 
+    def test_create_port_bulk(self):
+        self.nb_ovn.transaction = mock.MagicMock()
+        with self.network() as net1:
+            with self.subnet(network=net1):
+                self.nb_ovn.transaction.reset_mock()
+                res = self._create_port_bulk(self.fmt, 3,
+                                             net1['network']['id'],
+                                             'test', True)
+                self.assertEqual(201, res.status_int)
+                self.assertEqual(
+                    3, self.nb_ovn.create_lswitch_port.call_count)
+                # The addresses of all the ports are added to the address
+                # set of the default security group at once
+                self.assertEqual(
+                    1, self.nb_ovn.update_address_set.call_count)
+                self.assertEqual(
+                    3, len(self.nb_ovn.update_address_set.call_args[1][
+                        'addrs_add']))
+                self.assertEqual(1, self.nb_ovn.transaction.call_count)
+
+    def test_create_port_postcommit_bulk(self):
+        plugin_context = mock.Mock(spec=['session'])
+        port_contexts = []
+        for port_id in ('port1', 'port2', 'port3'):
+            port_contexts.append(mock.Mock(
+                current={'id': port_id}, _plugin_context=plugin_context))
+        with mock.patch.object(self.mech_driver, '_is_bulk_request',
+                               return_value=True), \
+                mock.patch.object(self.mech_driver,
+                                  '_insert_port_provisioning_block'):
+            for port_context in port_contexts:
+                self.mech_driver.create_port_precommit(port_context)
+        with mock.patch.object(self.mech_driver, 'create_ports_in_ovn') as \
+                mock_create, \
+                mock.patch.object(self.mech_driver, 'get_ovn_port_options',
+                                  return_value=mock.sentinel.info), \
+                mock.patch.object(self.mech_driver._plugin, 'get_ports',
+                                  return_value=[{'id': 'port2'}]):
+            self.mech_driver.create_port_postcommit(port_contexts[0])
+            # port3 wasn't committed to the DB
+            mock_create.assert_called_once_with(
+                [({'id': 'port1'}, mock.sentinel.info),
+                 ({'id': 'port2'}, mock.sentinel.info)])
+            mock_create.reset_mock()
+            self.mech_driver.create_port_postcommit(port_contexts[1])
+            mock_create.assert_not_called()
+            self.assertEqual({}, getattr(plugin_context,
+                                         mech_driver.BULK_PORTS_ATTR))
+
+    def test_create_port_postcommit_single(self):
+        plugin_context = mock.Mock(spec=['session'])
+        port_context = mock.Mock(current={'id': 'port1'},
+                                 _plugin_context=plugin_context)
+        with mock.patch.object(self.mech_driver, '_is_bulk_request',
+                               return_value=False), \
+                mock.patch.object(self.mech_driver,
+                                  '_insert_port_provisioning_block'):
+            self.mech_driver.create_port_precommit(port_context)
+        self.assertFalse(hasattr(plugin_context,
+                                 mech_driver.BULK_PORTS_ATTR))
+        with mock.patch.object(self.mech_driver, 'create_port_in_ovn') as \
+                mock_create, \
+                mock.patch.object(self.mech_driver, 'get_ovn_port_options',
+                                  return_value=mock.sentinel.info), \
+                mock.patch.object(self.mech_driver._plugin,
+                                  'get_ports') as get_ports:
+            self.mech_driver.create_port_postcommit(port_context)
+            mock_create.assert_called_once_with({'id': 'port1'},
+                                                mock.sentinel.info)
+            get_ports.assert_not_called()
+
+    def test_create_ports_in_ovn_chunks(self):
+        self.nb_ovn.transaction = mock.MagicMock()
+        port_info = mock.Mock(addresses=['fake'])
+        ports = [({'id': 'port%d' % i, 'name': '', 'network_id': 'net1'},
+                  port_info) for i in range(5)]
+        with mock.patch.object(ovn_const, 'OVN_BULK_PORTS_PER_TXN', 2), \
+                mock.patch.object(ovn_acl, 'add_acls', return_value=[]):
+            self.mech_driver.create_ports_in_ovn(ports)
+        self.assertEqual(3, self.nb_ovn.transaction.call_count)
+        self.assertEqual(5, self.nb_ovn.create_lswitch_port.call_count)
+
     def test_update_port_changed_security_groups(self):
         with self.network(set_context=True, tenant_id='test') as net1:
             with self.subnet(network=net1) as subnet1:
@@ -519,6 +606,110 @@ class TestOVNMechanismDriver(test_plugin.Ml2PluginV2TestCase):
                     self.assertEqual(
                         1, self.nb_ovn.update_address_set.call_count)
 
+    def _test_create_port_created_at(self, tracked):
+        with self.network(set_context=True, tenant_id='test') as net1:
+            with self.subnet(network=net1) as subnet1:
+                with self.port(subnet=subnet1,
+                               set_context=True, tenant_id='test'):
+                    external_ids = self.nb_ovn.create_lswitch_port.call_args[
+                        1]['external_ids']
+                    if tracked:
+                        self.assertGreater(float(external_ids[
+                            ovn_const.OVN_PORT_CREATED_AT_EXT_ID_KEY]), 0)
+                    else:
+                        self.assertNotIn(
+                            ovn_const.OVN_PORT_CREATED_AT_EXT_ID_KEY,
+                            external_ids)
+
+    def test_create_port_created_at(self):
+        self._test_create_port_created_at(True)
+
+    def test_create_port_created_at_not_tracked(self):
+        config.cfg.CONF.set_override('ovn_port_activation_tracker_size', 0,
+                                     'ovn')
+        self.addCleanup(config.cfg.CONF.clear_override,
+                        'ovn_port_activation_tracker_size', 'ovn')
+        self._test_create_port_created_at(False)
+
+    def test_update_port_changed_columns_only(self):
+        with self.network(set_context=True, tenant_id='test') as net1:
+            with self.subnet(network=net1) as subnet1:
+                with self.port(subnet=subnet1,
+                               set_context=True, tenant_id='test') as port1:
+                    self.nb_ovn.set_lswitch_port.reset_mock()
+                    data = {'port': {'name': 'new-name'}}
+                    self._update('ports', port1['port']['id'], data)
+                    self.nb_ovn.set_lswitch_port.assert_called_once_with(
+                        lport_name=port1['port']['id'],
+                        external_ids={
+                            ovn_const.OVN_PORT_NAME_EXT_ID_KEY: 'new-name'})
+
+                    self.nb_ovn.set_lswitch_port.reset_mock()
+                    data = {'port': {'admin_state_up': False}}
+                    self._update('ports', port1['port']['id'], data)
+                    self.nb_ovn.set_lswitch_port.assert_called_once_with(
+                        lport_name=port1['port']['id'], enabled=False)
+
+    def test_update_port_no_ovn_change(self):
+        with self.network(set_context=True, tenant_id='test') as net1:
+            with self.subnet(network=net1) as subnet1:
+                with self.port(subnet=subnet1,
+                               set_context=True, tenant_id='test') as port1:
+                    self.nb_ovn.transaction.reset_mock()
+                    self.nb_ovn.set_lswitch_port.reset_mock()
+                    data = {'port': {'description': 'new description'}}
+                    self._update('ports', port1['port']['id'], data)
+                    self.nb_ovn.set_lswitch_port.assert_not_called()
+                    self.nb_ovn.transaction.assert_not_called()
+
+    def test_update_port_qos_options(self):
+        port = {'id': 'port1', 'name': 'port1', 'network_id': 'net1',
+                'mac_address': '00:00:00:00:00:01', 'fixed_ips': [],
+                'admin_state_up': True, 'device_owner': 'compute:nova'}
+        qos_options = {'policing_rate': '1000', 'policing_burst': '100'}
+        with mock.patch.object(self.mech_driver,
+                               '_get_port_dhcpv4_options') as mock_dhcp:
+            self.mech_driver.update_port(port, port, qos_options)
+        mock_dhcp.assert_not_called()
+        self.nb_ovn.set_lswitch_port.assert_called_once_with(
+            lport_name='port1', options=qos_options)
+
+    def _get_journal(self):
+        session = n_context.get_admin_context().session
+        return [(row.object_type, row.object_uuid, row.operation)
+                for row in session.query(models.OVNJournal).order_by(
+                    models.OVNJournal.seqnum)]
+
+    def test_journal_mode(self):
+        config.cfg.CONF.set_override('ovn_journal', True, 'ovn')
+        with self.network(set_context=True, tenant_id='test') as net1:
+            with self.subnet(network=net1) as subnet1:
+                with self.port(subnet=subnet1,
+                               set_context=True, tenant_id='test') as port1:
+                    net_id = net1['network']['id']
+                    port_id = port1['port']['id']
+                    self._update('ports', port_id,
+                                 {'port': {'name': 'new-name'}})
+                    # No OVN relevant change, not recorded
+                    self._update('ports', port_id,
+                                 {'port': {'description': 'foo'}})
+                    self._delete('ports', port_id)
+
+        self.nb_ovn.create_lswitch.assert_not_called()
+        self.nb_ovn.create_lswitch_port.assert_not_called()
+        self.nb_ovn.set_lswitch_port.assert_not_called()
+        self.nb_ovn.delete_lswitch_port.assert_not_called()
+        self.assertEqual(
+            [(ovn_const.OVN_JOURNAL_NETWORK, net_id,
+              ovn_const.OVN_JOURNAL_CREATE),
+             (ovn_const.OVN_JOURNAL_PORT, port_id,
+              ovn_const.OVN_JOURNAL_CREATE),
+             (ovn_const.OVN_JOURNAL_PORT, port_id,
+              ovn_const.OVN_JOURNAL_UPDATE),
+             (ovn_const.OVN_JOURNAL_PORT, port_id,
+              ovn_const.OVN_JOURNAL_DELETE)],
+            self._get_journal())
+
     def test_delete_port_without_security_groups(self):
         kwargs = {'security_groups': []}
         with self.network(set_context=True, tenant_id='test') as net1:
@@ -740,8 +931,10 @@ class TestOVNMechansimDriverSegment(test_segment.HostSegmentMappingTestCase):
         hostname_with_physnets = {'hostname1': ['phys_net1', 'phys_net2'],
                                   'hostname2': ['phys_net1']}
         ovn_sb_api = self.mech_driver._sb_ovn
-        ovn_sb_api.get_chassis_hostname_and_physnets.return_value = (
-            hostname_with_physnets)
+        ovn_sb_api.get_chassis_hosts_with_physnet.side_effect = (
+            lambda physnet: {host for host, physnets
+                             in hostname_with_physnets.items()
+                             if physnet in physnets})
         self.mech_driver.subscribe()
         with self.network() as network:
             network_id = network['network']['id']
@@ -755,6 +948,36 @@ class TestOVNMechansimDriverSegment(test_segment.HostSegmentMappingTestCase):
         segments_host_db2 = self._get_segments_for_host('hostname2')
         self.assertFalse(set(segments_host_db2))
 
+    def test_update_segment_host_mappings(self):
+        network_id, host = self._test_segment_host_mapping()
+        segment1_id = list(self._get_segments_for_host(host))[0]
+        segment2 = self._test_create_segment(
+            network_id=network_id, physical_network='phys_net2',
+            segmentation_id=201, network_type='vlan')['segment']
+        self.mech_driver.update_segment_host_mappings(
+            {'hostname2': ['phys_net1', 'phys_net2'],
+             'hostname3': ['phys_net2', 'phys_net3']})
+        # The mapping of the other hosts is kept
+        self.assertEqual({segment1_id}, set(self._get_segments_for_host(host)))
+        self.assertEqual({segment1_id, segment2['id']},
+                         set(self._get_segments_for_host('hostname2')))
+        self.assertEqual({segment2['id']},
+                         set(self._get_segments_for_host('hostname3')))
+
+        # Nothing is written when the mappings didn't change
+        ctx = n_context.get_admin_context()
+        self.assertEqual((0, 0), segments_db.update_segment_host_mappings(
+            ctx, {host: {segment1_id}, 'hostname3': {segment2['id']}}))
+
+    def test_update_segment_host_mappings_all_hosts(self):
+        network_id, host = self._test_segment_host_mapping()
+        segment1_id = list(self._get_segments_for_host(host))[0]
+        self.mech_driver.update_segment_host_mappings(
+            {'hostname2': ['phys_net1']}, all_hosts=True)
+        self.assertEqual({}, self._get_segments_for_host(host))
+        self.assertEqual({segment1_id},
+                         set(self._get_segments_for_host('hostname2')))
+
 
 class TestOVNMechansimDriverDHCPOptions(OVNMechanismDriverTestCase):
 
@@ -882,6 +1105,46 @@ class TestOVNMechansimDriverDHCPOptions(OVNMechanismDriverTestCase):
         self.mech_driver._nb_ovn.add_dhcp_options.assert_called_once_with(
             'foo-subnet', port_id='foo-port', **expected_dhcp_options)
 
+    def test_create_port_dhcpv4_options_same_txn(self):
+        port = {
+            'id': 'foo-port',
+            'name': 'foo-port-name',
+            'network_id': 'foo-net',
+            'mac_address': 'fa:16:3e:00:00:01',
+            'device_owner': 'compute:None',
+            'fixed_ips': [{'subnet_id': 'foo-subnet',
+                           'ip_address': '10.0.0.11'}],
+            'extra_dhcp_opts': [{'ip_version': 4, 'opt_name': 'mtu',
+                                 'opt_value': '1200'}]}
+        self.mech_driver._nb_ovn.get_subnet_dhcp_options.return_value = {
+            'cidr': '10.0.0.0/24', 'external_ids': {'subnet_id': 'foo-subnet'},
+            'options': {'router': '10.0.0.1', 'mtu': '1400'},
+            'uuid': 'foo-uuid'}
+        dhcp_cmd = mock.Mock(spec=ovn_commands.AddDHCPOptionsCommand,
+                             port_id='foo-port')
+        self.mech_driver._nb_ovn.add_dhcp_options.return_value = dhcp_cmd
+        txn = mock.MagicMock()
+        self.mech_driver._nb_ovn.transaction = mock.MagicMock()
+        self.mech_driver._nb_ovn.transaction.return_value.__enter__.\
+            return_value = txn
+
+        ovn_port_info = self.mech_driver.get_ovn_port_options(port)
+        self.assertEqual([dhcp_cmd], ovn_port_info.dhcpv4_options)
+        with mock.patch.object(ovn_acl, 'add_acls', return_value=[]):
+            self.mech_driver.create_port_in_ovn(port, ovn_port_info)
+
+        # One transaction adding the DHCP_Options row before the port
+        self.assertEqual(1, self.mech_driver._nb_ovn.transaction.call_count)
+        self.mech_driver._nb_ovn.get_port_dhcp_options.assert_not_called()
+        txn.add.assert_has_calls([
+            mock.call(dhcp_cmd),
+            mock.call(self.mech_driver._nb_ovn.create_lswitch_port.
+                      return_value)])
+        self.assertEqual(
+            [dhcp_cmd],
+            self.mech_driver._nb_ovn.create_lswitch_port.call_args[1][
+                'dhcpv4_options'])
+
     def test_get_port_dhcpv4_options_port_dhcp_opts_not_set(self):
         port = {
             'id': 'foo-port',
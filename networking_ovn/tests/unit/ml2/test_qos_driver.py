@@ -10,7 +10,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 import mock
+from oslo_config import cfg
 from oslo_utils import uuidutils
 
 from neutron.objects.qos import policy as qos_policy
@@ -44,7 +47,8 @@ class TestOVNQosNotificationDriver(base.BaseTestCase):
 
     def test_delete_policy(self):
         self.driver.delete_policy(context, self.policy)
-        self.qos_driver.delete_policy.assert_not_called()
+        self.qos_driver.delete_policy.assert_called_once_with(context,
+                                                              self.policy)
 
 
 class TestOVNQosDriver(base.BaseTestCase):
@@ -115,6 +119,47 @@ class TestOVNQosDriver(base.BaseTestCase):
     def test__generate_port_options_with_rule(self):
         self._generate_port_options(self.policy_id, [self.rule], self.expected)
 
+    def _enable_cache(self):
+        cfg.CONF.set_override('ovn_qos_cache_timeout', 60, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_qos_cache_timeout',
+                        'ovn')
+
+    def test__generate_port_options_cached(self):
+        self._enable_cache()
+        with mock.patch.object(qos_rule, 'get_rules',
+                               return_value=[self.rule]) as get_rules:
+            self.driver._generate_port_options(context, self.policy_id)
+            options = self.driver._generate_port_options(context,
+                                                         self.policy_id)
+            get_rules.assert_called_once_with(context, self.policy_id)
+            self.assertEqual(self.expected, options)
+
+    def test__generate_port_options_cache_expired(self):
+        self._enable_cache()
+        with mock.patch.object(qos_rule, 'get_rules',
+                               return_value=[self.rule]) as get_rules, \
+                mock.patch.object(qos_driver.time, 'time',
+                                  side_effect=[100, 200, 200]):
+            self.driver._generate_port_options(context, self.policy_id)
+            self.driver._generate_port_options(context, self.policy_id)
+            self.assertEqual(2, get_rules.call_count)
+
+    def test__generate_port_options_cache_disabled(self):
+        # The cache is disabled by default
+        with mock.patch.object(qos_rule, 'get_rules',
+                               return_value=[self.rule]) as get_rules:
+            self.driver._generate_port_options(context, self.policy_id)
+            self.driver._generate_port_options(context, self.policy_id)
+            self.assertEqual(2, get_rules.call_count)
+            self.assertEqual({}, self.driver._policy_options)
+
+    def test__set_cached_purge(self):
+        cache = {'expired': (0, 'foo'), 'valid': (time.time() + 60, 'bar')}
+        self._enable_cache()
+        with mock.patch.object(qos_driver, 'QOS_CACHE_SIZE', 2):
+            self.driver._set_cached(cache, 'new', 'baz')
+        self.assertEqual(['new', 'valid'], sorted(cache))
+
     def _get_qos_options(self, port, port_policy, network_policy):
         with mock.patch.object(qos_policy.QosPolicy, 'get_network_policy',
                                return_value=self.policy) as get_network_policy:
@@ -156,19 +201,36 @@ class TestOVNQosDriver(base.BaseTestCase):
         port['qos_policy_id'] = None
         self._get_qos_options(port, False, True)
 
+    @mock.patch('neutron.context.get_admin_context', return_value=context)
+    def test_get_qos_options_network_policy_cached(self, *mocks):
+        port = self._create_fake_port()
+        port['qos_policy_id'] = None
+        self._enable_cache()
+        with mock.patch.object(qos_policy.QosPolicy, 'get_network_policy',
+                               return_value=self.policy) as get_policy, \
+                mock.patch.object(qos_rule, 'get_rules',
+                                  return_value=[self.rule]) as get_rules:
+            self.driver.get_qos_options(port)
+            options = self.driver.get_qos_options(port)
+            get_policy.assert_called_once_with(context, self.network_id)
+            get_rules.assert_called_once_with(context,
+                                              self.network_policy_id)
+            self.assertEqual(self.expected, options)
+
     def _update_network_ports(self, port, called):
+        nb_ovn = self.mech_driver._nb_ovn
         with mock.patch.object(self.plugin, 'get_ports',
                                return_value=[port]) as get_ports:
-            with mock.patch.object(self.mech_driver,
-                                   'update_port') as update_port:
-                self.driver._update_network_ports(
-                    context, self.network_id, {})
-                get_ports.assert_called_once_with(
-                    context, filters={'network_id': [self.network_id]})
-                if called:
-                    update_port.assert_called()
-                else:
-                    update_port.assert_not_called()
+            self.driver._update_network_ports(
+                context, self.network_id, self.expected)
+            get_ports.assert_called_once_with(
+                context, filters={'network_id': [self.network_id]})
+            if called:
+                nb_ovn.set_lswitch_ports_qos_options.assert_called_once_with(
+                    [port['id']], self.expected, if_exists=True)
+            else:
+                nb_ovn.set_lswitch_ports_qos_options.assert_not_called()
+            self.mech_driver.update_port.assert_not_called()
 
     def test__update_network_ports_port_policy(self):
         self._update_network_ports(self.port, False)
@@ -183,6 +245,13 @@ class TestOVNQosDriver(base.BaseTestCase):
         port['qos_policy_id'] = None
         self._update_network_ports(port, True)
 
+    def test__update_network_ports_vtep(self):
+        port = self._create_fake_port()
+        port['qos_policy_id'] = None
+        port['binding:profile'] = {'vtep-physical-switch': 'psw1',
+                                   'vtep-logical-switch': 'lsw1'}
+        self._update_network_ports(port, False)
+
     def _update_network(self, network, original_network, called):
         with mock.patch.object(self.driver, '_generate_port_options',
                                return_value={}) as generate_port_options:
@@ -218,30 +287,67 @@ class TestOVNQosDriver(base.BaseTestCase):
         original_network = self._create_fake_network()
         original_network['qos_policy_id'] = uuidutils.generate_uuid()
         self._update_network(network, original_network, True)
+        self.assertEqual(
+            self.network_policy_id,
+            self.driver._get_network_policy_id(context, self.network_id))
 
     def test_update_policy(self):
+        network_port = self._create_fake_port()
+        network_port['id'] = uuidutils.generate_uuid()
+        network_port['qos_policy_id'] = None
+        nb_ovn = self.mech_driver._nb_ovn
         with mock.patch.object(self.driver, '_generate_port_options',
                                return_value={}) as generate_port_options, \
             mock.patch.object(self.policy, 'get_bound_networks',
                               return_value=[self.network_id]
                               ) as get_bound_networks, \
-            mock.patch.object(self.driver, '_update_network_ports'
-                              ) as update_network_ports, \
             mock.patch.object(self.policy, 'get_bound_ports',
                               return_value=[self.port_id]
                               ) as get_bound_ports, \
-            mock.patch.object(self.plugin, 'get_port',
-                              return_value=self.port) as get_port, \
-            mock.patch.object(self.mech_driver, 'update_port',
-                              ) as update_port:
+            mock.patch.object(self.plugin, 'get_ports',
+                              side_effect=[[network_port, self.port],
+                                           [self.port]]) as get_ports:
 
             self.driver.update_policy(context, self.policy)
 
             generate_port_options.assert_called_once_with(
                 context, self.network_policy_id)
             get_bound_networks.assert_called_once()
-            update_network_ports.assert_called_once_with(
-                context, self.network_id, {})
             get_bound_ports.assert_called_once()
-            get_port.assert_called_once_with(context, self.port_id)
-            update_port.assert_called_once_with(self.port, self.port, {})
+            get_ports.assert_has_calls([
+                mock.call(context, filters={'network_id': [self.network_id]}),
+                mock.call(context, filters={'id': [self.port_id]})])
+            nb_ovn.set_lswitch_ports_qos_options.assert_called_once_with(
+                [network_port['id'], self.port_id], {}, if_exists=True)
+            self.mech_driver.update_port.assert_not_called()
+
+    def test_update_policy_not_bound(self):
+        with mock.patch.object(qos_rule, 'get_rules', return_value=[]), \
+            mock.patch.object(self.policy, 'get_bound_networks',
+                              return_value=[]), \
+            mock.patch.object(self.policy, 'get_bound_ports',
+                              return_value=[]):
+            self.driver.update_policy(context, self.policy)
+            self.plugin.get_ports.assert_not_called()
+            self.mech_driver._nb_ovn.set_lswitch_ports_qos_options.\
+                assert_not_called()
+
+    def test_update_policy_invalidates_cache(self):
+        with mock.patch.object(qos_rule, 'get_rules',
+                               return_value=[self.rule]) as get_rules, \
+            mock.patch.object(self.policy, 'get_bound_networks',
+                              return_value=[]), \
+            mock.patch.object(self.policy, 'get_bound_ports',
+                              return_value=[]):
+            self.driver._generate_port_options(context,
+                                               self.network_policy_id)
+            self.driver.update_policy(context, self.policy)
+            self.assertEqual(2, get_rules.call_count)
+
+    def test_delete_policy(self):
+        with mock.patch.object(qos_rule, 'get_rules',
+                               return_value=[self.rule]):
+            self.driver._generate_port_options(context,
+                                               self.network_policy_id)
+        self.driver.delete_policy(context, self.policy)
+        self.assertNotIn(self.network_policy_id, self.driver._policy_options)
@@ -19,6 +19,7 @@ from networking_ovn.ml2 import trunk_driver
 from networking_ovn.tests.unit import fakes
 
 from neutron.objects import trunk as trunk_objects
+from neutron.services.trunk import constants as trunk_consts
 from neutron.tests import base
 
 from oslo_config import cfg
@@ -31,10 +32,14 @@ class TestTrunkHandler(base.BaseTestCase):
         self.plugin_driver = mock.Mock()
         self.plugin_driver._nb_ovn = fakes.FakeOvsdbNbOvnIdl()
         self.handler = trunk_driver.OVNTrunkHandler(self.plugin_driver)
+        self.spawn_after = mock.patch.object(
+            trunk_driver.greenthread, 'spawn_after').start()
         self.trunk_1 = mock.Mock()
+        self.trunk_1.id = "trunk-1"
         self.trunk_1.port_id = "parent_port_1"
 
         self.trunk_2 = mock.Mock()
+        self.trunk_2.id = "trunk-2"
         self.trunk_2.port_id = "parent_port_2"
 
         self.sub_port_1 = mock.Mock()
@@ -62,80 +67,165 @@ class TestTrunkHandler(base.BaseTestCase):
         self.get_trunk_object.side_effect = lambda ctxt, id: \
             self.trunk_1 if id == 'trunk-1' else self.trunk_2
 
+    def _assert_subports_set(self, expected):
+        self.handler._flush()
+        nb_ovn = self.plugin_driver._nb_ovn
+        nb_ovn.set_lswitch_ports_parent.assert_called_once_with(
+            expected, if_exists=True)
+        nb_ovn.set_lswitch_ports_parent.return_value.execute.\
+            assert_called_once_with(check_error=True)
+        nb_ovn.set_lswitch_port.assert_not_called()
+
     def test_create_trunk(self):
         self.trunk_1.sub_ports = []
-
         self.handler.trunk_created(self.trunk_1)
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls([])
+        self.handler._flush()
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent.\
+            assert_not_called()
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
 
+        self.trunk_1.update.reset_mock()
         self.trunk_1.sub_ports = [self.sub_port_1, self.sub_port_2]
         self.handler.trunk_created(self.trunk_1)
-
-        calls = [mock.call.set_lswitch_port("sub_port_1",
-                                            parent_name="parent_port_1",
-                                            tag=40),
-                 mock.call.set_lswitch_port("sub_port_2",
-                                            parent_name="parent_port_1",
-                                            tag=41)]
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls(
-            calls, any_order=True)
+        self._assert_subports_set({'sub_port_1': ('parent_port_1', 40),
+                                   'sub_port_2': ('parent_port_1', 41)})
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
 
     def test_delete_trunk(self):
-        self.trunk_1.sub_ports = []
-        self.handler.trunk_deleted(self.trunk_1)
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls([])
-
         self.trunk_1.sub_ports = [self.sub_port_1, self.sub_port_2]
         self.handler.trunk_deleted(self.trunk_1)
-
-        calls = [mock.call.set_lswitch_port("sub_port_1",
-                                            parent_name=[],
-                                            tag=[]),
-                 mock.call.set_lswitch_port("sub_port_2",
-                                            parent_name=[],
-                                            tag=[])]
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls(
-            calls, any_order=True)
+        self._assert_subports_set({'sub_port_1': ([], []),
+                                   'sub_port_2': ([], [])})
+        self.trunk_1.update.assert_not_called()
 
     def test_subports_added(self):
         self.handler.subports_added(self.trunk_1,
                                     [self.sub_port_1, self.sub_port_2])
         self.handler.subports_added(self.trunk_2,
                                     [self.sub_port_3, self.sub_port_4])
-        calls = [mock.call.set_lswitch_port("sub_port_1",
-                                            parent_name="parent_port_1",
-                                            tag=40),
-                 mock.call.set_lswitch_port("sub_port_2",
-                                            parent_name="parent_port_1",
-                                            tag=41),
-                 mock.call.set_lswitch_port("sub_port_3",
-                                            parent_name="parent_port_2",
-                                            tag=42),
-                 mock.call.set_lswitch_port("sub_port_4",
-                                            parent_name="parent_port_2",
-                                            tag=43)]
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls(
-            calls, any_order=True)
+        self._assert_subports_set({'sub_port_1': ('parent_port_1', 40),
+                                   'sub_port_2': ('parent_port_1', 41),
+                                   'sub_port_3': ('parent_port_2', 42),
+                                   'sub_port_4': ('parent_port_2', 43)})
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+        self.trunk_2.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
 
     def test_subports_deleted(self):
         self.handler.subports_deleted(self.trunk_1,
                                       [self.sub_port_1, self.sub_port_2])
         self.handler.subports_deleted(self.trunk_2,
                                       [self.sub_port_3, self.sub_port_4])
-        calls = [mock.call.set_lswitch_port("sub_port_1",
-                                            parent_name=[],
-                                            tag=[]),
-                 mock.call.set_lswitch_port("sub_port_2",
-                                            parent_name=[],
-                                            tag=[]),
-                 mock.call.set_lswitch_port("sub_port_3",
-                                            parent_name=[],
-                                            tag=[]),
-                 mock.call.set_lswitch_port("sub_port_4",
-                                            parent_name=[],
-                                            tag=[])]
-        self.plugin_driver._nb_ovn.set_lswitch_port.assert_has_calls(
-            calls, any_order=True)
+        self._assert_subports_set({'sub_port_1': ([], []),
+                                   'sub_port_2': ([], []),
+                                   'sub_port_3': ([], []),
+                                   'sub_port_4': ([], [])})
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+        self.trunk_2.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+
+    def test_subports_coalesced(self):
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        self.handler.subports_added(self.trunk_1, [self.sub_port_2])
+        self.handler.subports_deleted(self.trunk_1, [self.sub_port_1])
+        self.spawn_after.assert_called_once_with(
+            self.handler.COALESCE_INTERVAL, self.handler._flush)
+        self._assert_subports_set({'sub_port_1': ([], []),
+                                   'sub_port_2': ('parent_port_1', 41)})
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+
+    def test_trunk_created_and_deleted(self):
+        self.trunk_1.sub_ports = [self.sub_port_1]
+        self.handler.trunk_created(self.trunk_1)
+        self.handler.trunk_deleted(self.trunk_1)
+        self._assert_subports_set({'sub_port_1': ([], [])})
+        self.trunk_1.update.assert_not_called()
+
+    def _fail_subports(self, *ports):
+        def set_lswitch_ports_parent(lport_parents, if_exists):
+            command = mock.Mock()
+            if set(ports) & set(lport_parents):
+                command.execute.side_effect = RuntimeError
+            return command
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent.side_effect = (
+            set_lswitch_ports_parent)
+
+    def test_flush_failure(self):
+        self._fail_subports('sub_port_1')
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        self.handler.subports_deleted(self.trunk_2, [self.sub_port_3])
+        self.spawn_after.reset_mock()
+        self.handler._flush()
+        # The changes of each trunk are applied on their own
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent.assert_has_calls(
+            [mock.call({'sub_port_1': ('parent_port_1', 40),
+                        'sub_port_3': ([], [])}, if_exists=True),
+             mock.call({'sub_port_1': ('parent_port_1', 40)},
+                       if_exists=True),
+             mock.call({'sub_port_3': ([], [])}, if_exists=True)],
+            any_order=True)
+        self.trunk_2.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+        # The failed changes are retried
+        self.trunk_1.update.assert_not_called()
+        self.assertEqual({'sub_port_1': ('trunk-1', ('parent_port_1', 40))},
+                         self.handler._pending_subports)
+        self.spawn_after.assert_called_once_with(
+            self.handler.RETRY_INTERVAL, self.handler._flush)
+
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent.side_effect = (
+            None)
+        self.handler._flush()
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+        self.assertEqual({}, self.handler._pending_subports)
+        self.assertEqual({}, self.handler._retries)
+
+    def test_flush_failure_newer_change(self):
+        def set_lswitch_ports_parent(lport_parents, if_exists):
+            # The subport is deleted while its addition is applied
+            self.handler.subports_deleted(self.trunk_1, [self.sub_port_1])
+            return mock.Mock(**{'execute.side_effect': RuntimeError})
+        self.plugin_driver._nb_ovn.set_lswitch_ports_parent.side_effect = (
+            set_lswitch_ports_parent)
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        self.handler._flush()
+        self.assertEqual({'sub_port_1': ('trunk-1', ([], []))},
+                         self.handler._pending_subports)
+
+    def test_flush_failure_give_up(self):
+        self._fail_subports('sub_port_1')
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        for i in range(self.handler.MAX_RETRIES):
+            self.handler._flush()
+            self.trunk_1.update.assert_not_called()
+        self.handler._flush()
+        self.trunk_1.update.assert_called_once_with(
+            status=trunk_consts.ERROR_STATUS)
+        self.assertEqual({}, self.handler._pending_subports)
+        self.assertEqual({}, self.handler._retries)
+
+    def test_flush_status_failure(self):
+        self.trunk_1.update.side_effect = RuntimeError
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        self.handler.subports_added(self.trunk_2, [self.sub_port_3])
+        self.handler._flush()
+        self.trunk_2.update.assert_called_once_with(
+            status=trunk_consts.ACTIVE_STATUS)
+
+    def test_flush_trunk_gone(self):
+        self.get_trunk_object.side_effect = None
+        self.get_trunk_object.return_value = None
+        self.handler.subports_added(self.trunk_1, [self.sub_port_1])
+        self.handler._flush()
+        self.get_trunk_object.assert_called_once_with(mock.ANY,
+                                                      id='trunk-1')
+        self.trunk_1.update.assert_not_called()
 
 
 class TestTrunkDriver(base.BaseTestCase):
@@ -128,6 +128,58 @@ class TestBaseCommandHelpers(base.TestCase):
         self._test__updatevalues_in_list_no_mutate(fake_row_exists)
 
 
+class TestRowCache(base.TestCase):
+
+    def setUp(self):
+        super(TestRowCache, self).setUp()
+        self.rows = [fakes.FakeOvsdbRow.create_one_ovsdb_row()
+                     for i in range(3)]
+        self.table = fakes.FakeOvsdbTable.create_one_ovsdb_table()
+        self.table.rows = dict((row.uuid, row) for row in self.rows)
+        self.idl = mock.Mock(tables={'Logical_Switch': self.table})
+
+    def _row_by_value(self, name, *default):
+        return commands._row_by_value(self.idl, 'Logical_Switch', 'name',
+                                      name, *default)
+
+    def test_row_by_value_no_cache(self):
+        with mock.patch.object(idlutils, 'row_by_value') as row_by_value:
+            self._row_by_value('foo', None)
+        row_by_value.assert_called_once_with(self.idl, 'Logical_Switch',
+                                             'name', 'foo', None)
+
+    def test_row_by_value_indexed(self):
+        with commands.row_cache(self.idl):
+            self.assertEqual(self.rows[0], self._row_by_value(
+                self.rows[0].name))
+            self.assertEqual(self.rows[1], self._row_by_value(
+                self.rows[1].name))
+            with mock.patch.object(idlutils, 'row_by_value') as row_by_value:
+                for row in self.rows:
+                    self.assertEqual(row, self._row_by_value(row.name))
+            row_by_value.assert_not_called()
+        self.assertIsNone(commands.get_row_cache(self.idl))
+
+    def test_row_by_value_deleted_row(self):
+        with commands.row_cache(self.idl):
+            name = self.rows[0].name
+            self.assertEqual(self.rows[0], self._row_by_value(name))
+            del self.table.rows[self.rows[0].uuid]
+            self.assertIsNone(self._row_by_value(name, None))
+            self.assertRaises(idlutils.RowNotFound, self._row_by_value, name)
+
+    def test_row_by_value_inserted_row(self):
+        with commands.row_cache(self.idl) as cache:
+            self.assertIsNone(self._row_by_value('foo', None))
+            self._row_by_value(self.rows[0].name)
+            row = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+                attrs={'name': 'foo'})
+            self.table.rows[row.uuid] = row
+            self.assertEqual(row, self._row_by_value('foo'))
+            cache.clear()
+            self.assertEqual(row, self._row_by_value('foo'))
+
+
 class TestBaseCommand(base.TestCase):
     def setUp(self):
         super(TestBaseCommand, self).setUp()
@@ -304,6 +356,23 @@ class TestAddLSwitchPortCommand(TestBaseCommand):
     def test_lswitch_port_add_ignore_exists(self):
         self._test_lswitch_port_add(may_exist=False)
 
+    def test_lswitch_port_add_dhcp_options_cmd(self):
+        fake_lswitch = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        fake_dhcp_options = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        fake_lsp = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        self.transaction.insert.side_effect = [fake_dhcp_options, fake_lsp]
+        dhcp_cmd = commands.AddDHCPOptionsCommand(
+            self.ovn_api, 'fake-subnet-id', port_id='fake-lsp',
+            may_exists=False)
+        dhcp_cmd.run_idl(self.transaction)
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lswitch):
+            cmd = commands.AddLSwitchPortCommand(
+                self.ovn_api, 'fake-lsp', fake_lswitch.name,
+                may_exist=False, dhcpv4_options=[dhcp_cmd])
+            cmd.run_idl(self.transaction)
+        self.assertEqual([fake_dhcp_options.uuid], fake_lsp.dhcpv4_options)
+
 
 class TestSetLSwitchPortCommand(TestBaseCommand):
 
@@ -351,11 +420,169 @@ class TestSetLSwitchPortCommand(TestBaseCommand):
                                return_value=fake_lsp):
             cmd = commands.SetLSwitchPortCommand(
                 self.ovn_api, fake_lsp.name, if_exists=True,
-                external_ids=new_ext_ids)
+                external_ids=new_ext_ids, dhcpv4_options=[])
             cmd.run_idl(self.transaction)
             self.assertEqual(new_ext_ids, fake_lsp.external_ids)
             fake_dhcp_options.delete.assert_called_once_with()
 
+    def test_lswitch_port_update_keep_dhcp(self):
+        new_ext_ids = {ovn_const.OVN_PORT_NAME_EXT_ID_KEY: 'test-new'}
+        fake_dhcp_options = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'external_ids': {'port_id': 'fake-lsp'}})
+        self.ovn_api.dhcp_options_table.rows[fake_dhcp_options.uuid] = \
+            fake_dhcp_options
+        fake_lsp = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'name': 'fake-lsp',
+                   'dhcpv4_options': [fake_dhcp_options]})
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lsp):
+            cmd = commands.SetLSwitchPortCommand(
+                self.ovn_api, fake_lsp.name, if_exists=True,
+                external_ids=new_ext_ids)
+            cmd.run_idl(self.transaction)
+        self.assertEqual(new_ext_ids, fake_lsp.external_ids)
+        self.assertEqual([fake_dhcp_options], fake_lsp.dhcpv4_options)
+        fake_dhcp_options.delete.assert_not_called()
+
+    def test_lswitch_port_update_dhcp_options_cmd(self):
+        fake_dhcp_options = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'external_ids': {'port_id': 'fake-lsp'}})
+        self.ovn_api.dhcp_options_table.rows[fake_dhcp_options.uuid] = \
+            fake_dhcp_options
+        fake_lsp = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'name': 'fake-lsp',
+                   'dhcpv4_options': [fake_dhcp_options]})
+        dhcp_cmd = mock.Mock(spec=commands.AddDHCPOptionsCommand,
+                             result=fake_dhcp_options.uuid)
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lsp):
+            cmd = commands.SetLSwitchPortCommand(
+                self.ovn_api, fake_lsp.name, if_exists=True,
+                dhcpv4_options=[dhcp_cmd])
+            cmd.run_idl(self.transaction)
+        # The DHCP_Options row updated by the command is kept
+        self.assertEqual([fake_dhcp_options.uuid], fake_lsp.dhcpv4_options)
+        fake_dhcp_options.delete.assert_not_called()
+
+
+class TestSetLSwitchPortsQosOptionsCommand(TestBaseCommand):
+
+    def _test_lswitch_port_not_found(self, if_exists):
+        with mock.patch.object(idlutils, 'row_by_value',
+                               side_effect=idlutils.RowNotFound):
+            cmd = commands.SetLSwitchPortsQosOptionsCommand(
+                self.ovn_api, ['fake-lsp'], {'policing_rate': '1'},
+                if_exists=if_exists)
+            if if_exists:
+                cmd.run_idl(self.transaction)
+            else:
+                self.assertRaises(RuntimeError, cmd.run_idl, self.transaction)
+
+    def test_lswitch_port_not_found_ignore(self):
+        self._test_lswitch_port_not_found(True)
+
+    def test_lswitch_port_not_found_fail(self):
+        self._test_lswitch_port_not_found(False)
+
+    def test_set_qos_options(self):
+        fake_lsp1 = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'options': {'policing_rate': '1',
+                               'policing_burst': '100',
+                               'foo': 'bar'}})
+        fake_lsp2 = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'options': {'policing_rate': '2'}})
+        with mock.patch.object(idlutils, 'row_by_value',
+                               side_effect=[fake_lsp1, fake_lsp2]):
+            cmd = commands.SetLSwitchPortsQosOptionsCommand(
+                self.ovn_api, [fake_lsp1.name, fake_lsp2.name],
+                {'policing_rate': '2'}, if_exists=True)
+            cmd.run_idl(self.transaction)
+            fake_lsp1.verify.assert_called_once_with('options')
+            self.assertEqual({'policing_rate': '2', 'foo': 'bar'},
+                             fake_lsp1.options)
+            fake_lsp2.verify.assert_not_called()
+            self.assertEqual({'policing_rate': '2'}, fake_lsp2.options)
+
+    def test_set_qos_options_mutate(self):
+        fake_lsp = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'options': {'policing_rate': '1',
+                               'policing_burst': '100'}},
+            methods={'addvalue': None, 'setkey': None, 'delkey': None})
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lsp):
+            cmd = commands.SetLSwitchPortsQosOptionsCommand(
+                self.ovn_api, [fake_lsp.name], {'policing_rate': '2'},
+                if_exists=True)
+            cmd.run_idl(self.transaction)
+            fake_lsp.setkey.assert_called_once_with(
+                'options', 'policing_rate', '2')
+            fake_lsp.delkey.assert_called_once_with(
+                'options', 'policing_burst')
+            fake_lsp.verify.assert_not_called()
+
+    def test_partition(self):
+        cmd = commands.SetLSwitchPortsQosOptionsCommand(
+            self.ovn_api, iter(['lsp1', 'lsp2', 'lsp3']),
+            {'policing_rate': '1'}, if_exists=True)
+        self.assertEqual(3, cmd.get_size())
+        self.assertEqual([cmd], cmd.partition(3))
+        partitions = cmd.partition(2)
+        self.assertEqual([['lsp1', 'lsp2'], ['lsp3']],
+                         [part.lport_names for part in partitions])
+        for part in partitions:
+            self.assertEqual({'policing_rate': '1'}, part.options)
+            self.assertTrue(part.if_exists)
+
+
+class TestSetLSwitchPortsParentCommand(TestBaseCommand):
+
+    def _test_lswitch_port_not_found(self, if_exists):
+        with mock.patch.object(idlutils, 'row_by_value',
+                               side_effect=idlutils.RowNotFound):
+            cmd = commands.SetLSwitchPortsParentCommand(
+                self.ovn_api, {'fake-lsp': ('fake-parent', 10)},
+                if_exists=if_exists)
+            if if_exists:
+                cmd.run_idl(self.transaction)
+            else:
+                self.assertRaises(RuntimeError, cmd.run_idl, self.transaction)
+
+    def test_lswitch_port_not_found_ignore(self):
+        self._test_lswitch_port_not_found(True)
+
+    def test_lswitch_port_not_found_fail(self):
+        self._test_lswitch_port_not_found(False)
+
+    def test_set_parents(self):
+        fake_lsp1 = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        fake_lsp2 = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'parent_name': 'fake-parent', 'tag': 10})
+        lsps = {fake_lsp1.name: fake_lsp1, fake_lsp2.name: fake_lsp2}
+        with mock.patch.object(
+                idlutils, 'row_by_value',
+                side_effect=lambda idl, table, col, name: lsps[name]):
+            cmd = commands.SetLSwitchPortsParentCommand(
+                self.ovn_api, {fake_lsp1.name: ('fake-parent', 11),
+                               fake_lsp2.name: ([], [])},
+                if_exists=True)
+            cmd.run_idl(self.transaction)
+            self.assertEqual('fake-parent', fake_lsp1.parent_name)
+            self.assertEqual(11, fake_lsp1.tag)
+            self.assertEqual([], fake_lsp2.parent_name)
+            self.assertEqual([], fake_lsp2.tag)
+
+    def test_partition(self):
+        lport_parents = {'lsp1': ('parent', 1), 'lsp2': ('parent', 2),
+                         'lsp3': ([], [])}
+        cmd = commands.SetLSwitchPortsParentCommand(
+            self.ovn_api, lport_parents, if_exists=True)
+        self.assertEqual(3, cmd.get_size())
+        self.assertEqual([cmd], cmd.partition(3))
+        partitions = cmd.partition(2)
+        self.assertEqual([{'lsp1': ('parent', 1), 'lsp2': ('parent', 2)},
+                          {'lsp3': ([], [])}],
+                         [part.lport_parents for part in partitions])
+
 
 class TestDelLSwitchPortCommand(TestBaseCommand):
 
@@ -483,6 +710,33 @@ class TestUpdateLRouterCommand(TestBaseCommand):
             self.assertEqual(new_ext_ids, fake_lrouter.external_ids)
 
 
+class TestMoveLRouterGatewayCommand(TestBaseCommand):
+
+    def _test_lrouter_move_gateway(self, chassis, expected_chassis):
+        fake_lrouter = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'options': {'chassis': chassis}})
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lrouter):
+            cmd = commands.MoveLRouterGatewayCommand(
+                self.ovn_api, fake_lrouter.name, 'hv1', 'hv2')
+            cmd.run_idl(self.transaction)
+            self.assertEqual({'chassis': expected_chassis},
+                             fake_lrouter.options)
+
+    def test_lrouter_move_gateway(self):
+        self._test_lrouter_move_gateway('hv1', 'hv2')
+
+    def test_lrouter_move_gateway_moved(self):
+        self._test_lrouter_move_gateway('hv3', 'hv3')
+
+    def test_lrouter_move_gateway_no_exist(self):
+        with mock.patch.object(idlutils, 'row_by_value',
+                               side_effect=idlutils.RowNotFound):
+            cmd = commands.MoveLRouterGatewayCommand(
+                self.ovn_api, 'fake-lrouter', 'hv1', 'hv2')
+            cmd.run_idl(self.transaction)
+
+
 class TestDelLRouterCommand(TestBaseCommand):
 
     def _test_lrouter_del_no_exist(self, if_exists=True):
@@ -813,6 +1067,28 @@ class TestUpdateACLsCommand(TestBaseCommand):
             self.assertEqual([], fake_lswitch.acls)
 
 
+    def test_partition(self):
+        ports = [{'id': 'port%d' % i, 'network_id': 'net%d' % (i % 2)}
+                 for i in range(5)]
+        acls = dict((port['id'], {'match': port['id']}) for port in ports[1:])
+        cmd = commands.UpdateACLsCommand(
+            self.ovn_api, ['net0', 'net1'], iter(ports), acls,
+            need_compare=False, is_add_acl=False)
+        self.assertEqual(5, cmd.get_size())
+        self.assertEqual([cmd], cmd.partition(5))
+        partitions = cmd.partition(2)
+        self.assertEqual([ports[0:2], ports[2:4], ports[4:]],
+                         [part.port_list for part in partitions])
+        self.assertEqual([['net0', 'net1'], ['net0', 'net1'], ['net0']],
+                         [part.lswitch_names for part in partitions])
+        self.assertEqual([['port1'], ['port2', 'port3'], ['port4']],
+                         [sorted(part.acl_new_values_dict)
+                          for part in partitions])
+        for part in partitions:
+            self.assertFalse(part.need_compare)
+            self.assertFalse(part.is_add_acl)
+
+
 class TestAddStaticRouteCommand(TestBaseCommand):
 
     def test_lrouter_not_found(self):
@@ -895,6 +1171,75 @@ class TestDelStaticRouteCommand(TestBaseCommand):
             self.assertEqual([mock.ANY], fake_lrouter.static_routes)
 
 
+class TestUpdateStaticRoutesCommand(TestBaseCommand):
+
+    def _test_lrouter_not_found(self, if_exists):
+        with mock.patch.object(idlutils, 'row_by_value',
+                               side_effect=idlutils.RowNotFound):
+            cmd = commands.UpdateStaticRoutesCommand(
+                self.ovn_api, 'fake-lrouter',
+                add_routes=[('30.0.0.0/24', '40.0.0.100')], del_routes=[],
+                if_exists=if_exists)
+            if if_exists:
+                cmd.run_idl(self.transaction)
+            else:
+                self.assertRaises(RuntimeError, cmd.run_idl, self.transaction)
+            self.transaction.insert.assert_not_called()
+
+    def test_lrouter_not_found_ignore(self):
+        self._test_lrouter_not_found(if_exists=True)
+
+    def test_lrouter_not_found_fail(self):
+        self._test_lrouter_not_found(if_exists=False)
+
+    def test_static_routes_update(self):
+        fake_static_route1 = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'ip_prefix': '10.0.0.0/24', 'nexthop': '20.0.0.100'})
+        fake_static_route2 = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'ip_prefix': '11.0.0.0/24', 'nexthop': '20.0.0.100'})
+        fake_lrouter = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'static_routes': [fake_static_route1,
+                                     fake_static_route2]})
+        new_static_route = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        self.transaction.insert.return_value = new_static_route
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lrouter):
+            cmd = commands.UpdateStaticRoutesCommand(
+                self.ovn_api, fake_lrouter.name,
+                add_routes=[('30.0.0.0/24', '40.0.0.100'),
+                            ('11.0.0.0/24', '20.0.0.100')],
+                del_routes=[('10.0.0.0/24', '20.0.0.100'),
+                            ('12.0.0.0/24', '20.0.0.100')],
+                if_exists=True)
+            cmd.run_idl(self.transaction)
+            self.transaction.insert.assert_called_once_with(
+                self.ovn_api.lrouter_static_route_table)
+            self.assertEqual('30.0.0.0/24', new_static_route.ip_prefix)
+            self.assertEqual('40.0.0.100', new_static_route.nexthop)
+            fake_lrouter.verify.assert_called_once_with('static_routes')
+            self.assertItemsEqual([fake_static_route2, new_static_route],
+                                  fake_lrouter.static_routes)
+            fake_static_route1.delete.assert_called_once_with()
+            fake_static_route2.delete.assert_not_called()
+
+    def test_static_routes_unchanged(self):
+        fake_static_route = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'ip_prefix': '10.0.0.0/24', 'nexthop': '20.0.0.100'})
+        fake_lrouter = fakes.FakeOvsdbRow.create_one_ovsdb_row(
+            attrs={'static_routes': [fake_static_route]})
+        with mock.patch.object(idlutils, 'row_by_value',
+                               return_value=fake_lrouter):
+            cmd = commands.UpdateStaticRoutesCommand(
+                self.ovn_api, fake_lrouter.name,
+                add_routes=[('10.0.0.0/24', '20.0.0.100')],
+                del_routes=[('12.0.0.0/24', '20.0.0.100')],
+                if_exists=True)
+            cmd.run_idl(self.transaction)
+            self.transaction.insert.assert_not_called()
+            fake_lrouter.verify.assert_not_called()
+            fake_static_route.delete.assert_not_called()
+
+
 class TestAddAddrSetCommand(TestBaseCommand):
 
     def test_addrset_exists(self):
@@ -1016,6 +1361,23 @@ class TestUpdateAddrSetCommand(TestBaseCommand):
     def test_addrset_update_del(self):
         self._test_addrset_update(addrs_del=['10.0.0.2'])
 
+    def test_partition(self):
+        cmd = commands.UpdateAddrSetCommand(
+            self.ovn_api, 'as1', addrs_add=['10.0.0.1', '10.0.0.2'],
+            addrs_remove=['10.0.0.3', '10.0.0.4', '10.0.0.5'],
+            if_exists=True)
+        self.assertEqual(5, cmd.get_size())
+        self.assertEqual([cmd], cmd.partition(5))
+        partitions = cmd.partition(2)
+        self.assertEqual(
+            [(['10.0.0.1', '10.0.0.2'], None),
+             (None, ['10.0.0.3', '10.0.0.4']),
+             (None, ['10.0.0.5'])],
+            [(part.addrs_add, part.addrs_remove) for part in partitions])
+        for part in partitions:
+            self.assertEqual('as1', part.name)
+            self.assertTrue(part.if_exists)
+
 
 class TestUpdateAddrSetExtIdsCommand(TestBaseCommand):
     def setUp(self):
@@ -1087,6 +1449,19 @@ class TestAddDHCPOptionsCommand(TestBaseCommand):
     def test_dhcp_options_add_ignore_exists(self):
         self._test_dhcp_options_add(may_exist=False)
 
+    def test_dhcp_options_add_result(self):
+        fake_dhcp_options = fakes.FakeOvsdbRow.create_one_ovsdb_row()
+        self.transaction.insert.return_value = fake_dhcp_options
+        cmd = commands.AddDHCPOptionsCommand(
+            self.ovn_api, 'fake-subnet-id', port_id='fake-port-id',
+            may_exists=False)
+        cmd.run_idl(self.transaction)
+        self.assertEqual(fake_dhcp_options.uuid, cmd.result)
+        self.transaction.get_insert_uuid = mock.Mock(
+            return_value='real-uuid')
+        cmd.post_commit(self.transaction)
+        self.assertEqual('real-uuid', cmd.result)
+
 
 class TestDelDHCPOptionsCommand(TestBaseCommand):
 
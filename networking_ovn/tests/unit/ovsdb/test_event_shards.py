@@ -0,0 +1,158 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from networking_ovn.ovsdb import event_shards
+from networking_ovn.tests import base
+
+
+class TestGetShard(base.TestCase):
+
+    def test_get_shard_range(self):
+        for num_shards in (1, 3, 8):
+            shards = set(event_shards.get_shard('port-%d' % i, num_shards)
+                         for i in range(200))
+            self.assertTrue(shards.issubset(set(range(num_shards))))
+        self.assertEqual(set(range(8)), shards)
+
+    def test_get_shard_stable(self):
+        self.assertEqual(event_shards.get_shard(u'port-1', 8),
+                         event_shards.get_shard(b'port-1', 8))
+        self.assertEqual(event_shards.get_shard('port-1', 8),
+                         event_shards.get_shard('port-1', 8))
+
+    def test_get_row_key(self):
+        row = mock.Mock()
+        row.name = 'port-1'
+        self.assertEqual('port-1', event_shards.get_row_key(row))
+        row = mock.Mock(spec=['uuid'], uuid='fake-uuid')
+        self.assertEqual('fake-uuid', event_shards.get_row_key(row))
+
+
+class TestEventShards(base.TestCase):
+
+    def setUp(self):
+        super(TestEventShards, self).setUp()
+        mock.patch.object(event_shards.idl, 'SchemaHelper').start()
+        self.idl_cls = mock.patch.object(event_shards.idl, 'Idl').start()
+        self.idl_cls.side_effect = lambda *args: mock.Mock(
+            has_lock=False, is_lock_contended=False)
+        mock.patch.object(event_shards.poller, 'Poller').start()
+        self.shards = event_shards.EventShards('remote', {}, 'lock', 4,
+                                               max_shards=2)
+
+    def _set_locks(self, *shards):
+        for shard, lock in enumerate(self.shards.locks):
+            lock.idl.has_lock = shard in shards
+
+    def test_lock_names(self):
+        self.assertEqual(['lock_0', 'lock_1', 'lock_2', 'lock_3'],
+                         [lock.lock_name for lock in self.shards.locks])
+        for lock in self.shards.locks:
+            lock.idl.set_lock.assert_called_once_with(lock.lock_name)
+
+    def test_owns_row(self):
+        row = mock.Mock()
+        row.name = 'port-1'
+        shard = event_shards.get_shard('port-1', 4)
+        self._set_locks(shard)
+        self.assertTrue(self.shards.owns_row(row))
+        self._set_locks((shard + 1) % 4)
+        self.assertFalse(self.shards.owns_row(row))
+
+    def test_owns_row_unsharded_table(self):
+        self.shards.sharded_tables = frozenset(['Logical_Switch_Port'])
+        row = mock.Mock()
+        row.name = 'chassis-1'
+        row._table.name = 'Chassis'
+        self._set_locks(0)
+        self.assertEqual(0, self.shards.get_row_shard(row))
+        self.assertTrue(self.shards.owns_row(row))
+        self._set_locks(1, 2, 3)
+        self.assertFalse(self.shards.owns_row(row))
+
+    def test_pop_acquired(self):
+        self._set_locks(0, 1)
+        self.shards._run_locks()
+        self.assertEqual([0, 1], self.shards.pop_acquired())
+        self.assertEqual([], self.shards.pop_acquired())
+        self._set_locks(1, 2)
+        self.shards._run_locks()
+        self.assertEqual([2], self.shards.pop_acquired())
+        # Lost and acquired again
+        self._set_locks(2)
+        self.shards._run_locks()
+        self._set_locks(1, 2)
+        self.shards._run_locks()
+        self.assertEqual([1], self.shards.pop_acquired())
+
+    def test_pop_acquired_released(self):
+        self._set_locks(0, 1, 2, 3)
+        self.shards._run_locks()
+        self.shards.pop_acquired()
+        self.shards.rebalance()
+        released = [shard for shard, lock in enumerate(self.shards.locks)
+                    if lock.released_at is not None]
+        # The released locks are granted back, their events may have been
+        # missed meanwhile
+        self.shards._run_locks()
+        self.assertEqual(released, self.shards.pop_acquired())
+
+    def test_rebalance_under_max_shards(self):
+        self._set_locks(0, 1)
+        self.shards.rebalance()
+        for lock in self.shards.locks:
+            self.assertIsNone(lock.released_at)
+
+    def test_rebalance_releases_extra_shards(self):
+        self._set_locks(0, 1, 2, 3)
+        self.shards.rebalance()
+        released = [lock for lock in self.shards.locks
+                    if lock.released_at is not None]
+        self.assertEqual(2, len(released))
+        for lock in released:
+            lock.idl.set_lock.assert_has_calls(
+                [mock.call(None), mock.call(lock.lock_name)])
+
+    def test_rebalance_keeps_shards_granted_back(self):
+        self._set_locks(0, 1, 2, 3)
+        self.shards.rebalance()
+        released = [lock for lock in self.shards.locks
+                    if lock.released_at is not None]
+        # Nobody else wants the locks, they are granted back
+        self.shards.rebalance()
+        for lock in released:
+            self.assertIsNone(lock.released_at)
+            self.assertGreater(lock.keep_until, 0)
+        # The other locks are released now
+        for lock in self.shards.locks:
+            if lock not in released:
+                self.assertIsNotNone(lock.released_at)
+
+    def test_rebalance_no_max_shards(self):
+        self.shards.max_shards = 0
+        self._set_locks(0, 1, 2, 3)
+        self.shards.rebalance()
+        for lock in self.shards.locks:
+            self.assertIsNone(lock.released_at)
+
+    def test_wait_for_locks(self):
+        self._set_locks(0)
+        for lock in self.shards.locks[1:]:
+            lock.idl.is_lock_contended = True
+        self.shards.wait_for_locks(1)
+        self.assertEqual([0], self.shards.owned_shards())
+        # Synced from the initial dump of the DB
+        self.assertEqual([], self.shards.pop_acquired())
+        for lock in self.shards.locks:
+            lock.idl.run.assert_called_once_with()
@@ -0,0 +1,162 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from ovs.db import idl
+
+from networking_ovn.ovsdb import impl_idl_ovn
+from networking_ovn.tests import base
+
+
+def _fake_chassis(name, hostname, bridge_mappings):
+    chassis = mock.Mock(
+        uuid='%s-uuid' % name, hostname=hostname,
+        external_ids={'ovn-bridge-mappings': bridge_mappings,
+                      'datapath-type': 'system'})
+    chassis.name = name
+    return chassis
+
+
+class TestChassisIndex(base.TestCase):
+
+    def setUp(self):
+        super(TestChassisIndex, self).setUp()
+        self.chassis = [_fake_chassis('ch1', 'host1', 'phys1:br1,phys2:br2'),
+                        _fake_chassis('ch2', 'host2', 'phys1:br1'),
+                        _fake_chassis('ch3', 'host3', '')]
+        rows = dict((ch.uuid, ch) for ch in self.chassis)
+        self.idl = mock.Mock(tables={'Chassis': mock.Mock(rows=rows)})
+        self.index = impl_idl_ovn.ChassisIndex(self.idl)
+        self.listener = self.idl.add_table_listener.call_args[0][1]
+
+    def test_initial_index(self):
+        self.idl.add_table_listener.assert_called_once_with('Chassis',
+                                                            mock.ANY)
+        self.assertEqual({'host1': ['phys1', 'phys2'],
+                          'host2': ['phys1'],
+                          'host3': []},
+                         dict((host, sorted(physnets)) for host, physnets
+                              in self.index.get_hostname_and_physnets()
+                              .items()))
+        self.assertEqual({'host1', 'host2'},
+                         self.index.get_hosts_with_physnet('phys1'))
+        self.assertEqual(set(), self.index.get_hosts_with_physnet('phys3'))
+        self.assertIs(self.chassis[1],
+                      self.index.get_chassis_by_hostname('host2'))
+        self.assertIsNone(self.index.get_chassis_by_hostname('host4'))
+
+    def test_chassis_changes(self):
+        self.listener(idl.ROW_CREATE,
+                      _fake_chassis('ch4', 'host4', 'phys3:br3'))
+        self.chassis[0].external_ids['ovn-bridge-mappings'] = 'phys2:br2'
+        self.listener(idl.ROW_UPDATE, self.chassis[0])
+        self.listener(idl.ROW_DELETE, self.chassis[1])
+        self.assertEqual(set(), self.index.get_hosts_with_physnet('phys1'))
+        self.assertEqual({'host1'},
+                         self.index.get_hosts_with_physnet('phys2'))
+        self.assertEqual({'host4'},
+                         self.index.get_hosts_with_physnet('phys3'))
+        self.assertIsNone(self.index.get_chassis_by_hostname('host2'))
+        self.assertEqual(['host1', 'host3', 'host4'],
+                         sorted(self.index.get_hostname_and_physnets()))
+
+    def test_hostname_changed(self):
+        self.chassis[1].hostname = 'host4'
+        self.listener(idl.ROW_UPDATE, self.chassis[1])
+        self.assertEqual({'host1', 'host4'},
+                         self.index.get_hosts_with_physnet('phys1'))
+        self.assertIsNone(self.index.get_chassis_by_hostname('host2'))
+        self.assertIs(self.chassis[1],
+                      self.index.get_chassis_by_hostname('host4'))
+
+    def test_shared_hostname(self):
+        ch4 = _fake_chassis('ch4', 'host2', 'phys3:br3')
+        with mock.patch.object(impl_idl_ovn.LOG, 'warning') as warning:
+            self.listener(idl.ROW_CREATE, ch4)
+            self.assertTrue(warning.called)
+        # The host has the physnets of both chassis
+        self.assertEqual(['phys1', 'phys3'],
+                         sorted(self.index.get_hostname_and_physnets()
+                                ['host2']))
+        self.assertEqual({'host2'},
+                         self.index.get_hosts_with_physnet('phys3'))
+        self.assertIs(self.chassis[1],
+                      self.index.get_chassis_by_hostname('host2'))
+
+        # The host is kept as long as one of its chassis is there
+        self.listener(idl.ROW_DELETE, self.chassis[1])
+        self.assertEqual(['phys3'],
+                         self.index.get_hostname_and_physnets()['host2'])
+        self.assertEqual({'host1'},
+                         self.index.get_hosts_with_physnet('phys1'))
+        self.assertIs(ch4, self.index.get_chassis_by_hostname('host2'))
+
+        self.listener(idl.ROW_DELETE, ch4)
+        self.assertNotIn('host2', self.index.get_hostname_and_physnets())
+        self.assertEqual(set(), self.index.get_hosts_with_physnet('phys3'))
+        self.assertIsNone(self.index.get_chassis_by_hostname('host2'))
+
+    def test_invalid_bridge_mappings(self):
+        self.listener(idl.ROW_CREATE, _fake_chassis('ch4', 'host4', 'phys3'))
+        self.assertEqual([],
+                         self.index.get_hostname_and_physnets()['host4'])
+
+    def test_gateway_weights(self):
+        self.assertEqual({'ch1': 1.0, 'ch2': 1.0, 'ch3': 1.0},
+                         self.index.get_gateway_weights())
+        self.chassis[0].external_ids['ovn-gateway-weight'] = '2.5'
+        self.listener(idl.ROW_UPDATE, self.chassis[0])
+        self.chassis[1].external_ids['ovn-gateway-weight'] = 'invalid'
+        self.listener(idl.ROW_UPDATE, self.chassis[1])
+        self.listener(idl.ROW_DELETE, self.chassis[2])
+        self.assertEqual({'ch1': 2.5, 'ch2': 1.0},
+                         self.index.get_gateway_weights())
+
+
+class TestOvsdbSbOvnIdlChassis(base.TestCase):
+
+    def setUp(self):
+        super(TestOvsdbSbOvnIdlChassis, self).setUp()
+        self.chassis = [_fake_chassis('ch1', 'host1', 'phys1:br1'),
+                        _fake_chassis('ch2', 'host2', 'phys2:br2')]
+        rows = dict((ch.uuid, ch) for ch in self.chassis)
+        cls = impl_idl_ovn.OvsdbSbOvnIdl
+        self.sb_idl = cls.__new__(cls)
+        self.sb_idl.idl = mock.Mock(tables={'Chassis': mock.Mock(rows=rows)})
+
+    def _test_chassis_queries(self):
+        self.assertEqual({'host2'},
+                         self.sb_idl.get_chassis_hosts_with_physnet('phys2'))
+        self.assertEqual({'host1': ['phys1'], 'host2': ['phys2']},
+                         self.sb_idl.get_chassis_hostname_and_physnets())
+        self.assertEqual(
+            ('system', ''),
+            self.sb_idl.get_chassis_datapath_and_iface_types('host1'))
+        self.assertEqual({'ch1': 1.0, 'ch2': 1.0},
+                         self.sb_idl.get_chassis_gateway_weights())
+
+    def test_chassis_queries(self):
+        with mock.patch.object(impl_idl_ovn.idlutils, 'row_by_value',
+                               return_value=self.chassis[0]):
+            self._test_chassis_queries()
+
+    def test_chassis_queries_index(self):
+        index = impl_idl_ovn.ChassisIndex(self.sb_idl.idl)
+        with mock.patch.object(impl_idl_ovn, 'get_chassis_index',
+                               return_value=index), \
+                mock.patch.object(impl_idl_ovn.idlutils,
+                                  'row_by_value') as row_by_value:
+            self._test_chassis_queries()
+            self.assertEqual(
+                (None, None),
+                self.sb_idl.get_chassis_datapath_and_iface_types('host3'))
+            row_by_value.assert_not_called()
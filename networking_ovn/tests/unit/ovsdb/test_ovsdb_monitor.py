@@ -12,15 +12,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import copy
+from eventlet import greenthread
 import mock
 import time
 import uuid
 
+from oslo_config import cfg
 from ovs.db import idl as ovs_idl
 
 from networking_ovn.common import config as ovn_config
+from networking_ovn.common import constants as ovn_const
 from networking_ovn.ovsdb import ovsdb_monitor
+from networking_ovn.tests import base
 from networking_ovn.tests.unit.ml2 import test_mech_driver
 from neutron import manager
 from neutron.plugins.common import constants as service_constants
@@ -69,6 +74,129 @@ OVN_SB_SCHEMA = {
 }
 
 
+class TestBaseOvnIdl(base.TestCase):
+
+    def setUp(self):
+        super(TestBaseOvnIdl, self).setUp()
+        self.idl = ovsdb_monitor.BaseOvnIdl.__new__(ovsdb_monitor.BaseOvnIdl)
+        self.idl.table_listeners = collections.defaultdict(list)
+
+    def test_notify_listeners(self):
+        listeners = [mock.Mock(side_effect=Exception), mock.Mock()]
+        for listener in listeners:
+            self.idl.add_table_listener('Logical_Router', listener)
+        other_listener = mock.Mock()
+        self.idl.add_table_listener('Logical_Switch', other_listener)
+        row = mock.Mock()
+        row._table.name = 'Logical_Router'
+        self.idl.notify('update', row, 'updates')
+        for listener in listeners:
+            listener.assert_called_once_with('update', row, 'updates')
+        other_listener.assert_not_called()
+
+
+class TestOvnDbNotifyHandler(base.TestCase):
+
+    def setUp(self):
+        super(TestOvnDbNotifyHandler, self).setUp()
+        self.handler = ovsdb_monitor.OvnDbNotifyHandler(mock.Mock())
+        self.mock_observe = mock.patch.object(ovsdb_monitor.metrics,
+                                              'observe').start()
+        self.match = mock.Mock(event_name='FakeEvent')
+        self.row = mock.Mock()
+        self.row.name = 'fake-name'
+
+    def test_run_event_metrics(self):
+        self.handler._run_event(self.match, 'update', self.row, None,
+                                time.time())
+        self.match.run.assert_called_once_with('update', self.row, None)
+        self.mock_observe.assert_has_calls(
+            [mock.call('ovn_event_queue_wait.FakeEvent', mock.ANY),
+             mock.call('ovn_event_handler_duration.FakeEvent', mock.ANY)])
+
+    def test_run_event_metrics_on_failure(self):
+        self.match.run.side_effect = Exception
+        self.assertRaises(Exception, self.handler._run_event, self.match,
+                          'update', self.row, None, time.time())
+        self.mock_observe.assert_called_with(
+            'ovn_event_handler_duration.FakeEvent', mock.ANY)
+
+    @mock.patch.object(ovsdb_monitor.LOG, 'warning')
+    def test_run_event_slow_handler(self, mock_warning):
+        cfg.CONF.set_override(
+            'ovn_event_handler_slow_threshold', 0.1, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ovn_event_handler_slow_threshold', 'ovn')
+        self.match.run.side_effect = lambda *args: greenthread.sleep(0.3)
+        self.handler._run_event(self.match, 'update', self.row, None,
+                                time.time())
+        # Logged by the watchdog while the handler runs and at the end
+        self.assertEqual(2, mock_warning.call_count)
+        self.assertIn('stack', mock_warning.call_args_list[0][0][1])
+
+    @mock.patch.object(ovsdb_monitor.LOG, 'warning')
+    def test_run_event_fast_handler(self, mock_warning):
+        self.handler._run_event(self.match, 'update', self.row, None,
+                                time.time())
+        mock_warning.assert_not_called()
+
+
+class TestPortActivationTracker(base.TestCase):
+
+    def setUp(self):
+        super(TestPortActivationTracker, self).setUp()
+        self.tracker = ovsdb_monitor.PortActivationTracker(2)
+        self.observe_patcher = mock.patch.object(ovsdb_monitor.metrics,
+                                                 'observe')
+        self.mock_observe = self.observe_patcher.start()
+
+    def test_port_up(self):
+        self.tracker.port_created('port1', time.time() - 1)
+        self.tracker.port_up('port1', time.time(), time.time())
+        self.assertEqual(
+            ['ovn_port_activation.nb_commit',
+             'ovn_port_activation.wait_for_up',
+             'ovn_port_activation.provisioning',
+             'ovn_port_activation.total'],
+            [c[0][0] for c in self.mock_observe.call_args_list])
+        # The time to commit the port is measured from its commit time
+        self.assertGreaterEqual(self.mock_observe.call_args_list[0][0][1],
+                                1)
+        # The port isn't tracked anymore
+        self.mock_observe.reset_mock()
+        self.tracker.port_up('port1', time.time(), time.time())
+        self.mock_observe.assert_not_called()
+
+    def test_port_up_not_tracked(self):
+        self.tracker.port_up('port1', time.time(), time.time())
+        self.mock_observe.assert_not_called()
+
+    def test_port_deleted(self):
+        self.tracker.port_created('port1')
+        self.tracker.port_deleted('port1')
+        self.tracker.port_up('port1', time.time(), time.time())
+        self.mock_observe.assert_not_called()
+
+    def test_max_ports(self):
+        for port in ('port1', 'port2', 'port3'):
+            self.tracker.port_created(port)
+        for port in ('port1', 'port2', 'port3'):
+            self.tracker.port_up(port, time.time(), time.time())
+        # port1 was dropped
+        self.assertEqual(8, self.mock_observe.call_count)
+
+    def test_percentiles(self):
+        self.observe_patcher.stop()
+        self.addCleanup(ovsdb_monitor.metrics.get_registry().reset)
+        self.tracker.port_created('port1')
+        self.tracker.port_up('port1', time.time(), time.time())
+        percentiles = self.tracker.percentiles()
+        self.assertEqual(
+            set(ovsdb_monitor.PortActivationTracker.PHASES) |
+            set(['queue_wait']), set(percentiles))
+        self.assertIsNotNone(percentiles['total'][50])
+
+
 class TestOvnIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
 
     def setUp(self):
@@ -159,6 +287,34 @@ class TestOvnIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
         self.assertFalse(self.driver.set_port_status_up.called)
         self.assertFalse(self.driver.set_port_status_down.called)
 
+    def test_lsp_up_update_event_port_activation(self):
+        self.addCleanup(ovsdb_monitor.metrics.get_registry().reset)
+        self.idl.post_initialize(self.driver)
+        tracker = self.idl.port_activation_tracker
+        tracker.port_up = mock.Mock(wraps=tracker.port_up)
+        self._test_lsp_helper('create', {"up": False, "name": "foo-name"})
+        self._test_lsp_helper('update', {"up": True, "name": "foo-name"},
+                              old_row_json={"up": False})
+        self.driver.set_port_status_up.assert_called_once_with("foo-name")
+        tracker.port_up.assert_called_once_with("foo-name", mock.ANY,
+                                                mock.ANY)
+        self.assertIsNotNone(tracker.percentiles()['total'][50])
+
+    def test_lsp_create_event_port_created_at(self):
+        self.idl.post_initialize(self.driver)
+        tracker = self.idl.port_activation_tracker
+        tracker.port_created = mock.Mock()
+        created_at = time.time() - 1
+        self._test_lsp_helper(
+            'create', {"up": False, "name": "foo-name",
+                       "external_ids": ["map", [
+                           [ovn_const.OVN_PORT_CREATED_AT_EXT_ID_KEY,
+                            '%.6f' % created_at]]]})
+        tracker.port_created.assert_called_once_with('foo-name', mock.ANY)
+        self.assertAlmostEqual(created_at,
+                               tracker.port_created.call_args[0][1],
+                               places=5)
+
     def test_lsp_other_column_update_event(self):
         new_row_json = {"up": False, "name": "foo-name",
                         "addresses": ["10.0.0.2"]}
@@ -189,6 +345,55 @@ class TestOvnIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
         self.idl.notify("create", mock.ANY)
         self.assertTrue(self.idl.notify_handler.notify.called)
 
+    def test_notify_event_shards(self):
+        self.idl.has_lock = False
+        self.idl.is_lock_contended = True
+        self.idl.event_shards = mock.Mock()
+        self.idl.event_shards.owns_row.return_value = True
+        self.idl.notify_handler.notify = mock.Mock()
+        self.idl.notify("create", mock.sentinel.row)
+        self.idl.event_shards.owns_row.assert_called_once_with(
+            mock.sentinel.row)
+        self.assertTrue(self.idl.notify_handler.notify.called)
+
+    def test_notify_event_shards_not_owned(self):
+        self.idl.event_shards = mock.Mock()
+        self.idl.event_shards.owns_row.return_value = False
+        self.idl.notify_handler.notify = mock.Mock()
+        self.idl.notify("create", mock.sentinel.row)
+        self.assertFalse(self.idl.notify_handler.notify.called)
+
+    def test_run_syncs_acquired_shards(self):
+        self.idl.event_shards = mock.Mock()
+        self.idl.event_shards.pop_acquired.return_value = [2]
+        with mock.patch.object(ovs_idl.Idl, 'run'), \
+                mock.patch.object(self.idl, 'sync_shards') as sync_shards:
+            self.idl.run()
+            sync_shards.assert_called_once_with([2])
+            sync_shards.reset_mock()
+            self.idl.event_shards.pop_acquired.return_value = []
+            self.idl.run()
+            sync_shards.assert_not_called()
+
+    def test_sync_shards(self):
+        rows = {}
+        for name, up in (('port-1', True), ('port-2', False),
+                         ('port-3', True)):
+            row_uuid = str(uuid.uuid4())
+            rows[row_uuid] = ovs_idl.Row.from_json(
+                self.idl, self.lp_table, row_uuid, {"up": up, "name": name})
+        self.lp_table.rows = rows
+        self.idl.event_shards = mock.Mock()
+        self.idl.event_shards.get_row_shard.side_effect = (
+            lambda row: 0 if row.name == 'port-3' else 1)
+        self.idl.notify_handler.queue = mock.Mock()
+        self.idl.sync_shards([1])
+        self.assertEqual(
+            [('port-1', 'LogicalSwitchPortCreateUpEvent'),
+             ('port-2', 'LogicalSwitchPortCreateDownEvent')],
+            sorted((call[0][2].name, call[0][0].event_name) for call
+                   in self.idl.notify_handler.queue.call_args_list))
+
 
 class TestOvnSbIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
 
@@ -203,12 +408,13 @@ class TestOvnSbIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
         self.sb_idl.has_lock = True
         self.sb_idl.post_initialize(self.driver)
         self.chassis_table = self.sb_idl.tables.get('Chassis')
-        self.driver.update_segment_host_mapping = mock.Mock()
+        self.driver.update_segment_host_mappings = mock.Mock()
         mgr = manager.NeutronManager.get_instance()
         self.l3_plugin = mgr.get_service_plugins().get(
             service_constants.L3_ROUTER_NAT)
         if ovn_config.is_ovn_l3():
             self.l3_plugin.schedule_unhosted_routers = mock.Mock()
+            self.l3_plugin.rebalance_routers = mock.Mock()
 
         self.row_json = {
             "name": "fake-name",
@@ -233,8 +439,8 @@ class TestOvnSbIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
 
     def test_chassis_create_event(self):
         self._test_chassis_helper('create', self.row_json)
-        self.driver.update_segment_host_mapping.assert_called_once_with(
-            'fake-hostname', ['fake-phynet1'])
+        self.driver.update_segment_host_mappings.assert_called_once_with(
+            {'fake-hostname': ['fake-phynet1']})
         if ovn_config.is_ovn_l3():
             self.assertEqual(
                 1,
@@ -242,8 +448,8 @@ class TestOvnSbIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
 
     def test_chassis_delete_event(self):
         self._test_chassis_helper('delete', self.row_json)
-        self.driver.update_segment_host_mapping.assert_called_once_with(
-            'fake-hostname', [])
+        self.driver.update_segment_host_mappings.assert_called_once_with(
+            {'fake-hostname': []})
         if ovn_config.is_ovn_l3():
             self.assertEqual(
                 1,
@@ -254,9 +460,101 @@ class TestOvnSbIdlNotifyHandler(test_mech_driver.OVNMechanismDriverTestCase):
         old_row_json['external_ids'][1][0][1] = (
             "fake-phynet2:fake-br2")
         self._test_chassis_helper('update', self.row_json, old_row_json)
-        self.driver.update_segment_host_mapping.assert_called_once_with(
-            'fake-hostname', ['fake-phynet1'])
+        self.driver.update_segment_host_mappings.assert_called_once_with(
+            {'fake-hostname': ['fake-phynet1']})
         if ovn_config.is_ovn_l3():
             self.assertEqual(
                 1,
                 self.l3_plugin.schedule_unhosted_routers.call_count)
+
+    def test_chassis_update_event_other_column(self):
+        old_row_json = copy.deepcopy(self.row_json)
+        old_row_json['external_ids'][1].append(["ovn-encap-ip", "1.1.1.1"])
+        self._test_chassis_helper('update', self.row_json, old_row_json)
+        self.driver.update_segment_host_mappings.assert_not_called()
+        if ovn_config.is_ovn_l3():
+            self.l3_plugin.schedule_unhosted_routers.assert_not_called()
+
+    def test_chassis_update_event_hostname(self):
+        old_row_json = {"hostname": "fake-hostname-old"}
+        self._test_chassis_helper('update', self.row_json, old_row_json)
+        self.driver.update_segment_host_mappings.assert_called_once_with(
+            {'fake-hostname-old': [], 'fake-hostname': ['fake-phynet1']})
+
+    def test_chassis_events_debounced(self):
+        event = self.sb_idl._chassis_event
+        table = self.chassis_table
+        with mock.patch.object(ovsdb_monitor.greenthread,
+                               'spawn_after') as spawn_after:
+            for i in range(3):
+                row_json = copy.deepcopy(self.row_json)
+                row_json['hostname'] = 'fake-hostname-%d' % i
+                row = ovs_idl.Row.from_json(self.sb_idl, table,
+                                            str(uuid.uuid4()), row_json)
+                event.run(event.ROW_CREATE, row, None)
+        spawn_after.assert_called_once_with(event.DEBOUNCE_INTERVAL,
+                                            event._flush)
+        self.driver.update_segment_host_mappings.assert_not_called()
+        event._flush()
+        # The mappings of all the hosts are updated at once
+        self.driver.update_segment_host_mappings.assert_called_once_with(
+            dict(('fake-hostname-%d' % i, ['fake-phynet1'])
+                 for i in range(3)))
+        if ovn_config.is_ovn_l3():
+            self.assertEqual(
+                1,
+                self.l3_plugin.schedule_unhosted_routers.call_count)
+
+    def test_chassis_create_event_rebalance(self):
+        cfg.CONF.set_override('ovn_l3_rebalance_on_chassis_join', True,
+                              'ovn')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ovn_l3_rebalance_on_chassis_join', 'ovn')
+        self._test_chassis_helper('create', self.row_json)
+        if ovn_config.is_ovn_l3():
+            self.l3_plugin.rebalance_routers.assert_called_once_with()
+
+    def test_sync_shards(self):
+        row_uuid = str(uuid.uuid4())
+        row = ovs_idl.Row.from_json(self.sb_idl, self.chassis_table,
+                                    row_uuid, self.row_json)
+        self.chassis_table.rows = {row_uuid: row}
+        self.sb_idl.notify_handler.queue = mock.Mock()
+        # The Chassis events are handled by the holder of the first shard
+        self.sb_idl.sync_shards([1, 2])
+        self.sb_idl.notify_handler.queue.assert_not_called()
+        self.sb_idl.sync_shards([0])
+        self.sb_idl.notify_handler.queue.assert_called_once_with(
+            self.sb_idl._chassis_event, 'update', row)
+
+    def test_rebalance_serialized(self):
+        event = ovsdb_monitor.ChassisEvent(self.driver)
+        event.l3_plugin = mock.Mock()
+        rebalance_routers = event.l3_plugin.rebalance_routers
+
+        def _rebalance_routers():
+            if rebalance_routers.call_count == 1:
+                # Requested while the first rebalancing runs
+                event._rebalance()
+                event._rebalance()
+
+        rebalance_routers.side_effect = _rebalance_routers
+        event._rebalance()
+        # The requests are coalesced into a single pass after the first
+        self.assertEqual(2, rebalance_routers.call_count)
+        self.assertFalse(event._rebalancing)
+
+    def test_chassis_update_event_no_rebalance(self):
+        cfg.CONF.set_override('ovn_l3_rebalance_on_chassis_join', True,
+                              'ovn')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ovn_l3_rebalance_on_chassis_join', 'ovn')
+        old_row_json = {"hostname": "fake-hostname-old"}
+        self._test_chassis_helper('update', self.row_json, old_row_json)
+        if ovn_config.is_ovn_l3():
+            self.l3_plugin.rebalance_routers.assert_not_called()
+
+    def test_chassis_create_event_rebalance_disabled(self):
+        self._test_chassis_helper('create', self.row_json)
+        if ovn_config.is_ovn_l3():
+            self.l3_plugin.rebalance_routers.assert_not_called()
@@ -0,0 +1,83 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from networking_ovn.ovsdb import schema
+from networking_ovn.tests import base
+from networking_ovn.tests.unit.ovsdb import test_ovsdb_monitor
+
+
+class TestGetTables(base.TestCase):
+
+    def test_get_tables_api(self):
+        tables = schema.get_tables(schema.OVN_NORTHBOUND,
+                                   schema.WORKER_ROLE_API)
+        self.assertEqual(schema.NB_API_TABLES, tables)
+        self.assertNotIn('up', tables['Logical_Switch_Port'])
+
+    def test_get_tables_ovn_worker(self):
+        tables = schema.get_tables(schema.OVN_NORTHBOUND,
+                                   schema.WORKER_ROLE_OVN)
+        self.assertIn('up', tables['Logical_Switch_Port'])
+        self.assertIn('name', tables['Logical_Switch_Port'])
+        # The module level definitions must not be modified
+        self.assertNotIn('up', schema.NB_API_TABLES['Logical_Switch_Port'])
+
+    def test_get_tables_sb(self):
+        for role in (schema.WORKER_ROLE_API, schema.WORKER_ROLE_OVN):
+            self.assertEqual(
+                {'Chassis': ['name', 'hostname', 'external_ids']},
+                schema.get_tables(schema.OVN_SOUTHBOUND, role))
+
+    def test_get_tables_unknown(self):
+        self.assertIsNone(schema.get_tables('Open_vSwitch',
+                                            schema.WORKER_ROLE_API))
+
+    def test_merge_tables_all_columns(self):
+        self.assertEqual(
+            {'Chassis': None, 'Encap': ['ip']},
+            schema._merge_tables({'Chassis': ['name'], 'Encap': ['ip']},
+                                 {'Chassis': None, 'Encap': ['ip']}))
+
+
+class TestRegisterTables(base.TestCase):
+
+    def setUp(self):
+        super(TestRegisterTables, self).setUp()
+        self.helper = mock.Mock(
+            schema_json=test_ovsdb_monitor.OVN_NB_SCHEMA)
+
+    def test_register_all(self):
+        schema.register_tables(self.helper)
+        self.helper.register_all.assert_called_once_with()
+        self.helper.register_table.assert_not_called()
+        self.helper.register_columns.assert_not_called()
+
+    def test_register_table_list(self):
+        schema.register_tables(self.helper, ['Logical_Switch'])
+        self.helper.register_table.assert_called_once_with('Logical_Switch')
+        self.helper.register_all.assert_not_called()
+
+    def test_register_columns(self):
+        schema.register_tables(
+            self.helper, {'Logical_Switch_Port': ['name', 'up',
+                                                  'dhcpv4_options'],
+                          'Logical_Switch': None})
+        self.helper.register_columns.assert_called_once_with(
+            'Logical_Switch_Port', ['name', 'up'])
+        self.helper.register_table.assert_called_once_with('Logical_Switch')
+
+    def test_register_missing_table(self):
+        schema.register_tables(self.helper, {'DHCP_Options': ['cidr']})
+        self.helper.register_table.assert_not_called()
+        self.helper.register_columns.assert_not_called()
@@ -0,0 +1,426 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from networking_ovn.ovsdb import commands as cmd
+from networking_ovn.ovsdb import transaction
+from networking_ovn.tests import base
+
+
+class FakeConnection(transaction.GroupCommitMixin):
+
+    def __init__(self):
+        super(FakeConnection, self).__init__()
+        self.idl = mock.Mock()
+        self.timeout = 10
+
+
+class TestTransactionBase(base.TestCase):
+
+    def setUp(self):
+        super(TestTransactionBase, self).setUp()
+        self.api = mock.Mock()
+        self.idl_txn = mock.Mock()
+        self.idl_txn.commit_block.return_value = self.idl_txn.SUCCESS
+        mock.patch.object(transaction.idl, 'Transaction',
+                          return_value=self.idl_txn).start()
+
+    def _txn(self, *results, **kwargs):
+        txn = transaction.Transaction(self.api, mock.Mock(), 10,
+                                      check_error=True, **kwargs)
+        for result in results:
+            txn.add(mock.Mock(result=result))
+        return txn
+
+
+class TestOptimizeCommands(base.TestCase):
+
+    def setUp(self):
+        super(TestOptimizeCommands, self).setUp()
+        self.api = mock.Mock()
+
+    def _update_addr_set(self, name, addrs_add, addrs_remove,
+                         if_exists=True):
+        return cmd.UpdateAddrSetCommand(self.api, name, addrs_add,
+                                        addrs_remove, if_exists)
+
+    def test_merge_addr_set_updates(self):
+        other = mock.Mock()
+        commands = [self._update_addr_set('as1', ['10.0.0.1'], None),
+                    other,
+                    self._update_addr_set('as2', ['10.0.0.2'], None),
+                    self._update_addr_set('as1', ['10.0.0.3'], ['10.0.0.1']),
+                    self._update_addr_set('as1', ['10.0.0.1', '10.0.0.4'],
+                                          ['10.0.0.5'])]
+        optimized = transaction.optimize_commands(commands)
+        self.assertEqual(3, len(optimized))
+        self.assertEqual('as1', optimized[0].name)
+        self.assertEqual(['10.0.0.3', '10.0.0.1', '10.0.0.4'],
+                         optimized[0].addrs_add)
+        self.assertEqual(['10.0.0.5'], optimized[0].addrs_remove)
+        self.assertEqual([other, commands[2]], optimized[1:])
+
+    def test_merge_addr_set_updates_if_exists(self):
+        commands = [self._update_addr_set('as1', ['10.0.0.1'], None),
+                    self._update_addr_set('as1', ['10.0.0.2'], None,
+                                          if_exists=False)]
+        self.assertEqual(commands, transaction.optimize_commands(commands))
+
+    def test_no_merge_across_other_command(self):
+        commands = [self._update_addr_set('as1', ['10.0.0.1'], None),
+                    cmd.DelAddrSetCommand(self.api, 'as1', True),
+                    self._update_addr_set('as1', ['10.0.0.2'], None)]
+        self.assertEqual(commands, transaction.optimize_commands(commands))
+
+    def test_cancel_add_delete(self):
+        commands = [cmd.AddLSwitchPortCommand(self.api, 'port1', 'ls1', True),
+                    cmd.AddAddrSetCommand(self.api, 'as1', True),
+                    cmd.DelLSwitchPortCommand(self.api, 'port1', 'ls1', False),
+                    cmd.DelAddrSetCommand(self.api, 'as1', False)]
+        self.assertEqual(commands[2:],
+                         transaction.optimize_commands(commands))
+        for command in commands[2:]:
+            self.assertTrue(command.if_exists)
+
+    def test_no_cancel(self):
+        commands = [cmd.AddLSwitchPortCommand(self.api, 'port1', 'ls1', True),
+                    cmd.SetLSwitchPortCommand(self.api, 'port1', True),
+                    cmd.DelLSwitchPortCommand(self.api, 'port1', 'ls1', False),
+                    cmd.AddAddrSetCommand(self.api, 'as1', False),
+                    cmd.DelAddrSetCommand(self.api, 'as1', False)]
+        self.assertEqual(commands, transaction.optimize_commands(commands))
+        self.assertFalse(commands[2].if_exists)
+
+    def test_transaction_results(self):
+        txn = transaction.Transaction(self.api, mock.Mock(), 10)
+        commands = [self._update_addr_set('as1', ['10.0.0.1'], None),
+                    self._update_addr_set('as1', ['10.0.0.2'], None),
+                    mock.Mock(result='foo')]
+        for command in commands:
+            txn.add(command)
+        txn.optimize()
+        self.assertEqual(2, len(txn.commands))
+        self.assertEqual([None, None, 'foo'], txn.get_results())
+
+
+class TestPartition(base.TestCase):
+
+    def setUp(self):
+        super(TestPartition, self).setUp()
+        self.api = mock.Mock()
+        self.connection = mock.Mock()
+        self.connection.queue_txn.side_effect = self._queue_txn
+        self.failed = set()
+        self.committed = []
+
+    def _queue_txn(self, txn):
+        names = [command.name for command in txn.commands]
+        self.committed.append(names)
+        if self.failed.intersection(names):
+            txn.results.put(transaction.idlutils.ExceptionResult(
+                ex=RuntimeError('fail'), tb=''))
+        else:
+            txn.results.put(txn.get_results())
+
+    def _txn(self, commands, check_error=True):
+        txn = transaction.Transaction(self.api, self.connection, 10,
+                                      check_error=check_error,
+                                      log_errors=False)
+        for command in commands:
+            txn.add(command)
+        return txn
+
+    def _update_addr_set(self, name, count):
+        return cmd.UpdateAddrSetCommand(
+            self.api, name, ['10.0.0.%d' % i for i in range(count)], None,
+            True)
+
+    def _set_max_size(self, max_size):
+        cfg.CONF.set_override('ovn_txn_max_size', max_size, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_txn_max_size', 'ovn')
+
+    def test_partition(self):
+        txn = self._txn([self._update_addr_set('as1', 3),
+                         self._update_addr_set('as2', 1),
+                         self._update_addr_set('as3', 1)])
+        parts = txn.partition(2)
+        self.assertEqual([['as1'], ['as1', 'as2'], ['as3']],
+                         [[command.name for command in part]
+                          for part in parts])
+        self.assertIsNone(txn.partition(5))
+        self.assertIsNone(txn.partition(0))
+
+    def test_partition_not_partitionable(self):
+        txn = self._txn([self._update_addr_set('as1', 3),
+                         cmd.DelAddrSetCommand(self.api, 'as2', True)])
+        self.assertIsNone(txn.partition(2))
+
+    def test_commit_split(self):
+        self._set_max_size(2)
+        self._txn([self._update_addr_set('as1', 3),
+                   self._update_addr_set('as2', 1)]).commit()
+        self.assertEqual([['as1'], ['as1', 'as2']], self.committed)
+
+    def test_commit_split_failure(self):
+        self._set_max_size(2)
+        self.failed.add('as1')
+        txn = self._txn([self._update_addr_set('as1', 4),
+                         self._update_addr_set('as2', 2)])
+        ex = self.assertRaises(transaction.PartialCommitError, txn.commit)
+        # The failure of a part doesn't prevent the others to be committed
+        self.assertEqual([['as1'], ['as1'], ['as2']], self.committed)
+        self.assertEqual([0, 1], sorted(ex.errors))
+
+    def test_commit_split_failure_no_check_error(self):
+        self._set_max_size(2)
+        self.failed.add('as1')
+        txn = self._txn([self._update_addr_set('as1', 4)], check_error=False)
+        self.assertEqual([None], txn.commit())
+
+    def test_commit_not_split(self):
+        self._set_max_size(10)
+        self._txn([self._update_addr_set('as1', 3),
+                   self._update_addr_set('as2', 1)]).commit()
+        self.assertEqual([['as1', 'as2']], self.committed)
+
+
+class TestTransactionQueue(TestTransactionBase):
+
+    def setUp(self):
+        super(TestTransactionQueue, self).setUp()
+        self.queue = transaction.TransactionQueue(10)
+
+    def test_get_group(self):
+        txns = [self._txn(), self._txn(groupable=False), self._txn(),
+                self._txn()]
+        for txn in txns:
+            self.queue.put(txn)
+        self.assertEqual([txns[0], txns[2]], self.queue.get_group(2))
+        self.assertEqual([txns[1]], self.queue.get_group(2))
+        self.assertEqual([txns[3]], self.queue.get_group(2))
+        self.assertEqual([], self.queue.get_group(2))
+
+    def test_get_group_not_groupable(self):
+        txns = [self._txn(groupable=False), self._txn()]
+        for txn in txns:
+            self.queue.put(txn)
+        self.assertEqual([txns[0]], self.queue.get_group(10))
+        self.assertEqual([txns[1]], self.queue.get_group(10))
+
+    def test_get_group_interactive_first(self):
+        background = self._txn(priority=transaction.PRIORITY_BACKGROUND)
+        interactive = [self._txn(), self._txn()]
+        self.queue.put(background)
+        for txn in interactive:
+            self.queue.put(txn)
+        # The transactions of different priorities aren't grouped
+        self.assertEqual(interactive, self.queue.get_group(10))
+        self.assertEqual([background], self.queue.get_group(10))
+        self.assertEqual([], self.queue.get_group(10))
+
+    def test_get_group_background_not_starved(self):
+        self.queue.INTERACTIVE_STREAK = 1
+        background = self._txn(priority=transaction.PRIORITY_BACKGROUND)
+        interactive = [self._txn(groupable=False), self._txn()]
+        self.queue.put(background)
+        for txn in interactive:
+            self.queue.put(txn)
+        self.assertEqual([interactive[0]], self.queue.get_group(10))
+        self.assertEqual([background], self.queue.get_group(10))
+        self.assertEqual([interactive[1]], self.queue.get_group(10))
+
+    @mock.patch.object(transaction.time, 'time', return_value=100)
+    def test_get_group_background_rate_limited(self, mock_time):
+        queue = transaction.TransactionQueue(10, background_rate=2)
+        txns = [self._txn(priority=transaction.PRIORITY_BACKGROUND)
+                for i in range(3)]
+        for txn in txns:
+            queue.put(txn)
+        self.assertEqual(txns[:2], queue.get_group(10))
+        self.assertEqual([], queue.get_group(10))
+        self.assertAlmostEqual(0.5, queue.background_wait_time())
+        mock_time.return_value = 100.5
+        self.assertEqual(0, queue.background_wait_time())
+        self.assertEqual(txns[2:], queue.get_group(10))
+
+    def test_put_interactive_with_background_backlog(self):
+        queue = transaction.TransactionQueue(2, background_rate=1)
+        for i in range(2):
+            queue.put(self._txn(priority=transaction.PRIORITY_BACKGROUND))
+        self.assertRaises(transaction.queue.Full, queue.put,
+                          self._txn(priority=transaction.PRIORITY_BACKGROUND),
+                          block=False)
+        # The rate limited background transactions don't use the room of
+        # the interactive ones
+        interactive = [self._txn(groupable=False), self._txn()]
+        for txn in interactive:
+            queue.put(txn, block=False)
+        self.assertRaises(transaction.queue.Full, queue.put, self._txn(),
+                          block=False)
+        self.assertEqual([interactive[0]], queue.get_group(10))
+        self.assertEqual([interactive[1]], queue.get_group(10))
+
+
+class TestPriority(TestTransactionBase):
+
+    def test_background(self):
+        self.assertEqual(transaction.PRIORITY_INTERACTIVE,
+                         self._txn().priority)
+        with transaction.background():
+            self.assertEqual(transaction.PRIORITY_BACKGROUND,
+                             self._txn().priority)
+            with transaction.background():
+                pass
+            self.assertEqual(transaction.PRIORITY_BACKGROUND,
+                             transaction.get_current_priority())
+        self.assertEqual(transaction.PRIORITY_INTERACTIVE,
+                         self._txn().priority)
+
+    def test_priority_argument(self):
+        txn = self._txn(priority=transaction.PRIORITY_BACKGROUND)
+        self.assertEqual(transaction.PRIORITY_BACKGROUND, txn.priority)
+
+
+class TestRateLimiter(base.TestCase):
+
+    @mock.patch.object(transaction.time, 'time', return_value=100)
+    def test_rate_limiter(self, mock_time):
+        limiter = transaction.RateLimiter(10, burst=2)
+        self.assertEqual(2, limiter.available())
+        limiter.consume(2)
+        self.assertEqual(0, limiter.available())
+        self.assertAlmostEqual(0.1, limiter.wait_time())
+        mock_time.return_value = 100.1
+        self.assertEqual(1, limiter.available())
+        self.assertEqual(0, limiter.wait_time())
+        mock_time.return_value = 200
+        self.assertEqual(2, limiter.available())
+
+    def test_no_limit(self):
+        limiter = transaction.RateLimiter(0)
+        limiter.consume(100)
+        self.assertEqual(float('inf'), limiter.available())
+        self.assertEqual(0, limiter.wait_time())
+
+
+class TestCommitGroup(TestTransactionBase):
+
+    def test_commit_group(self):
+        txns = [self._txn(1, 2), self._txn(3)]
+        self.assertEqual([[1, 2], [3]],
+                         transaction.commit_group(self.api.idl, txns, 10))
+        self.idl_txn.commit_block.assert_called_once_with()
+        for txn in txns:
+            for command in txn.commands:
+                command.run_idl.assert_called_once_with(self.idl_txn)
+                command.post_commit.assert_called_once_with(self.idl_txn)
+
+    def test_commit_group_command_failure(self):
+        txns = [self._txn(1), self._txn(2)]
+        txns[1].commands[0].run_idl.side_effect = RuntimeError
+        self.assertIsNone(transaction.commit_group(self.api.idl, txns, 10))
+        self.idl_txn.abort.assert_called_once_with()
+        self.idl_txn.commit_block.assert_not_called()
+
+    def test_commit_group_error(self):
+        self.idl_txn.commit_block.return_value = self.idl_txn.ERROR
+        txns = [self._txn(1), self._txn(2)]
+        self.assertIsNone(transaction.commit_group(self.api.idl, txns, 10))
+        txns[0].commands[0].post_commit.assert_not_called()
+
+
+class TestGroupCommitMixin(TestTransactionBase):
+
+    def setUp(self):
+        super(TestGroupCommitMixin, self).setUp()
+        self.connection = FakeConnection()
+
+    def test_commit_txns(self):
+        txns = [self._txn(1), self._txn(2)]
+        self.connection.commit_txns(txns)
+        self.idl_txn.commit_block.assert_called_once_with()
+        self.assertEqual([1], txns[0].results.get_nowait())
+        self.assertEqual([2], txns[1].results.get_nowait())
+
+    def test_commit_txns_separately(self):
+        txns = [self._txn(1), self._txn(2)]
+        with mock.patch.object(transaction, 'commit_group',
+                               return_value=None), \
+                mock.patch.object(txns[0], 'do_commit',
+                                  side_effect=RuntimeError), \
+                mock.patch.object(txns[1], 'do_commit', return_value=[2]):
+            self.connection.commit_txns(txns)
+        self.assertIsInstance(txns[0].results.get_nowait(),
+                              transaction.idlutils.ExceptionResult)
+        self.assertEqual([2], txns[1].results.get_nowait())
+
+    def test_commit_txns_timings(self):
+        txns = [self._txn(1), self._txn(2)]
+        with mock.patch.object(transaction.metrics, 'observe') as observe:
+            self.connection.commit_txns(txns)
+        observed = [call[0][0] for call in observe.call_args_list]
+        self.assertEqual(2, observed.count('ovn_txn_queue_wait.interactive'))
+        self.assertEqual(2, observed.count('ovn_txn_command.Mock'))
+        self.assertEqual(2, observed.count('ovn_txn_commit'))
+
+
+class TestDoCommit(TestTransactionBase):
+
+    def test_do_commit(self):
+        txn = self._txn(1, 2)
+        self.assertEqual([1, 2], txn.do_commit())
+        for command in txn.commands:
+            command.run_idl.assert_called_once_with(self.idl_txn)
+            command.post_commit.assert_called_once_with(self.idl_txn)
+        self.assertEqual(['Mock'], list(txn.timings.commands))
+        self.assertEqual(0, txn.timings.retries)
+
+    @mock.patch.object(transaction.idlutils, 'wait_for_change')
+    def test_do_commit_try_again(self, mock_wait):
+        self.idl_txn.commit_block.side_effect = [self.idl_txn.TRY_AGAIN,
+                                                 self.idl_txn.SUCCESS]
+        txn = self._txn(1)
+        self.assertEqual([1], txn.do_commit())
+        self.assertEqual(1, txn.timings.retries)
+        self.assertEqual(2, txn.commands[0].run_idl.call_count)
+        self.assertEqual(1, mock_wait.call_count)
+
+    def test_do_commit_error(self):
+        self.idl_txn.commit_block.return_value = self.idl_txn.ERROR
+        self.assertRaises(RuntimeError, self._txn(1).do_commit)
+
+    def test_do_commit_command_failure(self):
+        txn = self._txn(1)
+        txn.commands[0].run_idl.side_effect = ValueError
+        self.assertRaises(ValueError, txn.do_commit)
+        self.idl_txn.abort.assert_called_once_with()
+        txn.check_error = False
+        self.assertIsNone(txn.do_commit())
+        self.idl_txn.commit_block.assert_not_called()
+
+    def test_commit_slow(self):
+        cfg.CONF.set_override('ovn_txn_slow_threshold', 5, 'ovn')
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_txn_slow_threshold',
+                        'ovn')
+        connection = mock.Mock()
+        txn = transaction.Transaction(self.api, connection, 10)
+        txn.add(mock.Mock(spec=['api', 'result'], result=1))
+        connection.queue_txn.side_effect = (
+            lambda txn: txn.results.put(txn.get_results()))
+        with mock.patch.object(transaction.time, 'time',
+                               side_effect=[100, 110]), \
+                mock.patch.object(transaction.LOG, 'warning') as warning:
+            self.assertEqual([1], txn.commit())
+        self.assertEqual(1, warning.call_count)
+        self.assertEqual(10, warning.call_args[0][1]['time'])
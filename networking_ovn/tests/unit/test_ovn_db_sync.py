@@ -15,6 +15,7 @@
 import mock
 
 from networking_ovn.common import constants as ovn_const
+from networking_ovn.common import utils
 from networking_ovn import ovn_db_sync
 from networking_ovn.tests.unit.ml2 import test_mech_driver
 
@@ -282,9 +283,10 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
         l3_plugin._get_sync_interfaces = mock.Mock()
         l3_plugin._get_sync_interfaces.return_value = (
             self.get_sync_router_ports)
-        l3_plugin.get_networks_for_lrouter_port = mock.Mock()
-        l3_plugin.get_networks_for_lrouter_port.return_value = (
-            self.lrport_networks)
+        l3_plugin.get_networks_for_lrouter_ports = mock.Mock()
+        l3_plugin.get_networks_for_lrouter_ports.side_effect = (
+            lambda ctx, ports: dict((port['id'], self.lrport_networks)
+                                    for port in ports))
         # end of router-sync block
 
         ovn_api.get_all_logical_switches_with_ports = mock.Mock()
@@ -310,8 +312,7 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
         l3_plugin.update_lrouter_port_in_ovn = mock.Mock()
         ovn_api.delete_lrouter = mock.Mock()
         ovn_api.delete_lrouter_port = mock.Mock()
-        ovn_api.add_static_route = mock.Mock()
-        ovn_api.delete_static_route = mock.Mock()
+        ovn_api.update_static_routes = mock.Mock()
         ovn_api.get_all_dhcp_options.return_value = {
             'subnets': {'n1-s1': {'cidr': '10.0.0.0/24',
                                   'options':
@@ -421,11 +422,20 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
         ovn_api.delete_lswitch_port.assert_has_calls(
             delete_lswitch_port_calls, any_order=True)
 
-        self.assertEqual(len(add_static_route_list),
-                         ovn_api.add_static_route.call_count)
-
-        self.assertEqual(len(del_static_route_list),
-                         ovn_api.delete_static_route.call_count)
+        # The routes of each router are updated with a single command
+        update_static_routes_calls = (
+            ovn_api.update_static_routes.call_args_list)
+        self.assertEqual(
+            len(set(call[0][0] for call in update_static_routes_calls)),
+            len(update_static_routes_calls))
+        self.assertEqual(
+            sorted(utils.get_static_route_keys(add_static_route_list)),
+            sorted(route for call in update_static_routes_calls
+                   for route in call[1]['add_routes']))
+        self.assertEqual(
+            sorted(utils.get_static_route_keys(del_static_route_list)),
+            sorted(route for call in update_static_routes_calls
+                   for route in call[1]['del_routes']))
 
         create_router_calls = [mock.call(r)
                                for r in create_router_list]
@@ -630,22 +640,9 @@ class TestOvnSbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
         ovn_api.get_chassis_hostname_and_physnets.return_value = (
             hostname_with_physnets)
         ovn_driver = ovn_sb_synchronizer.ovn_driver
-        ovn_driver.update_segment_host_mapping = mock.Mock()
-        hosts_in_neutron = {'hostname2', 'hostname3'}
-
-        with mock.patch.object(ovn_db_sync.segments_db,
-                               'get_hosts_mapped_with_segments',
-                               return_value=hosts_in_neutron):
-            ovn_sb_synchronizer.sync_hostname_and_physical_networks(mock.ANY)
-            all_hosts = set(hostname_with_physnets.keys()) | hosts_in_neutron
-            self.assertEqual(
-                len(all_hosts),
-                ovn_driver.update_segment_host_mapping.call_count)
-            update_segment_host_mapping_calls = [mock.call(
-                host, hostname_with_physnets[host])
-                for host in hostname_with_physnets]
-            update_segment_host_mapping_calls += [
-                mock.call(host, []) for host in
-                hosts_in_neutron - set(hostname_with_physnets.keys())]
-            ovn_driver.update_segment_host_mapping.assert_has_calls(
-                update_segment_host_mapping_calls, any_order=True)
+        ovn_driver.update_segment_host_mappings = mock.Mock()
+
+        ovn_sb_synchronizer.sync_hostname_and_physical_networks(mock.ANY)
+        # The stale hosts are cleared with the same update
+        ovn_driver.update_segment_host_mappings.assert_called_once_with(
+            hostname_with_physnets, all_hosts=True)